@@ -0,0 +1,1029 @@
+"""
+Timing runs for the slow parts of compiling stats. They run off of data that was already scraped and saved. The ones that
+touch the db (copy_formats, skater_on_ice, team_goalie_scan, aggregate_engines) roll back everything they do.
+
+Ex: python benchmarks.py toi_workers shifts_2017.csv 8
+    python benchmarks.py toi_equivalence shifts_2017.csv
+    python benchmarks.py toi_check  (a made up game w/ OT, a pulled goalie and 2x2 -> no db or csv needed)
+    python benchmarks.py copy_formats pbp_2017.csv
+    python benchmarks.py skater_on_ice  (runs off of the pbp table that's in the db)
+    python benchmarks.py team_goalie_scan  (same)
+    python benchmarks.py aggregate_engines  (runs off of the pbp, player_toi and team_toi tables in the db)
+    python benchmarks.py aggregate_engines fixture  (made up games -> only needs a db to connect to)
+    python benchmarks.py player_fetch 200  (runs against a stub people api on localhost)
+"""
+import io
+import json
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pandas as pd
+import psycopg2
+
+from compile_stats import aggregate_frames, aggregate_stats, compile_toi, on_ice
+from compile_stats import push_to_db as ptd
+from nhl_players import player_registry, process_players
+
+
+def print_timings(timings):
+    """
+    Print the time for each run and the speedup over the first one
+
+    :param timings: dict of run -> seconds
+    """
+    base = list(timings.values())[0]
+    for run, seconds in timings.items():
+        print("{}: {:.2f}s ({:.2f}x)".format(run, seconds, base / seconds))
+
+
+def toi_workers(shifts_df, max_workers):
+    """
+    Time the TOI for the same games with 1 to max_workers processes
+
+    :param shifts_df: DataFrame of shifts (with positions) -> In compile_toi.SHIFT_DTYPES
+    :param max_workers: Most processes to try
+
+    :return: dict of workers -> seconds
+    """
+    timings = dict()
+    for workers in range(1, max_workers + 1):
+        start = time.time()
+        compile_toi.process_games(shifts_df, workers=workers)
+        timings["{} workers".format(workers)] = time.time() - start
+
+    print_timings(timings)
+
+    return timings
+
+
+def toi_by_second(game_df):
+    """
+    TOI for one game the way compile_toi used to do it (before stints) -> Every second of the game gets who was on the
+    ice and the TOI is counted up one second at a time. Only kept around to check compile_toi against.
+
+    :param game_df: DataFrame of shifts for one game (with positions)
+
+    :return: list of player rows, list of team rows -> Columns are compile_toi.PLAYER_COLUMNS and TEAM_COLUMNS. Every
+             strength and empty net gets a row (even with no TOI) like it used to.
+    """
+    game_df = game_df.sort_values(by=['period', 'end']).reset_index(drop=True)
+    game_id, date = game_df.iloc[0]['game_id'], game_df.iloc[0]['date']
+    last_period, last_end = int(game_df['period'].iloc[-1]), int(game_df['end'].iloc[-1])
+
+    # Length of the game -> 3 periods of 1201 seconds, plus OT and for the playoffs any extra periods
+    length = 1201 * 3
+    if last_period == 4:
+        length += last_end + 1
+    if int(game_id) >= 30000:
+        length += 1201 * max(last_period - 4, 0) + last_end + 1
+
+    teams = list(set(game_df['team'].tolist()))
+    players = {team: dict() for team in teams}
+    for p in set(zip(game_df['player'], game_df['player_id'], game_df['position'], game_df['team'])):
+        players[p[3]][str(p[1])] = p
+
+    # Who is on for each second -> A player isn't on for the second he gets off
+    on_ice = [{team: {'Skaters': set(), 'Goalies': set()} for team in teams} for _ in range(length)]
+    for shift in game_df.to_dict('records'):
+        offset = 1200 * (int(shift['period']) - 1)
+        kind = 'Goalies' if shift['position'] == 'G' else 'Skaters'
+        for x in range(int(shift['start']) + offset, min(int(shift['end']) + offset, length)):
+            on_ice[x][shift['team']][kind].add(str(shift['player_id']))
+
+    buckets = [(strength, empty) for strength in compile_toi.strengths for empty in [1, 0]]
+    player_toi = {(team, key): {bucket: [0, 0] for bucket in buckets} for team in teams for key in players[team]}
+    team_toi = {team: {bucket: 0 for bucket in buckets} for team in teams}
+
+    for second in on_ice:
+        if_empty = int(any(len(second[team]['Goalies']) == 0 for team in teams))
+        for team in teams:
+            other = [t for t in teams if t != team][0]
+            strength = 'x'.join([str(len(second[team]['Skaters'])), str(len(second[other]['Skaters']))])
+
+            # Don't bother if it's a shootout...any other strength not approved goes to misc.
+            if strength in ['1x1', '0x0', '1x0', '0x1']:
+                break
+            if strength not in compile_toi.strengths:
+                strength = '2x2'
+
+            for key, p in players[team].items():
+                on = key in second[team]['Goalies' if p[2] == 'G' else 'Skaters']
+                player_toi[(team, key)][(strength, if_empty)][0 if on else 1] += 1
+
+            team_toi[team][(strength, if_empty)] += 1
+
+    player_rows, team_rows = [], []
+    for team in teams:
+        fixed_team = compile_toi.TEAMS.get(team, team)
+        for key, p in players[team].items():
+            for (strength, if_empty), (toi_on, toi_off) in player_toi[(team, key)].items():
+                player_rows.append((p[0], p[1], p[2], game_id, date, fixed_team, strength, if_empty, toi_on, toi_off))
+        for (strength, if_empty), toi in team_toi[team].items():
+            team_rows.append((team, game_id, date, strength, if_empty, toi))
+
+    return player_rows, team_rows
+
+
+def compare_toi(old_rows, new_rows):
+    """
+    Check compile_toi gives the same rows as toi_by_second. The old way has a row for every strength and empty net,
+    even with no TOI, and compile_toi only has the ones that were played at. So every row compile_toi has has to match
+    and the rows it doesn't have all have to be 0.
+
+    :param old_rows: [player rows, team rows] from toi_by_second
+    :param new_rows: [player rows, team rows] from compile_toi
+
+    :return: None
+    """
+    tables = [('player', compile_toi.PLAYER_COLUMNS, ['toi_on', 'toi_off']), ('team', compile_toi.TEAM_COLUMNS, ['toi'])]
+    for i, (table, columns, toi_columns) in enumerate(tables):
+        keys = columns[:-len(toi_columns)]
+        frames = []
+        for rows in [old_rows, new_rows]:
+            df = pd.DataFrame(rows[i], columns=columns).astype({'game_id': int, 'if_empty': int})
+            df = df.astype({col: int for col in toi_columns})
+            if table == 'player':
+                df['player_id'] = df['player_id'].astype(float)
+            frames.append(df.astype({col: str for col in keys if df[col].dtype.name == 'category'}))
+
+        merged = frames[0].merge(frames[1], on=keys, how='outer', suffixes=('_old', '_new'), indicator=True)
+        assert (merged._merge != 'right_only').all(), "compile_toi has {} rows that weren't there before".format(table)
+
+        dropped = merged[merged._merge == 'left_only']
+        assert (dropped[[col + '_old' for col in toi_columns]].values == 0).all(), \
+            "compile_toi is missing {} rows with TOI".format(table)
+
+        kept = merged[merged._merge == 'both']
+        for col in toi_columns:
+            diff = kept[kept[col + '_old'] != kept[col + '_new']]
+            assert diff.empty, "{} {} isn't the same:\n{}".format(table, col, diff[keys + [col + '_old', col + '_new']])
+
+        print("Same {} {} rows both ways ({} rows with no TOI aren't made anymore)"
+              .format(kept.shape[0], table, dropped.shape[0]))
+
+
+def toi_equivalence(shifts_df):
+    """
+    Time the TOI the old way (toi_by_second) and with compile_toi and check they give the same rows (see compare_toi).
+
+    :param shifts_df: DataFrame of shifts (with positions) -> In compile_toi.SHIFT_DTYPES
+
+    :return: dict of run -> seconds
+    """
+    timings, rows = dict(), dict()
+
+    start = time.time()
+    rows['by second'] = [[], []]
+    for game, game_df in shifts_df.groupby('game_id', sort=True):
+        game_players, game_teams = toi_by_second(game_df)
+        rows['by second'][0].extend(game_players)
+        rows['by second'][1].extend(game_teams)
+    timings['by second'] = time.time() - start
+
+    start = time.time()
+    rows['stints'] = compile_toi.process_games(shifts_df)[:2]
+    timings['stints'] = time.time() - start
+
+    print_timings(timings)
+    compare_toi(rows['by second'], rows['stints'])
+
+    return timings
+
+
+def toi_fixture():
+    """
+    A small made up game to check the TOI on without needing any scraped shifts. Regular season game that went to OT.
+    TBL (home) pulls their goalie for the last minute of the 3rd (6x5 w/ an empty net) and PIT has 3 guys in the box at
+    once for 20 seconds in the 1st (5x2 -> goes to misc. as 2x2). OT is 3x3 and ends 150 seconds in.
+
+    :return: DataFrame of shifts -> In compile_toi.SHIFT_DTYPES
+    """
+    shifts = []
+
+    def add(team, player_id, position, period, start, end):
+        shifts.append((20001, '2017-10-10', period, team, 'P{}'.format(player_id), player_id, position, start, end,
+                       end - start))
+
+    for team, base in [('TBL', 100), ('PIT', 200)]:
+        goalie, skaters = base, [base + i for i in range(1, 6)]
+        for period in [1, 2, 3]:
+            # Goalie is pulled w/ a minute left in the 3rd for TBL
+            add(team, goalie, 'G', period, 0, 1140 if (team == 'TBL' and period == 3) else 1200)
+            for i, skater in enumerate(skaters):
+                position = 'C' if i < 3 else 'D'
+                # 3 of the PIT guys are in the box from 500 to 520 in the 1st
+                if team == 'PIT' and period == 1 and i >= 2:
+                    add(team, skater, position, period, 0, 500)
+                    add(team, skater, position, period, 520, 1200)
+                else:
+                    add(team, skater, position, period, 0, 1200)
+        add(team, goalie, 'G', 4, 0, 150)
+        for skater in skaters[:3]:
+            add(team, skater, 'C', 4, 0, 150)
+
+    # The extra skater for TBL
+    add('TBL', 106, 'C', 3, 1140, 1200)
+
+    return compile_toi.compact_shifts(pd.DataFrame(shifts, columns=list(compile_toi.SHIFT_DTYPES)))
+
+
+def toi_check():
+    """
+    Check the TOI for toi_fixture. Both ways have to give what it should be (worked out by hand) and compile_toi has to
+    give the same rows as toi_by_second (see compare_toi). Doesn't need the db.
+
+    :return: None
+    """
+    shifts_df = toi_fixture()
+    old_rows = toi_by_second(shifts_df)
+    new_rows = compile_toi.process_games(shifts_df)[:2]
+
+    # (team, strength, if_empty) -> toi
+    team_toi = {('TBL', '5x5', 0): 3520, ('TBL', '2x2', 0): 20, ('TBL', '6x5', 1): 60, ('TBL', '3x3', 0): 150,
+                ('PIT', '5x5', 0): 3520, ('PIT', '2x2', 0): 20, ('PIT', '5x6', 1): 60, ('PIT', '3x3', 0): 150}
+
+    # (player_id, strength, if_empty) -> (toi_on, toi_off) -> Player rows have 'T.B' (see compile_toi.TEAMS)
+    player_toi = {(101, '5x5', 0): (3520, 0), (101, '2x2', 0): (20, 0), (101, '6x5', 1): (60, 0),
+                  (101, '3x3', 0): (150, 0), (104, '3x3', 0): (0, 150), (106, '5x5', 0): (0, 3520),
+                  (106, '6x5', 1): (60, 0), (100, '6x5', 1): (0, 60), (100, '3x3', 0): (150, 0),
+                  (203, '2x2', 0): (0, 20), (203, '5x6', 1): (60, 0), (204, '3x3', 0): (0, 150),
+                  (200, '5x6', 1): (60, 0)}
+
+    for run, (players, teams) in [('by second', old_rows), ('compile_toi', new_rows)]:
+        teams = {(row[0], row[3], row[4]): row[5] for row in teams}
+        players = {(int(row[1]), row[6], row[7]): (row[8], row[9]) for row in players if row[5] in ['T.B', 'PIT']}
+        for key, toi in team_toi.items():
+            assert teams.get(key) == toi, "{}: team {} should be {} not {}".format(run, key, toi, teams.get(key))
+        for key, toi in player_toi.items():
+            assert players.get(key) == toi, "{}: player {} should be {} not {}".format(run, key, toi, players.get(key))
+
+    # compile_toi only has rows for what was played at
+    assert len(new_rows[1]) == len(team_toi), "compile_toi has team rows for strengths that weren't played at"
+
+    compare_toi(old_rows, new_rows)
+    print("TOI for the fixture is right both ways")
+
+
+def copy_formats(pbp_df):
+    """
+    Time loading the pbp with a csv COPY and a binary COPY. Both the time to encode it and the time to encode and load
+    it are done (into a table that gets rolled back).
+
+    :param pbp_df: DataFrame of pbp (ex: a full season)
+
+    :return: dict of run -> seconds
+    """
+    pbp_df = ptd.fix_pbp_df(pbp_df)
+    spec = [(col, pg_type) for col, pg_type in ptd.PBP_SPEC if col in pbp_df.columns]
+
+    conn = psycopg2.connect(host=ptd.HOST, database="nhl_data", user=ptd.USERNAME, password=ptd.PASSWORD)
+    cur = conn.cursor()
+    ptd.create_table(cur, 'pbp_copy_bench', ptd.PBP_SPEC)
+
+    timings = dict()
+    for copy_format, run_spec in [('csv', None), ('binary', spec)]:
+        start = time.time()
+        for i in range(0, pbp_df.shape[0], ptd.CHUNK_SIZE):
+            chunk = pbp_df.iloc[i:i + ptd.CHUNK_SIZE]
+            if run_spec is None:
+                chunk.to_csv(index=False, header=False)
+            else:
+                ptd.binary_copy.encode(chunk, run_spec)
+        timings["{} encode".format(copy_format)] = time.time() - start
+
+        cur.execute("TRUNCATE pbp_copy_bench")
+        start = time.time()
+        ptd.copy_df(cur, pbp_df, ['pbp_copy_bench'], run_spec)
+        timings["{} encode + COPY".format(copy_format)] = time.time() - start
+
+    conn.rollback()
+    conn.close()
+
+    print_timings(timings)
+
+    return timings
+
+
+def on_ice_slot_loops(cur):
+    """
+    The old way of getting the on-ice numbers for skaters (before aggregate_stats.add_on_ice_stats). Each of the 12
+    player columns was it's own scan of pbp. It's kept here to check the new one against.
+
+    :param cur: cursor
+
+    :return: None
+    """
+    for x in range(1, 7):
+        players = [''.join(['homeplayer', str(x)]),
+                   ''.join(['homeplayer', str(x), '_id']),
+                   ''.join(['awayplayer', str(x)]),
+                   ''.join(['awayplayer', str(x), '_id'])
+                   ]
+
+        commands = (
+
+            """
+            DROP TABLE IF EXISTS home;
+            CREATE TABLE home
+            AS
+            SELECT 
+            max({0}) as player,
+            {1} as player_id,
+            game_id,
+            max(date) as date,
+            max(home_team) as team,
+            max(away_team) as opponent,
+            max(home_team) as home,
+            strength,
+            score_diff,
+            sum(case when event IN ('SHOT', 'GOAL') AND ev_team = home_team then 1 else 0 end) Shots_f,
+            sum(case when event = 'GOAL' AND ev_team = home_team then 1 else 0 end) Goals_f,
+            sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = home_team then 1 else 0 end) Fenwick_f,
+            sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = home_team then xg else 0 end) xg_f,
+            sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = home_team then shooter_xg else 0 end) shooter_xg_f,
+            sum(case when event IN ('GOAL', 'SHOT', 'MISS', 'BLOCK') AND ev_team = home_team then 1 else 0 end) Corsi_f,
+            sum(case when event IN ('SHOT', 'GOAL') AND ev_team = away_team then 1 else 0 end) Shots_a,
+            sum(case when event = 'GOAL' AND ev_team = away_team then 1 else 0 end) Goals_a,
+            sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = away_team then 1 else 0 end) Fenwick_a,
+            sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = away_team then xg else 0 end) xg_a,
+            sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = away_team then shooter_xg else 0 end) shooter_xg_a,
+            sum(case when event IN ('GOAL', 'SHOT', 'MISS', 'BLOCK') AND ev_team = away_team then 1 else 0 end) Corsi_a,
+            sum(case when event = 'FAC' and home_zone = 'Off' then 1 else 0 end) Face_Off,
+            sum(case when event = 'FAC' and home_zone = 'Def' then 1 else 0 end) Face_Def,
+            sum(case when event = 'FAC' and ev_zone = 'Neu' then 1 else 0 end) Face_Neu,
+            if_empty
+            FROM pbp 
+            GROUP BY {1}, game_id, strength, score_diff, if_empty;
+            """.format(players[0], players[1]),
+
+            """ 
+            DROP TABLE IF EXISTS away;
+            CREATE TABLE away
+            AS
+            SELECT 
+            max({0}) as player,
+            {1} as player_id,
+            game_id,
+            max(date) as date,
+            max(away_team) as team,
+            max(home_team) as opponent,
+            max(home_team) as home,
+            strength,
+            score_diff,
+            sum(case when event IN ('SHOT', 'GOAL') AND ev_team = away_team then 1 else 0 end) Shots_f,
+            sum(case when event = 'GOAL' AND ev_team = away_team then 1 else 0 end) Goals_f,
+            sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = away_team then 1 else 0 end) Fenwick_f,
+            sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = away_team then xg else 0 end) xg_f,
+            sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = away_team then shooter_xg else 0 end) shooter_xg_f,
+            sum(case when event IN ('GOAL', 'SHOT', 'MISS', 'BLOCK') AND ev_team = away_team then 1 else 0 end) Corsi_f,
+            sum(case when event IN ('SHOT', 'GOAL') AND ev_team = home_team then 1 else 0 end) Shots_a,
+            sum(case when event = 'GOAL' AND ev_team = home_team then 1 else 0 end) Goals_a,
+            sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = home_team then 1 else 0 end) Fenwick_a,
+            sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = home_team then xg else 0 end) xg_a,
+            sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = home_team then shooter_xg else 0 end) shooter_xg_a,
+            sum(case when event IN ('GOAL', 'SHOT', 'MISS', 'BLOCK') AND ev_team = home_team then 1 else 0 end) Corsi_a,
+            sum(case when event = 'FAC' and home_zone = 'Def' then 1 else 0 end) Face_Off,
+            sum(case when event = 'FAC' and home_zone = 'Off' then 1 else 0 end) Face_Def,
+            sum(case when event = 'FAC' and ev_zone = 'Neu' then 1 else 0 end) Face_Neu,
+            if_empty
+            FROM pbp 
+            GROUP BY {1}, game_id, strength, score_diff, if_empty;
+            """.format(players[2], players[3]),
+
+            """
+            -- Strength in pbp is 'home_num x away_num'...would need to flip this in away to get them on the same scale
+            UPDATE away
+            SET strength = SUBSTR(strength, 3, 1) || 'x' || SUBSTR(strength, 1, 1);
+            """,
+
+            """
+            INSERT INTO tmp_stats(player, player_id, game_id, date, team, opponent, home, strength, score_diff, Shots_f,
+            Goals_f, Fenwick_f, xg_f, shooter_xg_f, Corsi_f, Shots_a, Goals_a, Fenwick_a, xg_a, shooter_xg_a, Corsi_a,
+            Face_Off, Face_Def, Face_Neu, if_empty)
+            SELECT 
+            player, player_id, game_id, date, team, opponent, home, strength, score_diff, Shots_f,
+            Goals_f, Fenwick_f, xg_f, shooter_xg_f, Corsi_f, Shots_a, Goals_a, Fenwick_a, xg_a, shooter_xg_a, Corsi_a,
+            Face_Off, Face_Def, Face_Neu, if_empty
+            FROM home;
+            
+            INSERT INTO tmp_stats(player, player_id, game_id, date, team, opponent, home, strength, score_diff, Shots_f,
+            Goals_f, Fenwick_f, xg_f, shooter_xg_f, Corsi_f, Shots_a, Goals_a, Fenwick_a, xg_a, shooter_xg_a, Corsi_a,
+            Face_Off, Face_Def, Face_Neu, if_empty)
+            SELECT 
+            player, player_id, game_id, date, team, opponent, home, strength, score_diff, Shots_f,
+            Goals_f, Fenwick_f, xg_f, shooter_xg_f, Corsi_f, Shots_a, Goals_a, Fenwick_a, xg_a, shooter_xg_a, Corsi_a,
+            Face_Off, Face_Def, Face_Neu, if_empty
+            FROM away;
+            """,
+
+            """
+            DROP TABLE home;
+            DROP TABLE away;
+            """
+        )
+
+        for command in commands:
+            cur.execute(command)
+
+
+def skater_on_ice():
+    """
+    Time the on-ice numbers for skaters the old way (a scan of pbp for every player column) and the new way (one scan)
+    and check they give the same rows. Runs off of the pbp table in the db (ex: a full season) and is rolled back.
+
+    :return: dict of run -> seconds
+    """
+    conn = psycopg2.connect(host=ptd.HOST, database="nhl_data", user=ptd.USERNAME, password=ptd.PASSWORD)
+    cur = conn.cursor()
+
+    cols = """player TEXT, player_id BIGINT, game_id SMALLINT, date TEXT, team TEXT, opponent TEXT, home TEXT, 
+              strength TEXT, score_diff SMALLINT, shots_f SMALLINT, goals_f SMALLINT, fenwick_f SMALLINT, xg_f REAL, 
+              shooter_xg_f REAL, corsi_f SMALLINT, shots_a SMALLINT, goals_a SMALLINT, fenwick_a SMALLINT, xg_a REAL, 
+              shooter_xg_a REAL, corsi_a SMALLINT, face_off SMALLINT, face_def SMALLINT, face_neu SMALLINT, 
+              if_empty SMALLINT"""
+
+    timings, rows = dict(), dict()
+    def one_pass(cur):
+        aggregate_stats.add_on_ice_stats(cur, 'tmp_stats')
+
+    for run, add_stats in [('slot loops', on_ice_slot_loops), ('one pass', one_pass)]:
+        cur.execute("DROP TABLE IF EXISTS tmp_stats; CREATE TEMP TABLE tmp_stats ({});".format(cols))
+
+        start = time.time()
+        add_stats(cur)
+        timings[run] = time.time() - start
+
+        # The aggregating gets rid of these right after
+        cur.execute("DELETE FROM tmp_stats WHERE player IS NULL OR player_id IS NULL;")
+        cur.execute("SELECT * FROM tmp_stats")
+        df = pd.DataFrame(cur.fetchall(), columns=[desc[0] for desc in cur.description])
+        rows[run] = df.sort_values(list(df.columns)).reset_index(drop=True)
+
+    conn.rollback()
+    conn.close()
+
+    print_timings(timings)
+    pd.testing.assert_frame_equal(rows['slot loops'], rows['one pass'], check_exact=False, rtol=1e-5)
+    print("Same {} rows both ways".format(rows['one pass'].shape[0]))
+
+    return timings
+
+
+def goalie_home_away(cur):
+    """
+    The old way of making tmp_stats for goalies (before aggregate_stats.classify_events). The home and away goalies
+    were each their own scan of pbp. It's kept here to check the new one against.
+
+    :param cur: cursor
+
+    :return: None
+    """
+    commands = (
+
+        """ 
+        DROP TABLE IF EXISTS home;
+        CREATE TABLE home
+        AS
+        SELECT 
+        MAX(home_goalie) as player,
+        home_goalie_id as player_id,
+        game_id,
+        max(date) as date,
+        max(home_team) as team,
+        max(away_team) as opponent,
+        max(home_team) as home,
+        strength,
+        score_diff,
+        sum(case when event IN ('GOAL', 'SHOT') AND ev_team = away_team then 1 else 0 end) Shots_a,
+        sum(case when event = 'GOAL' AND ev_team = away_team then 1 else 0 end) Goals_a,
+        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = away_team then 1 else 0 end) fenwick_a,
+        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = away_team then xg else 0 end) xg_a,
+        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = away_team then shooter_xg else 0 end) shooter_xg_a,
+        sum(case when event IN ('GOAL', 'SHOT', 'MISS', 'BLOCK') AND ev_team = away_team then 1 else 0 end) corsi_a,
+        if_empty
+        FROM pbp 
+        WHERE period != 5
+        GROUP BY home_goalie_id, game_id, strength, score_diff, if_empty;
+        """,
+
+        """
+        DROP TABLE IF EXISTS away;
+        CREATE TABLE away
+        AS
+        SELECT 
+        MAX(away_goalie) as player,
+        away_goalie_id as player_id,
+        game_id,
+        max(date) as date,
+        max(away_team) as team,
+        max(home_team) as opponent,
+        max(home_team) as home,
+        strength,
+        score_diff,
+        sum(case when event IN ('GOAL', 'SHOT') AND ev_team = home_team then 1 else 0 end) Shots_a,
+        sum(case when event = 'GOAL' AND ev_team = home_team then 1 else 0 end) Goals_a,
+        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = home_team then 1 else 0 end) fenwick_a,
+        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = home_team then xg else 0 end) xg_a,
+        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = home_team then shooter_xg else 0 end) shooter_xg_a,
+        sum(case when event IN ('GOAL', 'SHOT', 'MISS', 'BLOCK') AND ev_team = home_team then 1 else 0 end) corsi_a,
+        if_empty
+        FROM pbp
+        WHERE period != 5
+        GROUP BY away_goalie_id, game_id, strength, score_diff, if_empty;
+        """,
+
+        """
+        -- Strength in pbp is 'home_num x away_num'...would need to flip this in away
+        -- to get them on the same scale
+        UPDATE away
+        SET strength = SUBSTR(strength, 3, 1) || 'x' || SUBSTR(strength, 1, 1);
+        """,
+
+        """
+        DROP TABLE IF EXISTS tmp_stats;
+        CREATE TEMP TABLE tmp_stats
+        AS
+        SELECT * FROM home
+        UNION
+        SELECT * FROM away;
+        """,
+
+        """
+        DROP TABLE home;
+        DROP TABLE away;
+        """
+    )
+
+    for command in commands:
+        cur.execute(command)
+
+
+def team_home_away(cur):
+    """
+    The old way of making tmp_stats for teams (before aggregate_stats.classify_events). The home and away teams were
+    each their own scan of pbp. It's kept here to check the new one against.
+
+    :param cur: cursor
+
+    :return: None
+    """
+    commands = (
+        """ 
+        DROP TABLE IF EXISTS home;
+        CREATE TABLE home
+        AS
+        SELECT 
+        home_team as team,
+        game_id,
+        max(date) as date,
+        max(away_team) as opponent,
+        max(home_team) as home,
+        strength,
+        score_diff,
+        sum(case when event IN ('GOAL', 'SHOT') AND ev_team = home_team then 1 else 0 end) Shots_f,
+        sum(case when event = 'GOAL' AND ev_team = home_team then 1 else 0 end) Goals_f,
+        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = home_team then 1 else 0 end) Fenwick_f,
+        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = home_team then xg else 0 end) xg_f,
+        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = home_team then shooter_xg else 0 end) shooter_xg_f,
+        sum(case when event IN ('GOAL', 'SHOT', 'MISS', 'BLOCK') AND ev_team = home_team then 1 else 0 end) Corsi_f,
+        sum(case when event = 'PENL' AND ev_team = home_team then 1 else 0 end) Pent,
+        sum(case when event = 'GIVE' AND ev_team = home_team then 1 else 0 end) Gives,
+        sum(case when event = 'TAKE' AND ev_team = home_team then 1 else 0 end) Takes,
+        sum(case when event = 'HIT' AND ev_team = home_team then 1 else 0 end) Hits_f,
+        sum(case when event = 'FAC' AND ev_team = home_team then 1 else 0 end) Face_w,
+        sum(case when event IN ('GOAL', 'SHOT') AND ev_team = away_team then 1 else 0 end) Shots_a,
+        sum(case when event = 'GOAL' AND ev_team = away_team then 1 else 0 end) Goals_a,
+        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = away_team then 1 else 0 end) Fenwick_a,
+        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = away_team then xg else 0 end) xg_a,
+        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = away_team then shooter_xg else 0 end) shooter_xg_a,
+        sum(case when event IN ('GOAL', 'SHOT', 'MISS', 'BLOCK') AND ev_team = away_team then 1 else 0 end) Corsi_a,
+        sum(case when event = 'PENL' AND ev_team = away_team then 1 else 0 end) Pend,
+        sum(case when event = 'HIT' AND ev_team = away_team then 1 else 0 end) Hits_a,
+        sum(case when event = 'FAC' AND ev_team = away_team then 1 else 0 end) Face_l,
+        sum(case when event = 'FAC' and home_zone = 'Off' then 1 else 0 end) Face_Off,
+        sum(case when event = 'FAC' and home_zone = 'Def' then 1 else 0 end) Face_Def,
+        sum(case when event = 'FAC' and home_zone = 'Neu' then 1 else 0 end) Face_Neu,
+        if_empty
+        FROM pbp 
+        WHERE period != 5
+        GROUP BY home_team, game_id, strength, score_diff, if_empty;
+        """,
+
+        """ 
+        DROP TABLE IF EXISTS away;
+        CREATE TABLE away
+        AS
+        SELECT 
+        away_team as team,
+        game_id,
+        max(date) as date,
+        max(home_team) as opponent,
+        max(home_team) as home,
+        strength,
+        score_diff,
+        sum(case when event IN ('GOAL', 'SHOT') AND ev_team = away_team then 1 else 0 end) Shots_f,
+        sum(case when event = 'GOAL' AND ev_team = away_team then 1 else 0 end) Goals_f,
+        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = away_team then 1 else 0 end) Fenwick_f,
+        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = away_team then xg else 0 end) xg_f,
+        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = away_team then shooter_xg else 0 end) shooter_xg_f,
+        sum(case when event IN ('GOAL', 'SHOT', 'MISS', 'BLOCK') AND ev_team = away_team then 1 else 0 end) Corsi_f,
+        sum(case when event = 'PENL' AND ev_team = away_team then 1 else 0 end) Pent,
+        sum(case when event = 'GIVE' AND ev_team = away_team then 1 else 0 end) Gives,
+        sum(case when event = 'TAKE' AND ev_team = away_team then 1 else 0 end) Takes,
+        sum(case when event = 'HIT' AND ev_team = away_team then 1 else 0 end) Hits_f,
+        sum(case when event = 'FAC' AND ev_team = away_team then 1 else 0 end) Face_w,
+        sum(case when event IN ('GOAL', 'SHOT') AND ev_team = home_team then 1 else 0 end) Shots_a,
+        sum(case when event = 'GOAL' AND ev_team = home_team then 1 else 0 end) Goals_a,
+        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = home_team then 1 else 0 end) Fenwick_a,
+        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = home_team then xg else 0 end) xg_a,
+        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = home_team then shooter_xg else 0 end) shooter_xg_a,
+        sum(case when event IN ('GOAL', 'SHOT', 'MISS', 'BLOCK') AND ev_team = home_team then 1 else 0 end) Corsi_a,
+        sum(case when event = 'PENL' AND ev_team = home_team then 1 else 0 end) Pend,
+        sum(case when event = 'HIT' AND ev_team = home_team then 1 else 0 end) Hits_a,
+        sum(case when event = 'FAC' AND ev_team = home_team then 1 else 0 end) Face_l,
+        sum(case when event = 'FAC' and home_zone = 'Def' then 1 else 0 end) Face_Off,
+        sum(case when event = 'FAC' and home_zone = 'Off' then 1 else 0 end) Face_Def,
+        sum(case when event = 'FAC' and home_zone = 'Neu' then 1 else 0 end) Face_Neu,
+        if_empty
+        FROM pbp 
+        WHERE period != 5
+        GROUP BY away_team, game_id, strength, score_diff, if_empty;
+        """,
+
+        """
+        -- Strength in pbp is 'home_num x away_num'...would need to flip this in away
+        -- to get them on the same scale
+        UPDATE away
+        SET strength = SUBSTR(strength, 3, 1) || 'x' || SUBSTR(strength, 1, 1);
+        """,
+
+        """
+        DROP TABLE IF EXISTS tmp_stats;
+        CREATE TEMP TABLE tmp_stats
+        AS
+        SELECT * FROM home 
+        UNION
+        SELECT * FROM away;
+        """,
+
+        """
+        DROP TABLE home;
+        DROP TABLE away;
+        """
+    )
+
+    for command in commands:
+        cur.execute(command)
+
+
+def team_goalie_scan():
+    """
+    Time making tmp_stats for teams and goalies the old way (home and away are each a scan of pbp for both) and the new
+    way (one scan for both -> aggregate_stats.classify_events) and check they give the same rows. Runs off of the pbp
+    table in the db (ex: a full season) and is rolled back.
+
+    :return: dict of run -> seconds
+    """
+    conn = psycopg2.connect(host=ptd.HOST, database="nhl_data", user=ptd.USERNAME, password=ptd.PASSWORD)
+    cur = conn.cursor()
+
+    def old_way():
+        for home_away in [team_home_away, goalie_home_away]:
+            home_away(cur)
+            cur.execute("SELECT * FROM tmp_stats")
+            yield pd.DataFrame(cur.fetchall(), columns=[desc[0] for desc in cur.description])
+
+    def new_way():
+        aggregate_stats.classify_events(cur)
+        for create_tmp_stats in [aggregate_stats.create_team_tmp_stats, aggregate_stats.create_goalie_tmp_stats]:
+            create_tmp_stats(cur)
+            cur.execute("SELECT * FROM tmp_stats")
+            yield pd.DataFrame(cur.fetchall(), columns=[desc[0] for desc in cur.description])
+
+    timings, rows = dict(), dict()
+    for run, make_rows in [('home/away scans', old_way), ('one scan', new_way)]:
+        start = time.time()
+        rows[run] = [df.sort_values(list(df.columns)).reset_index(drop=True) for df in make_rows()]
+        timings[run] = time.time() - start
+
+    conn.rollback()
+    conn.close()
+
+    print_timings(timings)
+    for old, new in zip(rows['home/away scans'], rows['one scan']):
+        pd.testing.assert_frame_equal(old, new, check_exact=False, rtol=1e-5)
+        print("Same {} rows both ways".format(new.shape[0]))
+
+    return timings
+
+
+class NoCommit:
+    """
+    Stands in for the connection passed to the aggregating stages so they don't commit and can be rolled back
+    """
+    def commit(self):
+        pass
+
+
+def read_table(cur, table):
+    """
+    Get a whole table as a DataFrame (with one COPY)
+
+    :param cur: cursor
+    :param table: name of table
+
+    :return: DataFrame
+    """
+    buffer = io.StringIO()
+    cur.copy_expert("COPY {} TO STDOUT CSV HEADER".format(table), buffer)
+    buffer.seek(0)
+
+    return pd.read_csv(buffer, dtype={'date': str, 'strength': str, 'team': str, 'opponent': str, 'home': str})
+
+
+def text_max(cur):
+    """
+    Check aggregate_frames.group_rows takes the max of text like Postgres does. Nulls mixed in with text are skipped and
+    a group that's all null is null. Ex: a player who's p1 on a GIVE for 'HOM' and on a PENL with no ev_team.
+
+    :param cur: cursor -> The table is temporary
+
+    :return: None
+    """
+    rows = pd.DataFrame({'player_id': [1, 1, 2, 2, 3, 3, 3], 'ev_team': ['HOM', None, None, None, 'AWY', None, 'HOM'],
+                         'event': ['GIVE', 'PENL', 'PENL', 'PENL', 'HIT', 'PENL', 'GIVE']})
+
+    cur.execute("CREATE TEMP TABLE text_max (player_id BIGINT, ev_team TEXT, event TEXT);")
+    cur.executemany("INSERT INTO text_max VALUES (%s, %s, %s);", rows.values.tolist())
+    cur.execute("SELECT player_id, max(ev_team), max(event) FROM text_max GROUP BY player_id ORDER BY player_id;")
+    sql_rows = cur.fetchall()
+    cur.execute("DROP TABLE text_max;")
+
+    frame_rows = aggregate_frames.group_rows(rows, ['player_id'], ['ev_team', 'event'], []).sort_values('player_id')
+    frame_rows = [tuple(row) for row in frame_rows[['player_id', 'ev_team', 'event']].values.tolist()]
+
+    assert sql_rows == frame_rows, "Max of text isn't the same: {} vs {}".format(sql_rows, frame_rows)
+    print("Same max of text (with nulls) both ways")
+
+
+def aggregate_fixture():
+    """
+    Made up pbp, player_toi and team_toi to aggregate without any scraped data. It's toi_fixture (as 'T.B' vs 'PIT')
+    played on two days. Each game gets 300 random events (the same every time) plus some in the minute TBL pulled
+    their goalie and the 20 seconds PIT had 3 guys in the box. Some penalties don't have an ev_team.
+
+    :return: pbp, player_toi, team_toi, nhl_players -> DataFrames like the tables (pbp like push_to_db.push_to_db
+             returns it)
+    """
+    rng = np.random.default_rng(0)
+    events = ['GOAL', 'SHOT', 'MISS', 'BLOCK', 'FAC', 'HIT', 'GIVE', 'TAKE', 'PENL']
+
+    shifts = toi_fixture()
+    shifts['team'] = shifts['team'].cat.rename_categories({'TBL': 'T.B'})
+    shifts = pd.concat([shifts, shifts.assign(game_id=20002, date='2017-10-11')], ignore_index=True)
+
+    rows = []
+    for game_id in [20001, 20002]:
+        periods = rng.integers(1, 5, 300)
+        seconds = np.where(periods == 4, rng.integers(1, 150, 300), rng.integers(1, 1200, 300))
+        rows += [(game_id, period, second, event) for period, second, event in
+                 zip(periods, seconds, rng.choice(events, 300, p=[.03, .25, .12, .12, .18, .12, .07, .06, .05]))]
+        rows += [(game_id, 3, 1145, 'SHOT'), (game_id, 3, 1150, 'GOAL'), (game_id, 3, 1170, 'FAC'),
+                 (game_id, 1, 505, 'SHOT'), (game_id, 1, 510, 'HIT')]
+
+    pbp = pd.DataFrame(rows, columns=['game_id', 'period', 'seconds_elapsed', 'event'])
+    pbp = pbp.sort_values(['game_id', 'period', 'seconds_elapsed'], kind='mergesort').reset_index(drop=True)
+    pbp['date'] = np.where(pbp.game_id == 20001, '2017-10-10', '2017-10-11')
+    pbp['home_team'], pbp['away_team'], pbp['season'] = 'T.B', 'PIT', 2017
+
+    resolved = on_ice.resolve_on_ice(pbp, shifts)
+    names = dict(zip(shifts.player_id.astype(float), shifts.player))
+    for col in on_ice.HOME_COLS + on_ice.AWAY_COLS + ['home_goalie_id', 'away_goalie_id']:
+        pbp[col] = resolved[col]
+        pbp[col.replace('_id', '')] = pbp[col].map(names)
+    pbp['strength'] = resolved['strength']
+    pbp['home_players'] = pbp[on_ice.HOME_COLS].notnull().sum(axis=1)
+    pbp['away_players'] = pbp[on_ice.AWAY_COLS].notnull().sum(axis=1)
+
+    # p1 is on the team of the event. p2 is on the other team for blocks/hits/faceoffs and a teammate for goals.
+    home = rng.random(len(pbp)) < .5
+    pbp['ev_team'] = np.where(home, 'T.B', 'PIT')
+    pbp.loc[(pbp.event == 'PENL') & (rng.random(len(pbp)) < .3), 'ev_team'] = None
+    pbp['ev_zone'] = rng.choice(['Off', 'Def', 'Neu'], len(pbp))
+    pbp['home_zone'] = np.where(home, pbp.ev_zone, pbp.ev_zone.map({'Off': 'Def', 'Def': 'Off', 'Neu': 'Neu'}))
+
+    home_on, away_on = pbp[on_ice.HOME_COLS].values, pbp[on_ice.AWAY_COLS].values
+    for player, other_team, used in [('p1', False, pbp.event.notnull()),
+                                     ('p2', True, pbp.event.isin(['BLOCK', 'HIT', 'FAC'])),
+                                     ('p2', False, pbp.event == 'GOAL'), ('p3', False, pbp.event == 'GOAL')]:
+        on = np.where((home != other_team)[:, None], home_on, away_on)
+        picked = on[np.arange(len(pbp)), rng.integers(0, 5, len(pbp))]
+        if player + '_id' not in pbp.columns:
+            pbp[player + '_id'] = np.nan
+        pbp.loc[used, player + '_id'] = picked[used.values]
+        pbp[player + '_name'] = pbp[player + '_id'].map(names)
+
+    goals = pbp.event == 'GOAL'
+    pbp['home_score'] = (goals & home).groupby(pbp.game_id).cumsum() - (goals & home)
+    pbp['away_score'] = (goals & ~home).groupby(pbp.game_id).cumsum() - (goals & ~home)
+    shots = pbp.event.isin(['GOAL', 'SHOT', 'MISS'])
+    pbp['xg'] = np.where(shots, rng.random(len(pbp)) * .3, np.nan)
+    pbp['shooter_xg'] = np.where(shots, rng.random(len(pbp)) * .3, np.nan)
+    pbp['xc'], pbp['yc'] = rng.integers(-99, 99, len(pbp)), rng.integers(-42, 42, len(pbp))
+    pbp['xc_adj'], pbp['yc_adj'] = pbp.xc, pbp.yc
+    for col in ['description', 'time_elapsed', 'type', 'home_coach', 'away_coach', 'reg_xg']:
+        pbp[col] = ''
+
+    pbp = ptd.fix_pbp_df(pbp[[col for col, pg_type in ptd.PBP_SPEC if col in pbp.columns]])
+    pbp = pbp.assign(strength=ptd.fix_strength(pbp.strength))
+
+    player_rows, team_rows = compile_toi.process_games(shifts)[:2]
+    player_toi, team_toi = aggregate_frames.toi_frames(player_rows, team_rows, pbp)
+
+    players = shifts.drop_duplicates('player_id')
+    nhl_players = pd.DataFrame({'id': players.player_id.astype(int), 'name': players.player,
+                                'shoots_catches': np.where(players.player_id % 2, 'L', 'R'),
+                                'position': players.position.astype(str)})
+
+    return pbp, player_toi, team_toi, nhl_players
+
+
+def load_fixture(cur):
+    """
+    Load aggregate_fixture into temp tables with the same names as the real ones (pbp, player_toi, team_toi,
+    nhl_players, score_coefficients). Temp tables come first when looking up a table so everything on this connection
+    uses them instead. They're gone when it's rolled back.
+
+    :param cur: cursor
+
+    :return: PlayerRegistry of the made up players
+    """
+    pbp, player_toi, team_toi, nhl_players = aggregate_fixture()
+
+    coefficients = pd.DataFrame([(team, diff, 1 + diff / 50, 1 + diff / 40, 1 + diff / 30)
+                                 for team in ['home', 'away'] for diff in range(-3, 4)],
+                                columns=['team', 'scorediff', 'shots', 'fenwick', 'corsi'])
+    tables = [('pbp', pbp, ptd.PBP_SPEC), ('player_toi', player_toi, ptd.PLAYER_TOI_SPEC),
+              ('team_toi', team_toi, ptd.TEAM_TOI_SPEC),
+              ('nhl_players', nhl_players, [('id', 'bigint'), ('name', 'text'), ('shoots_catches', 'text'),
+                                            ('position', 'text')]),
+              ('score_coefficients', coefficients, [('team', 'text'), ('scorediff', 'bigint'),
+                                                    ('shots', 'double precision'), ('fenwick', 'double precision'),
+                                                    ('corsi', 'double precision')])]
+    for table, df, spec in tables:
+        cur.execute("CREATE TEMP TABLE {} ({});".format(table, ', '.join('"{}" {}'.format(*col) for col in spec)))
+        ptd.copy_df(cur, df[[col for col, pg_type in spec]], [table])
+
+    players = player_registry.PlayerRegistry()
+    players.append(nhl_players[['id', 'shoots_catches', 'position', 'name']].values.tolist())
+
+    return players
+
+
+def aggregate_engines(fixture=False):
+    """
+    Time aggregating everything in the db (aggregate_stats, the stages one after the other) and in pandas
+    (aggregate_frames) and check they give the same team_stats, goalie_stats, and skater_stats. Everything is rolled
+    back at the end. Reading the tables into pandas isn't part of the time (in compile.process they're already in
+    memory). text_max is checked first.
+
+    It runs off of the pbp, player_toi, team_toi, nhl_players and score_coefficients tables in the db (ex: a full
+    season). With fixture it runs off of aggregate_fixture instead so it only needs a db to connect to:
+        python benchmarks.py aggregate_engines fixture
+
+    Passing means every table has the same rows (by primary_key) with the same values in every column (numbers within
+    1e-4) -> "Same N rows for table both ways" is printed for each. Otherwise an AssertionError says which column
+    isn't the same.
+
+    :param fixture: Use the made up games instead of what's in the db
+
+    :return: dict of run -> seconds
+    """
+    conn = psycopg2.connect(host=ptd.HOST, database="nhl_data", user=ptd.USERNAME, password=ptd.PASSWORD)
+    cur = conn.cursor()
+    tables = ['team_stats', 'goalie_stats', 'skater_stats']
+
+    text_max(cur)
+
+    players = load_fixture(cur) if fixture else player_registry.get_registry()
+    pbp, player_toi, team_toi = [read_table(cur, table) for table in ['pbp', 'player_toi', 'team_toi']]
+    coefficients = aggregate_frames.get_score_coefficients(cur)
+
+    timings, rows = dict(), dict()
+
+    start = time.time()
+    for name in ['events', 'teams', 'goalies', 'skater_on_ice', 'skater_individual', 'skaters']:
+        aggregate_stats.AGGREGATE_STAGES[name][0](cur, NoCommit())
+    timings['sql'] = time.time() - start
+    rows['sql'] = [read_table(cur, table) for table in tables]
+
+    start = time.time()
+    rows['pandas'] = aggregate_frames.aggregate_frames(pbp, player_toi, team_toi, coefficients, players)
+    timings['pandas'] = time.time() - start
+
+    conn.rollback()
+    conn.close()
+
+    print_timings(timings)
+    for table, sql_rows, frame_rows in zip(tables, rows['sql'], rows['pandas']):
+        sql_rows, frame_rows = [df.sort_values('primary_key').reset_index(drop=True) for df in [sql_rows, frame_rows]]
+        for col in frame_rows.columns:
+            if aggregate_frames.column_type(col) != 'text':
+                sql_rows[col], frame_rows[col] = [pd.to_numeric(df[col]).astype(float) for df in [sql_rows, frame_rows]]
+        pd.testing.assert_frame_equal(sql_rows[frame_rows.columns], frame_rows, check_exact=False, rtol=1e-5, atol=1e-4)
+        print("Same {} rows for {} both ways".format(frame_rows.shape[0], table))
+
+    return timings
+
+
+def stub_people_api(delay):
+    """
+    Start a people api on localhost that answers every id with a made up player
+
+    :param delay: seconds to wait before answering (like the real one)
+
+    :return: server, url (with {} for the id), and list of ids it was asked for
+    """
+    requested = []
+
+    class People(BaseHTTPRequestHandler):
+        def do_GET(self):
+            player_id = int(self.path.rstrip('/').split('/')[-1])
+            requested.append(player_id)
+            time.sleep(delay)
+
+            body = json.dumps({'people': [{'id': player_id, 'fullName': 'Player {}'.format(player_id),
+                                           'shootsCatches': 'L', 'primaryPosition': {'abbreviation': 'C'}}]})
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body.encode())
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), People)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, 'http://127.0.0.1:{}/api/v1/people/{{}}'.format(server.server_address[1]), requested
+
+
+def player_fetch(num_players, delay=.1):
+    """
+    Time fetching new players one at a time (how it used to be done -> a second after each) and with
+    process_players.fetch_players. Then fetch them again to check they all come from the cache.
+
+    :param num_players: number of players to fetch
+    :param delay: seconds the stub api takes to answer
+
+    :return: dict of run -> seconds
+    """
+    server, url, requested = stub_people_api(delay)
+    player_ids = list(range(8470000, 8470000 + num_players))
+    timings = dict()
+
+    start = time.time()
+    for player_id in player_ids:
+        process_players.get_player_info(player_id, url=url, cache_dir=None)
+        time.sleep(1)
+    timings['one at a time'] = time.time() - start
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        start = time.time()
+        players = process_players.fetch_players(player_ids, url=url, cache_dir=cache_dir)
+        timings['fetch_players'] = time.time() - start
+        assert [p['id'] for p in players] == player_ids
+
+        del requested[:]
+        start = time.time()
+        process_players.fetch_players(player_ids, url=url, cache_dir=cache_dir)
+        timings['cached'] = time.time() - start
+        assert not requested, "{} players were fetched again".format(len(requested))
+
+    server.shutdown()
+    print_timings(timings)
+
+    return timings
+
+
+if __name__ == '__main__':
+    if sys.argv[1] == 'toi_workers':
+        toi_workers(compile_toi.compact_shifts(pd.read_csv(sys.argv[2]).rename(columns=str.lower)), int(sys.argv[3]))
+    elif sys.argv[1] == 'toi_equivalence':
+        toi_equivalence(compile_toi.compact_shifts(pd.read_csv(sys.argv[2]).rename(columns=str.lower)))
+    elif sys.argv[1] == 'toi_check':
+        toi_check()
+    elif sys.argv[1] == 'copy_formats':
+        copy_formats(pd.read_csv(sys.argv[2]))
+    elif sys.argv[1] == 'skater_on_ice':
+        skater_on_ice()
+    elif sys.argv[1] == 'team_goalie_scan':
+        team_goalie_scan()
+    elif sys.argv[1] == 'aggregate_engines':
+        aggregate_engines(fixture=sys.argv[2:] == ['fixture'])
+    elif sys.argv[1] == 'player_fetch':
+        player_fetch(int(sys.argv[2]))
@@ -0,0 +1,754 @@
+"""
+Aggregating the stats in pandas instead of in the db (see aggregate_stats). It runs off of the pbp and TOI that are
+already in memory in compile.process so the working tables (pbp, player_toi, team_toi) never have to be loaded. Only
+the final rows (team_stats, goalie_stats, skater_stats) are sent over and then they go to the site like before.
+
+Every step follows the SQL in aggregate_stats so the rows come out the same -> benchmarks.py aggregate_engines checks
+the two against each other.
+
+All runs through - aggregate_all
+"""
+import time
+import numpy as np
+import pandas as pd
+import psycopg2
+
+import sys
+sys.path.append("..")
+from machine_info import *
+
+from compile_stats import aggregate_stats, compile_toi
+from compile_stats import push_to_db as ptd
+from nhl_players import player_registry
+
+SHOT_EVENTS = ['GOAL', 'SHOT']
+FENWICK_EVENTS = ['GOAL', 'SHOT', 'MISS']
+CORSI_EVENTS = ['GOAL', 'SHOT', 'MISS', 'BLOCK']
+
+# Counted for each side of an event (home_* and away_*) -> (name, events)
+SIDE_STATS = [('shots', SHOT_EVENTS), ('goals', ['GOAL']), ('fenwick', FENWICK_EVENTS), ('corsi', CORSI_EVENTS),
+              ('pent', ['PENL']), ('gives', ['GIVE']), ('takes', ['TAKE']), ('hits', ['HIT']), ('face_w', ['FAC'])]
+
+# What the events are grouped on (like in aggregate_stats.classify_events)
+EVENT_KEYS = ['game_id', 'home_team', 'away_team', 'strength', 'score_diff', 'if_empty']
+
+# Counts for each classified event (see classify_events)
+EVENT_COUNTS = ['{}_{}'.format(side, stat) for side in ['home', 'away']
+                for stat in [stat for stat, _ in SIDE_STATS] + ['xg', 'shooter_xg']] + \
+               ['face_home_off', 'face_home_def', 'face_neu', 'face_ev_neu']
+
+# Columns for each kind of row -> column it comes from for the home side (the away side is switched -> other_side)
+TEAM_NUMBERS = {
+    'shots_f': 'home_shots', 'goals_f': 'home_goals', 'fenwick_f': 'home_fenwick', 'xg_f': 'home_xg',
+    'shooter_xg_f': 'home_shooter_xg', 'corsi_f': 'home_corsi', 'pent': 'home_pent', 'gives': 'home_gives',
+    'takes': 'home_takes', 'hits_f': 'home_hits', 'face_w': 'home_face_w', 'shots_a': 'away_shots',
+    'goals_a': 'away_goals', 'fenwick_a': 'away_fenwick', 'xg_a': 'away_xg', 'shooter_xg_a': 'away_shooter_xg',
+    'corsi_a': 'away_corsi', 'pend': 'away_pent', 'hits_a': 'away_hits', 'face_l': 'away_face_w',
+    'face_off': 'face_home_off', 'face_def': 'face_home_def', 'face_neu': 'face_neu'
+}
+GOALIE_NUMBERS = {
+    'shots_a': 'away_shots', 'goals_a': 'away_goals', 'fenwick_a': 'away_fenwick', 'xg_a': 'away_xg',
+    'shooter_xg_a': 'away_shooter_xg', 'corsi_a': 'away_corsi'
+}
+# For skaters the neutral zone faceoffs are off of ev_zone
+SKATER_NUMBERS = {
+    'shots_f': 'home_shots', 'goals_f': 'home_goals', 'fenwick_f': 'home_fenwick', 'xg_f': 'home_xg',
+    'shooter_xg_f': 'home_shooter_xg', 'corsi_f': 'home_corsi', 'shots_a': 'away_shots', 'goals_a': 'away_goals',
+    'fenwick_a': 'away_fenwick', 'xg_a': 'away_xg', 'shooter_xg_a': 'away_shooter_xg', 'corsi_a': 'away_corsi',
+    'face_off': 'face_home_off', 'face_def': 'face_home_def', 'face_neu': 'face_ev_neu'
+}
+
+# Individual numbers for skaters -> (column, events, column the player has to be in)
+# (icors is fenwick as p1 or a BLOCK as p2 so it's done on it's own)
+INDIVIDUAL_STATS = [
+    ('goals', ['GOAL'], 'p1_id'), ('a1', ['GOAL'], 'p2_id'), ('a2', ['GOAL'], 'p3_id'), ('isf', SHOT_EVENTS, 'p1_id'),
+    ('ifen', FENWICK_EVENTS, 'p1_id'), ('iblocks', ['BLOCK'], 'p1_id'), ('pen_drawn', ['PENL'], 'p2_id'),
+    ('pen_taken', ['PENL'], 'p1_id'), ('gives', ['GIVE'], 'p1_id'), ('takes', ['TAKE'], 'p1_id'),
+    ('hits_f', ['HIT'], 'p1_id'), ('hits_a', ['HIT'], 'p2_id'), ('ifac_win', ['FAC'], 'p1_id'),
+    ('ifac_loss', ['FAC'], 'p2_id')
+]
+INDIVIDUAL_COLUMNS = [stat for stat, _, _ in INDIVIDUAL_STATS] + ['ixg', 'shooter_ixg', 'icors']
+
+# Numbers a skater's off-ice ones are taken from (team - skater)
+OFF_ICE_COLUMNS = ['shots_f', 'goals_f', 'fenwick_f', 'xg_f', 'shooter_xg_f', 'corsi_f', 'shots_a', 'goals_a',
+                   'fenwick_a', 'xg_a', 'shooter_xg_a', 'corsi_a', 'shots_f_sa', 'fenwick_f_sa', 'corsi_f_sa',
+                   'shots_a_sa', 'fenwick_a_sa', 'corsi_a_sa', 'face_off', 'face_def', 'face_neu']
+
+# Score adjusted columns -> (column, column in score_coefficients)
+SCORE_ADJUSTED = [('shots', 'shots'), ('fenwick', 'fenwick'), ('corsi', 'corsi')]
+
+# Columns of the stats tables (in the same order as the ones made by aggregate_stats)
+TEAM_STATS_COLUMNS = [
+    'team', 'game_id', 'season', 'date', 'opponent', 'home', 'strength', 'toi', 'shots_f', 'goals_f', 'fenwick_f',
+    'xg_f', 'corsi_f', 'shots_a', 'goals_a', 'fenwick_a', 'xg_a', 'corsi_a', 'pent', 'pend', 'gives', 'takes',
+    'hits_f', 'hits_a', 'face_w', 'face_l', 'face_off', 'face_def', 'face_neu', 'shots_f_sa', 'fenwick_f_sa',
+    'corsi_f_sa', 'shots_a_sa', 'fenwick_a_sa', 'corsi_a_sa', 'if_empty', 'primary_key', 'shooter_xg_a', 'shooter_xg_f'
+]
+GOALIE_STATS_COLUMNS = [
+    'player', 'player_id', 'game_id', 'season', 'date', 'team', 'opponent', 'home', 'strength', 'shots_a', 'goals_a',
+    'fenwick_a', 'xg_a', 'corsi_a', 'toi_on', 'toi_off', 'shots_a_sa', 'fenwick_a_sa', 'corsi_a_sa', 'if_empty',
+    'primary_key', 'shooter_xg_a'
+]
+SKATER_STATS_COLUMNS = [
+    'player', 'player_id', 'position', 'handedness', 'season', 'game_id', 'date', 'team', 'opponent', 'home',
+    'strength', 'toi_on', 'goals', 'a1', 'a2', 'isf', 'ifen', 'ixg', 'icors', 'iblocks', 'pen_drawn', 'pen_taken',
+    'gives', 'takes', 'hits_f', 'hits_a', 'ifac_win', 'ifac_loss', 'shots_f', 'goals_f', 'fenwick_f', 'xg_f',
+    'corsi_f', 'shots_a', 'goals_a', 'fenwick_a', 'xg_a', 'corsi_a', 'shots_f_sa', 'fenwick_f_sa', 'corsi_f_sa',
+    'shots_a_sa', 'fenwick_a_sa', 'corsi_a_sa', 'face_off', 'face_def', 'face_neu', 'toi_off', 'shots_f_off',
+    'goals_f_off', 'fenwick_f_off', 'xg_f_off', 'corsi_f_off', 'shots_a_off', 'goals_a_off', 'fenwick_a_off',
+    'xg_a_off', 'corsi_a_off', 'shots_f_off_sa', 'fenwick_f_off_sa', 'corsi_f_off_sa', 'shots_a_off_sa',
+    'fenwick_a_off_sa', 'corsi_a_off_sa', 'face_off_off', 'face_neu_off', 'face_def_off', 'if_empty', 'primary_key',
+    'shooter_xg_a', 'shooter_xg_a_off', 'shooter_xg_f', 'shooter_xg_f_off', 'shooter_ixg'
+]
+TEXT_COLUMNS = ['player', 'position', 'handedness', 'date', 'team', 'opponent', 'home', 'strength', 'primary_key']
+
+
+def column_type(col):
+    """
+    Type of a column in the stats tables
+
+    :param col: name of column
+
+    :return: Postgres type
+    """
+    if col in TEXT_COLUMNS:
+        return 'text'
+    if 'xg' in col or col.endswith('_sa'):
+        return 'double precision'
+    return 'bigint'
+
+
+def flip_strength(strength):
+    """
+    Strength in pbp is 'home_num x away_num'...need to flip this for away to get them on the same scale
+
+    :param strength: Series of strengths
+
+    :return: Series of flipped strengths
+    """
+    return strength.str[2] + 'x' + strength.str[0]
+
+
+def get_season(dates):
+    """
+    Get the season for each date. Anything in the offseason (or not from 2007-2020) is null like in the SQL.
+
+    :param dates: Series of dates ('2017-10-04')
+
+    :return: Series of seasons
+    """
+    dates = pd.to_datetime(dates, errors='coerce')
+    season = dates.dt.year - (dates.dt.month < 9)
+    offseason = (dates.dt.month == 8) | ((dates.dt.month == 7) & (dates.dt.day > 1))
+
+    return season.where(~offseason & season.between(2007, 2020)).astype('Int64')
+
+
+def other_side(col):
+    """
+    Get the column for the same number from the other side (ex: home_shots -> away_shots)
+
+    :param col: column of the classified events
+
+    :return: column for other side
+    """
+    zones = {'face_home_off': 'face_home_def', 'face_home_def': 'face_home_off'}
+    side, _, stat = col.partition('_')
+
+    if col in zones:
+        return zones[col]
+    if side in ['home', 'away']:
+        return ('away' if side == 'home' else 'home') + '_' + stat
+    return col
+
+
+def group_rows(df, keys, maxes, sums):
+    """
+    GROUP BY -> Nulls are kept as their own group like in Postgres. Sums of nothing are 0 (like the COALESCEs) and
+    maxes of nothing are null.
+
+    The max of a text column is done on the spot of each value in the sorted values (-1 for null). So nulls are skipped
+    like in Postgres and it doesn't fall back to going through every group in python (which is really slow and fails
+    when there's a null with the text).
+
+    :param df: DataFrame
+    :param keys: columns to group on
+    :param maxes: columns to take the max of
+    :param sums: columns to add up
+
+    :return: DataFrame of groups
+    """
+    text = {col: pd.factorize(df[col], sort=True) for col in maxes if df[col].dtype == object}
+    df = df.assign(**{col: codes for col, (codes, values) in text.items()})
+
+    # One max and one sum over all the columns (instead of one for each column)
+    groups = df.groupby(keys, dropna=False, sort=False)
+    grouped = pd.concat([groups[list(maxes)].max(), groups[list(sums)].sum()], axis=1).reset_index()
+
+    # -1 gets the None at the end
+    for col, (codes, values) in text.items():
+        grouped[col] = np.append(np.asarray(values, dtype=object), None)[grouped[col].values]
+
+    return grouped
+
+
+def prepare_pbp(pbp):
+    """
+    Get the pbp columns needed with the right types. Should be the pbp returned by push_to_db.push_to_db (score_diff,
+    if_empty and the strengths fixed).
+
+    :param pbp: DataFrame of pbp
+
+    :return: DataFrame
+    """
+    id_cols = ['p1_id', 'p2_id', 'p3_id', 'home_goalie_id', 'away_goalie_id'] + \
+              ['{}player{}_id'.format(side, x) for side in ['home', 'away'] for x in range(1, 7)]
+    name_cols = ['p1_name', 'p2_name', 'p3_name', 'home_goalie', 'away_goalie'] + \
+                ['{}player{}'.format(side, x) for side in ['home', 'away'] for x in range(1, 7)]
+    cols = EVENT_KEYS + ['date', 'period', 'event', 'ev_team', 'ev_zone', 'home_zone', 'xg', 'shooter_xg']
+
+    pbp = pbp[cols + id_cols + name_cols].reset_index(drop=True)
+    for col in id_cols + ['xg', 'shooter_xg', 'period', 'score_diff']:
+        pbp[col] = pd.to_numeric(pbp[col], errors='coerce').astype(float)
+    pbp['if_empty'] = pbp.if_empty.astype(np.int64)
+
+    return pbp
+
+
+def classify_events(pbp):
+    """
+    Classify every event once (which side it's for and if it's a shot/fenwick/corsi/etc.). Unlike
+    aggregate_stats.classify_events nothing is grouped here since the skaters need each event too.
+
+    :param pbp: DataFrame of pbp (prepare_pbp)
+
+    :return: DataFrame of the keys and counts for each event -> home_* and away_*
+    """
+    events = pbp[EVENT_KEYS + ['date', 'period', 'home_goalie', 'home_goalie_id', 'away_goalie', 'away_goalie_id']]
+    flags = dict()
+
+    is_home = (pbp.ev_team == pbp.home_team).values
+    sides = {'home': is_home, 'away': (pbp.ev_team == pbp.away_team).values & ~is_home}
+    is_fenwick = pbp.event.isin(FENWICK_EVENTS).values
+
+    for side, on_side in sides.items():
+        for stat, stat_events in SIDE_STATS:
+            flags[side + '_' + stat] = (on_side & pbp.event.isin(stat_events).values).astype(np.int64)
+        for stat in ['xg', 'shooter_xg']:
+            flags[side + '_' + stat] = np.where(on_side & is_fenwick, pbp[stat].fillna(0).values, 0)
+
+    is_fac = (pbp.event == 'FAC').values
+    for col, zone_col, zone in [('face_home_off', 'home_zone', 'Off'), ('face_home_def', 'home_zone', 'Def'),
+                                ('face_neu', 'home_zone', 'Neu'), ('face_ev_neu', 'ev_zone', 'Neu')]:
+        flags[col] = (is_fac & (pbp[zone_col] == zone).values).astype(np.int64)
+
+    return pd.concat([events, pd.DataFrame(flags, index=pbp.index)], axis=1)
+
+
+def side_rows(events, side, numbers):
+    """
+    Make the rows for one side (home or away) of the events. The numbers are from that side's point of view and the
+    strength is flipped for the away side.
+
+    :param events: DataFrame of classified events (grouped or not)
+    :param side: 'home' or 'away'
+    :param numbers: dict of column -> column in events for the home side (ex: TEAM_NUMBERS)
+
+    :return: DataFrame
+    """
+    other = 'away' if side == 'home' else 'home'
+    rows = pd.DataFrame({
+        'team': events[side + '_team'].values,
+        'game_id': events.game_id.values,
+        'date': events.date.values,
+        'opponent': events[other + '_team'].values,
+        'home': events.home_team.values,
+        'strength': (events.strength if side == 'home' else flip_strength(events.strength)).values,
+        'score_diff': events.score_diff.values,
+        'if_empty': events.if_empty.values,
+    })
+    for col, events_col in numbers.items():
+        rows[col] = events[events_col if side == 'home' else other_side(events_col)].values
+
+    return rows
+
+
+def match_rows(df, other, keys, cols):
+    """
+    Get columns from another DataFrame for each row (like an UPDATE ... FROM). Null keys never match like in SQL.
+
+    :param df: DataFrame of rows
+    :param other: DataFrame to get them from
+    :param keys: columns to match on
+    :param cols: columns to get (numbers)
+
+    :return: DataFrame of cols in the same order as df -> null if there was no match
+    """
+    matched = df[keys].merge(other[keys + cols].drop_duplicates(keys), on=keys, how='left')[cols].astype(float)
+    matched.loc[df[keys].isnull().any(axis=1).values] = np.nan
+
+    return matched
+
+
+def add_toi(df, toi, keys, toi_cols):
+    """
+    Add the TOI to the rows (the UPDATE ... FROM player_toi/team_toi). Strengths they were never on the ice for in a
+    game they played in get 0.
+
+    :param df: DataFrame of rows
+    :param toi: DataFrame of player or team TOI
+    :param keys: columns to match on -> The first is who the row is for (ex: player_id)
+    :param toi_cols: columns to add (ex: ['toi_on', 'toi_off'])
+
+    :return: DataFrame with TOI
+    """
+    toi_values = match_rows(df, toi, keys, toi_cols)
+    df = df.assign(**{col: toi_values[col].values for col in toi_cols})
+
+    game_keys = [keys[0], 'game_id']
+    played = pd.MultiIndex.from_frame(df[game_keys]).isin(pd.MultiIndex.from_frame(toi[game_keys]))
+    no_toi = df[toi_cols[0]].isnull().values & df.strength.isin(compile_toi.strengths).values & played
+    df.loc[no_toi, toi_cols] = 0
+
+    return df
+
+
+def add_missing_toi(df, toi, keys, cols):
+    """
+    Add the TOI rows that aren't in the rows yet. So strengths where nothing happened (ex: '2x2' -> NHL fucked up on
+    shifts so undefined strength) are still there.
+
+    :param df: DataFrame of rows
+    :param toi: DataFrame of player or team TOI (only the ones that should be added)
+    :param keys: columns to check if it's there
+    :param cols: columns to add
+
+    :return: DataFrame with the rows added
+    """
+    there = pd.MultiIndex.from_frame(toi[keys]).isin(pd.MultiIndex.from_frame(df[keys]))
+
+    return pd.concat([df, toi.loc[~there, cols]], ignore_index=True)
+
+
+def add_score_adjusted(df, coefficients, sides):
+    """
+    Add the score adjusted numbers (ex: shots_f_sa). The for numbers use the coefficient for the team's side and the
+    against numbers use the other side's. No coefficient (or no score_diff) is null.
+
+    :param df: DataFrame of rows
+    :param coefficients: DataFrame of score_coefficients
+    :param sides: ['f', 'a'] or just ['a']
+
+    :return: DataFrame with the columns
+    """
+    is_home = (df.team == df.home).values
+    score_diff = df.score_diff.astype(float)
+    coefs = {team: coefficients[coefficients.team == team].set_index('scorediff') for team in ['home', 'away']}
+
+    adjusted = dict()
+    for side in sides:
+        uses_home = is_home if side == 'f' else ~is_home
+        for stat, coef_col in SCORE_ADJUSTED:
+            home, away = [score_diff.map(coefs[team][coef_col]).values for team in ['home', 'away']]
+            col = '{}_{}'.format(stat, side)
+            adjusted[col + '_sa'] = df[col].values * np.where(uses_home, home, away)
+
+    return df.assign(**adjusted)
+
+
+def add_primary_key(df, who):
+    """
+    Add the primary key -> who-date-strength-if_empty
+
+    :param df: DataFrame of final rows
+    :param who: 'team' or 'player_id'
+
+    :return: None
+    """
+    who = df[who].astype('Int64').astype(str) if who == 'player_id' else df[who].fillna('')
+    df['primary_key'] = who + '-' + df.date.fillna('') + '-' + df.strength.fillna('') + '-' + df.if_empty.astype(str)
+
+
+def drop_key_collisions(df, table):
+    """
+    Only keep the row from the latest game (highest game_id) for each primary_key (like
+    aggregate_stats.create_stats_table) and print the games for any that were used more than once (like
+    aggregate_stats.report_key_collisions).
+
+    :param df: DataFrame of final rows
+    :param table: name of table
+
+    :return: DataFrame
+    """
+    copies = df.primary_key.duplicated(keep=False)
+    if not copies.any():
+        return df
+
+    kept = ~df.sort_values('game_id', ascending=False, kind='mergesort').primary_key.duplicated()
+    kept = kept.reindex(df.index).values
+
+    print("{} of the rows for {} had the same primary_key as another one".format(df.primary_key.duplicated().sum(),
+                                                                                 table))
+    key_rows = df[copies].assign(kept=kept[copies.values]).sort_values(['primary_key', 'game_id'])
+    aggregate_stats.report_key_collisions(key_rows[['primary_key', 'game_id', 'team', 'opponent', 'kept']]
+                                          .to_dict('records'))
+
+    return df[kept]
+
+
+def finish_rows(df, columns):
+    """
+    Put the columns in the order of the table with the right types
+
+    :param df: DataFrame of final rows
+    :param columns: columns of the table
+
+    :return: DataFrame
+    """
+    df = df[columns].reset_index(drop=True)
+    for col in columns:
+        if column_type(col) == 'bigint':
+            df[col] = pd.to_numeric(df[col]).round().astype('Int64')
+
+    return df
+
+
+def aggregate_teams(events, team_toi, coefficients):
+    """
+    Aggregate Stats for Teams -> aggregate_stats.aggregate_teams
+
+    :param events: DataFrame of classified events without the shootout
+    :param team_toi: DataFrame of team TOI
+    :param coefficients: DataFrame of score_coefficients
+
+    :return: DataFrame of team_stats
+    """
+    grouped = group_rows(events, EVENT_KEYS, ['date'], EVENT_COUNTS)
+    teams = pd.concat([side_rows(grouped, side, TEAM_NUMBERS) for side in ['home', 'away']], ignore_index=True)
+    teams = teams[teams.team.notnull()]
+
+    teams = add_toi(teams, team_toi, ['team', 'game_id', 'date', 'strength', 'if_empty'], ['toi'])
+    teams = add_missing_toi(teams, team_toi[team_toi.toi > 0], ['team', 'date', 'strength', 'if_empty'],
+                            ['team', 'game_id', 'date', 'home', 'opponent', 'strength', 'if_empty', 'toi'])
+
+    # Get rid useless rows
+    teams = teams[~(teams.toi.isnull() & (teams.corsi_f == 0) & (teams.corsi_a == 0))]
+    teams = add_score_adjusted(teams, coefficients, ['f', 'a'])
+
+    numbers = list(TEAM_NUMBERS) + ['{}_{}_sa'.format(stat, side) for side in ['f', 'a'] for stat, _ in SCORE_ADJUSTED]
+    teams = group_rows(teams, ['team', 'game_id', 'date', 'strength', 'if_empty'], ['opponent', 'home', 'toi'], numbers)
+    teams['season'] = get_season(teams.date)
+    add_primary_key(teams, 'team')
+
+    return finish_rows(drop_key_collisions(teams, 'team_stats'), TEAM_STATS_COLUMNS)
+
+
+# Columns of player_toi that are added as rows when they aren't there yet
+TOI_ROW_COLUMNS = ['player', 'player_id', 'game_id', 'date', 'team', 'home', 'opponent', 'strength', 'if_empty',
+                   'toi_on', 'toi_off']
+
+
+def aggregate_goalies(events, player_toi, coefficients):
+    """
+    Aggregate Stats for goalies -> aggregate_stats.aggregate_goalies. Each goalie only gets the numbers against.
+
+    :param events: DataFrame of classified events without the shootout
+    :param player_toi: DataFrame of player TOI
+    :param coefficients: DataFrame of score_coefficients
+
+    :return: DataFrame of goalie_stats
+    """
+    goalies = []
+    for side in ['home', 'away']:
+        grouped = group_rows(events, EVENT_KEYS + [side + '_goalie_id'], ['date', side + '_goalie'], EVENT_COUNTS)
+        goalies.append(side_rows(grouped, side, GOALIE_NUMBERS).assign(player=grouped[side + '_goalie'].values,
+                                                                       player_id=grouped[side + '_goalie_id'].values))
+    goalies = pd.concat(goalies, ignore_index=True)
+    goalies = goalies[goalies.player.notnull() & goalies.player_id.notnull()]
+
+    goalies = add_toi(goalies, player_toi, ['player_id', 'game_id', 'strength', 'if_empty'], ['toi_on', 'toi_off'])
+    goalies = add_missing_toi(goalies, player_toi[(player_toi.position == 'G') & (player_toi.toi_on > 0)],
+                              ['player_id', 'date', 'strength', 'if_empty'], TOI_ROW_COLUMNS)
+
+    # Get rid useless rows (corsi_a is for shootouts)
+    goalies = goalies[~(goalies.toi_on.isnull() & goalies.toi_off.isnull() & (goalies.corsi_a == 0))]
+    goalies = add_score_adjusted(goalies, coefficients, ['a'])
+
+    numbers = list(GOALIE_NUMBERS) + ['{}_a_sa'.format(stat) for stat, _ in SCORE_ADJUSTED]
+    goalies = group_rows(goalies, ['player_id', 'game_id', 'date', 'strength', 'if_empty'],
+                         ['player', 'team', 'opponent', 'home', 'toi_on', 'toi_off'], numbers)
+    goalies['season'] = get_season(goalies.date)
+    add_primary_key(goalies, 'player_id')
+    goalies = drop_key_collisions(goalies[goalies.opponent.notnull()], 'goalie_stats')
+
+    return finish_rows(goalies, GOALIE_STATS_COLUMNS)
+
+
+def on_ice_rows(events, pbp):
+    """
+    On-ice numbers for every player in the 12 player columns -> aggregate_stats.add_on_ice_stats. The 6 columns for
+    each side are stacked so every event is a row for each player on the ice and then it's one group by for the side.
+
+    :param events: DataFrame of classified events
+    :param pbp: DataFrame of pbp
+
+    :return: DataFrame
+    """
+    sides = []
+    for side in ['home', 'away']:
+        rows = side_rows(events, side, SKATER_NUMBERS)
+
+        slots = []
+        for x in range(1, 7):
+            player_id = pbp['{}player{}_id'.format(side, x)].values
+            on_ice = ~np.isnan(player_id)
+            slots.append(rows[on_ice].assign(player=pbp['{}player{}'.format(side, x)].values[on_ice],
+                                             player_id=player_id[on_ice]))
+
+        sides.append(group_rows(pd.concat(slots, ignore_index=True),
+                                ['player_id', 'game_id', 'strength', 'score_diff', 'if_empty'],
+                                ['player', 'date', 'team', 'opponent', 'home'], list(SKATER_NUMBERS)))
+
+    return pd.concat(sides, ignore_index=True)
+
+
+def individual_rows(pbp):
+    """
+    Individual numbers for skaters (the event players) -> aggregate_stats.aggregate_skater_individual
+
+    :param pbp: DataFrame of pbp
+
+    :return: DataFrame
+    """
+    is_fenwick = pbp.event.isin(FENWICK_EVENTS).values
+    opponent = np.where((pbp.ev_team == pbp.home_team).values, pbp.away_team.values, pbp.home_team.values)
+
+    slots = []
+    for x in range(1, 4):
+        player_id = pbp['p{}_id'.format(x)]
+        in_event = {col: (pbp[col] == player_id).values for col in ['p1_id', 'p2_id', 'p3_id']}
+
+        rows = {'player': pbp['p{}_name'.format(x)].values, 'player_id': player_id.values,
+                'game_id': pbp.game_id.values, 'date': pbp.date.values, 'team': pbp.ev_team.values, 'opponent': opponent,
+                'home': pbp.home_team.values, 'strength': pbp.strength.values, 'score_diff': pbp.score_diff.values,
+                'if_empty': pbp.if_empty.values}
+        for stat, stat_events, col in INDIVIDUAL_STATS:
+            rows[stat] = (pbp.event.isin(stat_events).values & in_event[col]).astype(np.int64)
+        for stat, xg_col in [('ixg', 'xg'), ('shooter_ixg', 'shooter_xg')]:
+            rows[stat] = np.where(is_fenwick & in_event['p1_id'], pbp[xg_col].fillna(0).values, 0)
+        rows['icors'] = ((is_fenwick & in_event['p1_id']) | ((pbp.event == 'BLOCK').values & in_event['p2_id']))\
+            .astype(np.int64)
+
+        rows = pd.DataFrame(rows)[player_id.notnull().values]
+        slots.append(group_rows(rows, ['player_id', 'game_id', 'date', 'strength', 'score_diff', 'if_empty'],
+                                ['player', 'team', 'opponent', 'home'], INDIVIDUAL_COLUMNS))
+    ind = pd.concat(slots, ignore_index=True)
+
+    # Fix Strength if Away Team
+    away = ind.team.notnull() & ind.home.notnull() & (ind.team != ind.home)
+    ind['strength'] = flip_strength(ind.strength).where(away, ind.strength)
+
+    ind = group_rows(ind, ['player_id', 'game_id', 'date', 'strength', 'if_empty'],
+                     ['player', 'team', 'opponent', 'home'], INDIVIDUAL_COLUMNS)
+
+    # The SQL sums ixg for this one too
+    ind['shooter_ixg'] = ind.ixg
+
+    return ind
+
+
+def off_ice_column(col):
+    """
+    Get the off-ice column for an on-ice one (ex: shots_f -> shots_f_off, shots_f_sa -> shots_f_off_sa)
+
+    :param col: on-ice column
+
+    :return: off-ice column
+    """
+    return col[:-3] + '_off_sa' if col.endswith('_sa') else col + '_off'
+
+
+def aggregate_skaters(events, pbp, player_toi, team_stats, coefficients, players):
+    """
+    Aggregate numbers for skaters -> aggregate_stats.aggregate_skater_on_ice, aggregate_skater_individual, and
+    aggregate_skaters.
+
+    :param events: DataFrame of classified events
+    :param pbp: DataFrame of pbp
+    :param player_toi: DataFrame of player TOI
+    :param team_stats: DataFrame of team_stats (aggregate_teams) -> For the off-ice numbers
+    :param coefficients: DataFrame of score_coefficients
+    :param players: PlayerRegistry
+
+    :return: DataFrame of skater_stats
+    """
+    keys = ['player_id', 'game_id', 'date', 'strength', 'if_empty']
+
+    skaters = on_ice_rows(events, pbp)
+    skaters = skaters[skaters.player.notnull()]
+
+    skaters = add_toi(skaters, player_toi, ['player_id', 'game_id', 'strength', 'if_empty'], ['toi_on', 'toi_off'])
+    is_skater = player_toi.position.notnull() & (player_toi.position != 'G') & (player_toi.toi_on > 0)
+    skaters = add_missing_toi(skaters, player_toi[is_skater], ['player_id', 'date', 'strength', 'if_empty'],
+                              TOI_ROW_COLUMNS)
+
+    # Add Position and handedness
+    skaters = skaters.assign(position=players.positions(skaters.player_id, default=None),
+                             handedness=players.handedness(skaters.player_id, default=None))
+    skaters = skaters[skaters.position != 'G']
+    skaters = add_score_adjusted(skaters, coefficients, ['f', 'a'])
+
+    numbers = list(SKATER_NUMBERS) + ['{}_{}_sa'.format(stat, side) for side in ['f', 'a']
+                                      for stat, _ in SCORE_ADJUSTED]
+    skaters = group_rows(skaters, keys, ['player', 'position', 'handedness', 'team', 'opponent', 'home', 'toi_on',
+                                         'toi_off'], numbers)
+    skaters['toi_off'] = skaters.toi_off.fillna(0)
+    skaters['season'] = get_season(skaters.date)
+    add_primary_key(skaters, 'player_id')
+    skaters = drop_key_collisions(skaters, 'skater_stats').reset_index(drop=True)
+
+    # Off-ice is the team's numbers - the player's
+    team_numbers = match_rows(skaters, team_stats, ['team', 'game_id', 'strength', 'if_empty'], OFF_ICE_COLUMNS)
+    for col in OFF_ICE_COLUMNS:
+        skaters[off_ice_column(col)] = team_numbers[col].values - skaters[col].values
+
+    # Merge in the individual numbers
+    ind = match_rows(skaters, individual_rows(pbp), keys, INDIVIDUAL_COLUMNS)
+    for col in INDIVIDUAL_COLUMNS:
+        skaters[col] = ind[col].fillna(0).values
+
+    return finish_rows(skaters, SKATER_STATS_COLUMNS)
+
+
+def aggregate_frames(pbp, player_toi, team_toi, coefficients, players):
+    """
+    Aggregate Stats for each - Teams/Goalies/Skaters
+
+    :param pbp: DataFrame of pbp (returned by push_to_db.push_to_db)
+    :param player_toi: DataFrame of player TOI (see toi_frames)
+    :param team_toi: DataFrame of team TOI (see toi_frames)
+    :param coefficients: DataFrame of score_coefficients (see get_score_coefficients)
+    :param players: PlayerRegistry (see player_registry.get_registry)
+
+    :return: team_stats, goalie_stats, skater_stats
+    """
+    pbp = prepare_pbp(pbp)
+    player_toi = player_toi.assign(player_id=pd.to_numeric(player_toi.player_id, errors='coerce').astype(float))
+
+    # Every event is classified once. Teams and goalies don't include the shootout.
+    events = classify_events(pbp)
+    not_shootout = events[events.period.notnull() & (events.period != 5)]
+
+    teams = aggregate_teams(not_shootout, team_toi, coefficients)
+    goalies = aggregate_goalies(not_shootout, player_toi, coefficients)
+    skaters = aggregate_skaters(events, pbp, player_toi, teams, coefficients, players)
+
+    return teams, goalies, skaters
+
+
+def collect_toi(toi_games, player_rows, team_rows):
+    """
+    Hold onto the player and team TOI rows as they come in from compile_toi.iter_games instead of loading them. The
+    pair rows still go through.
+
+    :param toi_games: Iterable of (player rows, team rows, pair rows) for each game
+    :param player_rows: list to add the player rows to
+    :param team_rows: list to add the team rows to
+
+    :return: Generator of ([], [], pair rows) for each game
+    """
+    for game_players, game_teams, game_pairs in toi_games:
+        player_rows.extend(game_players)
+        team_rows.extend(game_teams)
+        yield [], [], game_pairs
+
+
+def toi_frames(player_rows, team_rows, pbp):
+    """
+    Make the player and team TOI into DataFrames like the player_toi and team_toi tables
+
+    :param player_rows: list of player rows (see collect_toi)
+    :param team_rows: list of team rows
+    :param pbp: DataFrame of pbp -> For the home team and opponent
+
+    :return: player_toi, team_toi
+    """
+    games = pbp.groupby('game_id')[['home_team', 'away_team']].first()
+
+    player_toi = pd.DataFrame(player_rows, columns=compile_toi.PLAYER_COLUMNS)
+    team_toi = pd.DataFrame(team_rows, columns=compile_toi.TEAM_COLUMNS)
+    for df in [player_toi, team_toi]:
+        ptd.add_home_opponent(df, games)
+
+    return player_toi, team_toi
+
+
+def get_score_coefficients(cur):
+    """
+    Get the score_coefficients table
+
+    :param cur: cursor
+
+    :return: DataFrame
+    """
+    cur.execute("SELECT team, scorediff, shots, fenwick, corsi FROM score_coefficients;")
+    coefficients = pd.DataFrame(cur.fetchall(), columns=['team', 'scorediff', 'shots', 'fenwick', 'corsi'])
+
+    return coefficients.astype({'scorediff': float, 'shots': float, 'fenwick': float, 'corsi': float})
+
+
+def stats_to_db(cur, table, df):
+    """
+    Make one of the stats tables out of the rows. The primary_key is unique like in aggregate_stats.create_stats_table
+    (the rows were already checked for that).
+
+    :param cur: cursor
+    :param table: name of table (ex: team_stats)
+    :param df: DataFrame of rows
+
+    :return: None
+    """
+    cur.execute("DROP TABLE IF EXISTS {};".format(table))
+    ptd.create_table(cur, table, [(col, column_type(col)) for col in df.columns])
+    cur.execute("ALTER TABLE {table} ADD CONSTRAINT {table}_primary_key UNIQUE (primary_key);".format(table=table))
+    ptd.copy_df(cur, df, [table])
+
+
+def aggregate_all(pbp, player_toi, team_toi, staged_dates=None):
+    """
+    Aggregate stats for each - Teams/Goalies/Skaters and send them to the site
+
+    :param pbp: DataFrame of pbp (returned by push_to_db.push_to_db)
+    :param player_toi: DataFrame of player TOI (see toi_frames)
+    :param team_toi: DataFrame of team TOI (see toi_frames)
+    :param staged_dates: (from_date, to_date) -> See aggregate_stats.aggregate_all
+    """
+    conn = None
+
+    try:
+        conn = psycopg2.connect(host=HOST, database="nhl_data", user=USERNAME, password=PASSWORD)
+        conn_web = psycopg2.connect(host=HOST, database=SITE_DB, user=USERNAME, password=PASSWORD)
+        cur = conn.cursor()
+        cur_web = conn_web.cursor()
+
+        start = time.time()
+        stats = aggregate_frames(pbp, player_toi, team_toi, get_score_coefficients(cur),
+                                 player_registry.get_registry())
+        print("Finished aggregating in {:.2f}s".format(time.time() - start))
+
+        for table, df in zip(['team_stats', 'goalie_stats', 'skater_stats'], stats):
+            stats_to_db(cur, table, df)
+        conn.commit()
+
+        aggregate_stats.send_to_web(cur_web, conn_web, staged_dates)
+        aggregate_stats.drop_tables(cur, conn)
+
+        cur.close()
+        conn.commit()
+        cur_web.close()
+        conn_web.commit()
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(error)
+    finally:
+        if conn is not None:
+            conn.close()
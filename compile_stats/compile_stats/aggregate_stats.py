@@ -1,81 +1,13 @@
+import os
 import psycopg2
 import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 sys.path.append("..")
 from machine_info import *
 
-
-def add_goalies_to_web(cur_web):
-    """
-    Adds new goalie data to website
-    :param cur_web: 
-    """
-    cur_web.execute(
-        """
-        CREATE EXTENSION dblink;
-        
-        INSERT INTO goalies_goalies
-        SELECT * 
-        FROM dblink('dbname=nhl_data port=5432 host={}
-                user={} password={}', 'SELECT * FROM goalie_stats')
-        AS t(player TEXT, player_id TEXT, game_id SMALLINT, season SMALLINT, date DATE, team TEXT, opponent TEXT, home TEXT, 
-        strength TEXT, shots_a SMALLINT, goals_a SMALLINT, fenwick_a SMALLINT, xg_a REAL, corsi_a SMALLINT, toi_on BIGINT,
-        toi_off BIGINT, shots_a_sa REAL, fenwick_a_sa REAL, corsi_a_sa REAL, if_empty SMALLINT, primary_key TEXT,
-        shooter_xg_a REAL);
-        """.format(HOST, USERNAME, PASSWORD)
-    )
-
-
-def add_teams_to_web(cur_web):
-    """
-    Adds new team data to website
-    :param cur_web: 
-    """
-    cur_web.execute(
-        """
-        -- CREATE EXTENSION dblink;
-
-        INSERT INTO teams_teams
-        SELECT * 
-        FROM dblink('dbname=nhl_data port=5432 host={}
-                user={} password={}', 'SELECT * FROM team_stats')
-        AS t(team TEXT, game_id SMALLINT, season SMALLINT, date DATE,  opponent TEXT, home TEXT, strength TEXT, toi BIGINT,
-        shots_f SMALLINT, goals_f SMALLINT, fenwick_f SMALLINT, xg_f REAL, corsi_f SMALLINT,  shots_a SMALLINT, 
-        goals_a SMALLINT, fenwick_a SMALLINT, xg_a REAL, corsi_a SMALLINT, pent SMALLINT, pend SMALLINT, gives SMALLINT,
-        takes SMALLINT, hits_f SMALLINT, hits_a SMALLINT, face_w SMALLINT, face_l SMALLINT, face_Off SMALLINT, 
-        face_Def SMALLINT, face_Neu SMALLINT, shots_f_sa REAL, fenwick_f_sa REAL, corsi_f_sa REAL, shots_a_sa REAL, 
-        fenwick_a_sa REAL, corsi_a_sa REAL, if_empty SMALLINT, primary_key TEXT, shooter_xg_a REAL, shooter_xg_f REAL);
-        """.format(HOST, USERNAME, PASSWORD)
-    )
-
-
-def add_skaters_to_web(cur_web):
-    """
-    Adds new team data to website
-    :param cur_web: 
-    """
-    cur_web.execute(
-        """
-        -- CREATE EXTENSION dblink;
-
-        INSERT INTO skaters_skaters
-        SELECT * 
-        FROM dblink('dbname=nhl_data port=5432 host={}
-                user={} password={}', 'SELECT * FROM skater_stats')
-        AS t(player TEXT, player_id BIGINT, position TEXT, handedness TEXT, season SMALLINT, game_id SMALLINT, date DATE,
-        team TEXT, opponent TEXT, home TEXT, strength TEXT, toi_on BIGINT, goals SMALLINT, a1 SMALLINT, a2 SMALLINT, 
-        isf SMALLINT, ifen SMALLINT, ixg REAL, icors SMALLINT, iBlocks SMALLINT, pen_drawn SMALLINT, pen_taken SMALLINT,
-        gives SMALLINT, takes SMALLINT, hits_f SMALLINT, hits_a SMALLINT, ifac_win SMALLINT, ifac_loss SMALLINT, 
-        shots_f SMALLINT, goals_f SMALLINT, fenwick_f SMALLINT, xg_f REAL, corsi_f SMALLINT, shots_a SMALLINT,
-        goals_a SMALLINT, fenwick_a SMALLINT, xg_a REAL, corsi_a SMALLINT, shots_f_sa REAL, fenwick_f_sa REAL, 
-        corsi_f_sa REAL, shots_a_sa REAL, fenwick_a_sa REAL, corsi_a_sa REAL, face_off SMALLINT, face_def SMALLINT,
-        face_neu SMALLINT, toi_off BIGINT, shots_f_off SMALLINT, goals_f_off SMALLINT, fenwick_f_off SMALLINT, 
-        xg_f_off REAL, corsi_f_off SMALLINT, shots_a_off SMALLINT, goals_a_off SMALLINT, fenwick_a_off SMALLINT, 
-        xg_a_off REAL, corsi_a_off SMALLINT, shots_f_off_sa REAL, fenwick_f_off_sa REAL, corsi_f_off_sa REAL, 
-        shots_a_off_sa REAL, fenwick_a_off_sa REAL, corsi_a_off_sa REAL, face_off_off SMALLINT, face_neu_off SMALLINT, 
-        face_def_off SMALLINT,  if_empty SMALLINT, primary_key TEXT, shooter_xg_a REAL, shooter_xg_a_off REAL, 
-        shooter_xg_f REAL, shooter_xg_f_off REAL, shooter_ixg REAL)
-        """.format(HOST, USERNAME, PASSWORD)
-    )
+from compile_stats import compile_toi
 
 
 def drop_tables(cur, conn):
@@ -89,6 +21,7 @@ def drop_tables(cur, conn):
         DROP TABLE IF EXISTS goalie_stats;
         DROP TABLE IF EXISTS team_stats;
         DROP TABLE IF EXISTS skater_stats;
+        DROP TABLE IF EXISTS game_events;
         DROP TABLE IF EXISTS pbp;
         """
     )
@@ -96,126 +29,459 @@ def drop_tables(cur, conn):
     conn.commit()
 
 
-def add_empty_net_column(cur, conn):
+# Strengths that get TOI (compile_toi.strengths) -> For "strength IN (...)"
+TOI_STRENGTHS = ', '.join("'{}'".format(strength) for strength in compile_toi.strengths)
+
+# nhl_data table -> site table it goes to
+WEB_TABLES = [('goalie_stats', 'goalies_goalies'), ('team_stats', 'teams_teams'), ('skater_stats', 'skaters_skaters')]
+
+
+class CountingReader:
+    """
+    Wraps the read end of the pipe so the bytes sent to the site can be counted
+    """
+    def __init__(self, pipe):
+        self.pipe = pipe
+        self.bytes = 0
+
+    def read(self, size=-1):
+        data = self.pipe.read(size)
+        self.bytes += len(data)
+        return data
+
+    def readline(self, size=-1):
+        data = self.pipe.readline(size)
+        self.bytes += len(data)
+        return data
+
+
+def copy_to_web(table, web_table):
+    """
+    Stream a table in nhl_data into a site table. One connection runs COPY TO STDOUT into a pipe and the other runs 
+    COPY FROM STDIN out of it so nothing is held in memory. The columns go in order (like the old INSERT ... SELECT *).
+
+    :param table: table in nhl_data (ex: goalie_stats)
+    :param web_table: table on the site to add to (ex: goalies_goalies)
+
+    :return: rows, bytes
+    """
+    conn = psycopg2.connect(host=HOST, database="nhl_data", user=USERNAME, password=PASSWORD)
+    conn_web = psycopg2.connect(host=HOST, database=SITE_DB, user=USERNAME, password=PASSWORD)
+    read_fd, write_fd = os.pipe()
+    errors = []
+
+    def copy_out():
+        try:
+            with os.fdopen(write_fd, 'wb') as pipe:
+                conn.cursor().copy_expert("COPY {} TO STDOUT".format(table), pipe)
+        except Exception as error:
+            errors.append(error)
+
+    start = time.time()
+    cur_web = conn_web.cursor()
+    writer = threading.Thread(target=copy_out)
+    writer.start()
+
+    try:
+        # If this fails the pipe is closed so the writer stops too
+        with os.fdopen(read_fd, 'rb') as pipe:
+            reader = CountingReader(pipe)
+            cur_web.copy_expert("COPY {} FROM STDIN".format(web_table), reader)
+        writer.join()
+
+        # Only keep it if everything came over
+        if errors:
+            raise errors[0]
+        conn_web.commit()
+
+        print("{} -> {}: {} rows, {} bytes in {:.2f}s".format(table, web_table, cur_web.rowcount, reader.bytes,
+                                                            time.time() - start))
+        return cur_web.rowcount, reader.bytes
+    finally:
+        writer.join()
+        conn.close()
+        conn_web.close()
+
+
+def add_to_web(staged=False):
+    """
+    Copy the stats to the site. All the tables go at the same time.
+
+    :param staged: Put them in the staging tables instead
+
+    :return: None
+    """
+    suffix = '_staged' if staged else ''
+    with ThreadPoolExecutor(max_workers=len(WEB_TABLES)) as executor:
+        transfers = [executor.submit(copy_to_web, table, web_table + suffix) for table, web_table in WEB_TABLES]
+        for transfer in transfers:
+            transfer.result()
+
+
+def send_to_web(cur_web, conn_web, staged_dates=None):
+    """
+    Copy the stats to the site. Either straight in or through the staging tables.
+
+    :param cur_web: cursor for site db
+    :param conn_web: connection to site db
+    :param staged_dates: (from_date, to_date) -> The rows for those dates are swapped in at the end if given
+
+    :return: None
+    """
+    if staged_dates is None:
+        add_to_web()
+    else:
+        create_staging_tables(cur_web)
+        conn_web.commit()
+        add_to_web(staged=True)
+        publish_staging_tables(cur_web, conn_web, staged_dates[0], staged_dates[1])
+
+
+def create_staging_tables(cur_web):
+    """
+    Create an empty shadow table for each site table. The new rows are put here first so nothing is missing from the
+    site while everything is being compiled.
+
+    :param cur_web: cursor for site db
+
+    :return: None
+    """
+    for _, table in WEB_TABLES:
+        cur_web.execute(
+            """
+            DROP TABLE IF EXISTS {table}_staged;
+            CREATE TABLE {table}_staged (LIKE {table} INCLUDING DEFAULTS);
+            """.format(table=table)
+        )
+
+
+def publish_staging_tables(cur_web, conn_web, from_date, to_date):
+    """
+    Swap the staged rows in for those dates. The old rows are deleted and the new ones are inserted in one transaction
+    so readers either see all the old rows or all the new ones. The shadow tables are dropped after.
+
+    :param cur_web: cursor for site db
+    :param conn_web: connection to site db
+    :param from_date: date from
+    :param to_date: date to
+
+    :return: None
+    """
+    conn_web.commit()
+
+    for _, table in WEB_TABLES:
+        start = time.time()
+        cur_web.execute(
+            """
+            DELETE FROM {table} WHERE date >= %(from_date)s AND date <= %(to_date)s;
+            INSERT INTO {table} SELECT * FROM {table}_staged;
+            """.format(table=table), {'from_date': from_date, 'to_date': to_date}
+        )
+        print("Swapped in {} rows for {} in {:.3f}s".format(cur_web.rowcount, table, time.time() - start))
+    conn_web.commit()
+
+    for _, table in WEB_TABLES:
+        cur_web.execute("DROP TABLE IF EXISTS {}_staged;".format(table))
+    conn_web.commit()
+
+
+def create_stats_table(cur, table, select):
     """
-    Add column indicating if empty net for both teams
-    case when event = 'GOAL' AND ev_team = home_team then 1 else 0 end)
+    Make one of the stats tables (team_stats, goalie_stats, skater_stats) out of a query. The primary_key is unique so
+    there can't be duplicates -> The rows go in from the latest game to the earliest (highest game_id first) with ON
+    CONFLICT DO NOTHING. So if a key comes up more than once the row from the latest game is kept (the old duplicate
+    removal kept the row that went in last). The rows that had that key are printed (see report_key_collisions).
+
+    The query is only run once. The rows for keys that came up more than once come back from the same statement.
+
+    :param cur: cursor
+    :param table: name of table
+    :param select: query for the rows (needs a primary_key column)
+
+    :return: None
     """
     cur.execute(
         """
-        ALTER TABLE pbp ADD COLUMN if_empty SMALLINT;
-        
-        UPDATE pbp
-        SET if_empty = CASE WHEN (home_goalie_id IS NULL or away_goalie_id IS NULL) THEN 1 ELSE 0 END;
+        DROP TABLE IF EXISTS {table};
+        CREATE TABLE {table} AS {select} WITH NO DATA;
+        ALTER TABLE {table} ADD CONSTRAINT {table}_primary_key UNIQUE (primary_key);
+        """.format(table=table, select=select)
+    )
+
+    cur.execute(
         """
+        WITH new_rows AS MATERIALIZED ({select}),
+        inserted AS (
+            INSERT INTO {table} SELECT * FROM new_rows ORDER BY game_id DESC
+            ON CONFLICT (primary_key) DO NOTHING
+            RETURNING primary_key, game_id, team
+        ),
+        copies AS (
+            SELECT primary_key FROM new_rows GROUP BY primary_key HAVING count(*) > 1
+        )
+        SELECT n.primary_key, n.game_id, n.team, n.opponent, i.primary_key IS NOT NULL AS kept
+        FROM new_rows n
+        JOIN copies c ON c.primary_key = n.primary_key
+        LEFT JOIN inserted i ON i.primary_key = n.primary_key AND i.game_id = n.game_id AND i.team = n.team
+        ORDER BY n.primary_key, n.game_id;
+        """.format(table=table, select=select)
     )
-    conn.commit()
+    columns = [desc[0] for desc in cur.description]
+    collisions = [dict(zip(columns, row)) for row in cur.fetchall()]
+
+    if collisions:
+        num_skipped = len(collisions) - len(set(row['primary_key'] for row in collisions))
+        print("{} of the rows for {} had the same primary_key as another one".format(num_skipped, table))
+        report_key_collisions(collisions)
+
 
+def report_key_collisions(collisions):
+    """
+    Print the games for each primary_key that came up more than once. The key doesn't have the game_id in it so it's
+    usually the same player/team in two games on the same day.
+
+    :param collisions: list of dicts for each row that has a key that's used more than once (primary_key, game_id,
+                       team, opponent, kept)
 
-def add_score_column(cur, conn):
+    :return: None
     """
-    Adds score_diff columns -3 -> 3+ to pbp
+    games = dict()
+    for row in collisions:
+        games.setdefault(row['primary_key'], []).append("{} ({} vs {}){}".format(
+            row['game_id'], row['team'], row['opponent'], ' <- kept' if row['kept'] else ''))
+
+    for key, key_games in games.items():
+        print("{}: games {}".format(key, ', '.join(key_games)))
+
+
+def classify_events(cur):
     """
+    Scan pbp once for both the team and goalie numbers. Every event is classified once (which side it's for and if it's
+    a shot/fenwick/corsi/etc.) and then counted for 3 groupings at the same time:
+        'team' -> game/strength/score/if_empty
+        'home_goalie' -> that + the home goalie
+        'away_goalie' -> that + the away goalie
+
+    Every count is for both sides (home_* and away_*) and the strength is from the home team's point of view like in
+    pbp. The rows go in game_events which aggregate_teams and aggregate_goalies pull from.
 
+    :param cur: cursor
+
+    :return: None
+    """
     cur.execute(
         """
-        ALTER TABLE pbp ADD COLUMN score_diff SMALLINT;
-        
-
-        UPDATE pbp
-        SET score_diff = home_score - away_score;
-        
-        -- Make bins for +3 and -3
-        UPDATE pbp
-        SET score_diff = CASE WHEN score_diff > 3 THEN 3 ELSE score_diff END;
-        
-        UPDATE pbp
-        SET score_diff = CASE WHEN score_diff < -3 THEN - 3 ELSE score_diff END;
+        DROP TABLE IF EXISTS game_events;
+        CREATE TABLE game_events
+        AS
+        SELECT
+        CASE GROUPING(e.home_goalie_id, e.away_goalie_id)
+            WHEN 1 THEN 'home_goalie' WHEN 2 THEN 'away_goalie' ELSE 'team' END as level,
+        e.game_id,
+        max(e.date) as date,
+        e.home_team,
+        e.away_team,
+        e.home_goalie_id,
+        max(e.home_goalie) as home_goalie,
+        e.away_goalie_id,
+        max(e.away_goalie) as away_goalie,
+        e.strength,
+        e.score_diff,
+        e.if_empty,
+        count(*) FILTER (WHERE e.side = 'home' AND e.is_shot) home_shots,
+        count(*) FILTER (WHERE e.side = 'home' AND e.event = 'GOAL') home_goals,
+        count(*) FILTER (WHERE e.side = 'home' AND e.is_fenwick) home_fenwick,
+        COALESCE(sum(e.xg) FILTER (WHERE e.side = 'home' AND e.is_fenwick), 0) home_xg,
+        COALESCE(sum(e.shooter_xg) FILTER (WHERE e.side = 'home' AND e.is_fenwick), 0) home_shooter_xg,
+        count(*) FILTER (WHERE e.side = 'home' AND e.is_corsi) home_corsi,
+        count(*) FILTER (WHERE e.side = 'home' AND e.event = 'PENL') home_pent,
+        count(*) FILTER (WHERE e.side = 'home' AND e.event = 'GIVE') home_gives,
+        count(*) FILTER (WHERE e.side = 'home' AND e.event = 'TAKE') home_takes,
+        count(*) FILTER (WHERE e.side = 'home' AND e.event = 'HIT') home_hits,
+        count(*) FILTER (WHERE e.side = 'home' AND e.event = 'FAC') home_face_w,
+        count(*) FILTER (WHERE e.side = 'away' AND e.is_shot) away_shots,
+        count(*) FILTER (WHERE e.side = 'away' AND e.event = 'GOAL') away_goals,
+        count(*) FILTER (WHERE e.side = 'away' AND e.is_fenwick) away_fenwick,
+        COALESCE(sum(e.xg) FILTER (WHERE e.side = 'away' AND e.is_fenwick), 0) away_xg,
+        COALESCE(sum(e.shooter_xg) FILTER (WHERE e.side = 'away' AND e.is_fenwick), 0) away_shooter_xg,
+        count(*) FILTER (WHERE e.side = 'away' AND e.is_corsi) away_corsi,
+        count(*) FILTER (WHERE e.side = 'away' AND e.event = 'PENL') away_pent,
+        count(*) FILTER (WHERE e.side = 'away' AND e.event = 'GIVE') away_gives,
+        count(*) FILTER (WHERE e.side = 'away' AND e.event = 'TAKE') away_takes,
+        count(*) FILTER (WHERE e.side = 'away' AND e.event = 'HIT') away_hits,
+        count(*) FILTER (WHERE e.side = 'away' AND e.event = 'FAC') away_face_w,
+        count(*) FILTER (WHERE e.event = 'FAC' AND e.home_zone = 'Off') face_home_off,
+        count(*) FILTER (WHERE e.event = 'FAC' AND e.home_zone = 'Def') face_home_def,
+        count(*) FILTER (WHERE e.event = 'FAC' AND e.home_zone = 'Neu') face_neu
+        FROM (
+            SELECT
+            game_id, date, home_team, away_team, home_goalie_id, home_goalie, away_goalie_id, away_goalie, strength,
+            score_diff, if_empty, event, xg, shooter_xg, home_zone,
+            CASE WHEN ev_team = home_team THEN 'home' WHEN ev_team = away_team THEN 'away' END as side,
+            event IN ('GOAL', 'SHOT') as is_shot,
+            event IN ('GOAL', 'SHOT', 'MISS') as is_fenwick,
+            event IN ('GOAL', 'SHOT', 'MISS', 'BLOCK') as is_corsi
+            FROM pbp
+            WHERE period != 5
+        ) e
+        GROUP BY e.game_id, e.home_team, e.away_team, e.strength, e.score_diff, e.if_empty,
+        GROUPING SETS ((), (e.home_goalie_id), (e.away_goalie_id));
         """
     )
 
-    conn.commit()
-
 
-def aggregate_goalies(cur, conn):
-    """
-    Aggregate Stats for goalies
+def create_goalie_tmp_stats(cur):
     """
+    Make tmp_stats for the goalies out of game_events (see classify_events). Each goalie only gets the numbers against.
 
-    commands = (
+    :param cur: cursor
 
-        """ 
-        DROP TABLE IF EXISTS home;
-        CREATE TABLE home
+    :return: None
+    """
+    cur.execute(
+        """
+        DROP TABLE IF EXISTS tmp_stats;
+        CREATE TEMP TABLE tmp_stats
         AS
-        SELECT 
-        MAX(home_goalie) as player,
+        SELECT
+        home_goalie as player,
         home_goalie_id as player_id,
         game_id,
-        max(date) as date,
-        max(home_team) as team,
-        max(away_team) as opponent,
-        max(home_team) as home,
+        date,
+        home_team as team,
+        away_team as opponent,
+        home_team as home,
         strength,
         score_diff,
-        sum(case when event IN ('GOAL', 'SHOT') AND ev_team = away_team then 1 else 0 end) Shots_a,
-        sum(case when event = 'GOAL' AND ev_team = away_team then 1 else 0 end) Goals_a,
-        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = away_team then 1 else 0 end) fenwick_a,
-        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = away_team then xg else 0 end) xg_a,
-        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = away_team then shooter_xg else 0 end) shooter_xg_a,
-        sum(case when event IN ('GOAL', 'SHOT', 'MISS', 'BLOCK') AND ev_team = away_team then 1 else 0 end) corsi_a,
+        away_shots Shots_a,
+        away_goals Goals_a,
+        away_fenwick fenwick_a,
+        away_xg xg_a,
+        away_shooter_xg shooter_xg_a,
+        away_corsi corsi_a,
         if_empty
-        FROM pbp 
-        WHERE period != 5
-        GROUP BY home_goalie_id, game_id, strength, score_diff, if_empty;
-        """,
-
-        """
-        DROP TABLE IF EXISTS away;
-        CREATE TABLE away
-        AS
-        SELECT 
-        MAX(away_goalie) as player,
+        FROM game_events
+        WHERE level = 'home_goalie'
+        UNION
+        SELECT
+        away_goalie as player,
         away_goalie_id as player_id,
         game_id,
-        max(date) as date,
-        max(away_team) as team,
-        max(home_team) as opponent,
-        max(home_team) as home,
-        strength,
+        date,
+        away_team as team,
+        home_team as opponent,
+        home_team as home,
+        -- Strength in pbp is 'home_num x away_num'...need to flip this for away to get them on the same scale
+        SUBSTR(strength, 3, 1) || 'x' || SUBSTR(strength, 1, 1) as strength,
         score_diff,
-        sum(case when event IN ('GOAL', 'SHOT') AND ev_team = home_team then 1 else 0 end) Shots_a,
-        sum(case when event = 'GOAL' AND ev_team = home_team then 1 else 0 end) Goals_a,
-        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = home_team then 1 else 0 end) fenwick_a,
-        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = home_team then xg else 0 end) xg_a,
-        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = home_team then shooter_xg else 0 end) shooter_xg_a,
-        sum(case when event IN ('GOAL', 'SHOT', 'MISS', 'BLOCK') AND ev_team = home_team then 1 else 0 end) corsi_a,
+        home_shots Shots_a,
+        home_goals Goals_a,
+        home_fenwick fenwick_a,
+        home_xg xg_a,
+        home_shooter_xg shooter_xg_a,
+        home_corsi corsi_a,
         if_empty
-        FROM pbp
-        WHERE period != 5
-        GROUP BY away_goalie_id, game_id, strength, score_diff, if_empty;
-        """,
-
+        FROM game_events
+        WHERE level = 'away_goalie';
         """
-        -- Strength in pbp is 'home_num x away_num'...would need to flip this in away
-        -- to get them on the same scale
-        UPDATE away
-        SET strength = SUBSTR(strength, 3, 1) || 'x' || SUBSTR(strength, 1, 1);
-        """,
+    )
+
+
+def create_team_tmp_stats(cur):
+    """
+    Make tmp_stats for the teams out of game_events (see classify_events).
 
+    :param cur: cursor
+
+    :return: None
+    """
+    cur.execute(
         """
         DROP TABLE IF EXISTS tmp_stats;
         CREATE TEMP TABLE tmp_stats
         AS
-        SELECT * FROM home
+        SELECT
+        home_team as team,
+        game_id,
+        date,
+        away_team as opponent,
+        home_team as home,
+        strength,
+        score_diff,
+        home_shots Shots_f,
+        home_goals Goals_f,
+        home_fenwick Fenwick_f,
+        home_xg xg_f,
+        home_shooter_xg shooter_xg_f,
+        home_corsi Corsi_f,
+        home_pent Pent,
+        home_gives Gives,
+        home_takes Takes,
+        home_hits Hits_f,
+        home_face_w Face_w,
+        away_shots Shots_a,
+        away_goals Goals_a,
+        away_fenwick Fenwick_a,
+        away_xg xg_a,
+        away_shooter_xg shooter_xg_a,
+        away_corsi Corsi_a,
+        away_pent Pend,
+        away_hits Hits_a,
+        away_face_w Face_l,
+        face_home_off Face_Off,
+        face_home_def Face_Def,
+        face_neu Face_Neu,
+        if_empty
+        FROM game_events
+        WHERE level = 'team'
         UNION
-        SELECT * FROM away;
-        """,
-
+        SELECT
+        away_team as team,
+        game_id,
+        date,
+        home_team as opponent,
+        home_team as home,
+        -- Strength in pbp is 'home_num x away_num'...need to flip this for away to get them on the same scale
+        SUBSTR(strength, 3, 1) || 'x' || SUBSTR(strength, 1, 1) as strength,
+        score_diff,
+        away_shots Shots_f,
+        away_goals Goals_f,
+        away_fenwick Fenwick_f,
+        away_xg xg_f,
+        away_shooter_xg shooter_xg_f,
+        away_corsi Corsi_f,
+        away_pent Pent,
+        away_gives Gives,
+        away_takes Takes,
+        away_hits Hits_f,
+        away_face_w Face_w,
+        home_shots Shots_a,
+        home_goals Goals_a,
+        home_fenwick Fenwick_a,
+        home_xg xg_a,
+        home_shooter_xg shooter_xg_a,
+        home_corsi Corsi_a,
+        home_pent Pend,
+        home_hits Hits_a,
+        home_face_w Face_l,
+        face_home_def Face_Off,
+        face_home_off Face_Def,
+        face_neu Face_Neu,
+        if_empty
+        FROM game_events
+        WHERE level = 'team';
         """
-        DROP TABLE home;
-        DROP TABLE away;
-        """,
+    )
+
+
+def aggregate_goalies(cur, conn):
+    """
+    Aggregate Stats for goalies
+    """
+
+    create_goalie_tmp_stats(cur)
+
+    commands = (
 
         """
         -- Delete where name = null
@@ -236,21 +502,17 @@ def aggregate_goalies(cur, conn):
         AND player_toi.game_id = tmp_stats.game_id
         AND player_toi.strength = tmp_stats.strength
         AND player_toi.if_empty = tmp_stats.if_empty;
-        """,
-
-        """
-        -- Add home team and opponent to TOI b4 adding it into master
-        ALTER TABLE player_toi ADD COLUMN home TEXT, ADD COLUMN opponent TEXT;
         
-        UPDATE player_toi p
-        SET 
-            home = t.home,
-            opponent = t.opponent
-        FROM tmp_stats t
+        -- Strengths the goalie's team never played at aren't in player_toi
+        UPDATE tmp_stats
+        SET toi_on = 0,
+            toi_off = 0
         WHERE
-        p.player_id = t.player_id  
-        AND p.date = t.date;
-        """,
+        toi_on IS NULL
+        AND strength IN ({strengths})
+        AND EXISTS (SELECT 1 FROM player_toi WHERE player_toi.player_id = tmp_stats.player_id 
+                    AND player_toi.game_id = tmp_stats.game_id);
+        """.format(strengths=TOI_STRENGTHS),
 
         """
         -- Insert those with '2x2' (NHL fucked up on shifts so undefined strength) into table
@@ -335,11 +597,13 @@ def aggregate_goalies(cur, conn):
                           WHEN date BETWEEN '2020-09-01' AND '2021-07-01' THEN 2020
                     END;
         """
+    )
 
+    for command in commands:
+        cur.execute(command)
+
+    create_stats_table(cur, 'goalie_stats',
         """
-        DROP TABLE IF EXISTS goalie_stats;
-        CREATE TABLE goalie_stats
-        AS
         SELECT 
         MAX(player) as player,
         player_id,
@@ -365,22 +629,10 @@ def aggregate_goalies(cur, conn):
         COALESCE(sum(shooter_xg_a),0) shooter_xg_a
         FROM tmp_stats 
         GROUP BY player_id, game_id, date, strength, if_empty
-        """,
-
-
+        HAVING max(opponent) IS NOT NULL
         """
-        -- Get rid of duplicate rows .... I have no idea what's causing it
-        DELETE FROM goalie_stats USING goalie_stats gs2
-            WHERE 
-                (goalie_stats.primary_key = gs2.primary_key AND goalie_stats.ctid < gs2.ctid)
-                OR goalie_stats.opponent IS NULL;;
-        """
-
     )
 
-    for command in commands:
-        cur.execute(command)
-
     # Commit All Changes
     conn.commit()
 
@@ -390,110 +642,9 @@ def aggregate_teams(cur, conn):
     Aggregate Stats for Teams
     
     """
-    commands = (
-        """ 
-        DROP TABLE IF EXISTS home;
-        CREATE TABLE home
-        AS
-        SELECT 
-        home_team as team,
-        game_id,
-        max(date) as date,
-        max(away_team) as opponent,
-        max(home_team) as home,
-        strength,
-        score_diff,
-        sum(case when event IN ('GOAL', 'SHOT') AND ev_team = home_team then 1 else 0 end) Shots_f,
-        sum(case when event = 'GOAL' AND ev_team = home_team then 1 else 0 end) Goals_f,
-        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = home_team then 1 else 0 end) Fenwick_f,
-        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = home_team then xg else 0 end) xg_f,
-        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = home_team then shooter_xg else 0 end) shooter_xg_f,
-        sum(case when event IN ('GOAL', 'SHOT', 'MISS', 'BLOCK') AND ev_team = home_team then 1 else 0 end) Corsi_f,
-        sum(case when event = 'PENL' AND ev_team = home_team then 1 else 0 end) Pent,
-        sum(case when event = 'GIVE' AND ev_team = home_team then 1 else 0 end) Gives,
-        sum(case when event = 'TAKE' AND ev_team = home_team then 1 else 0 end) Takes,
-        sum(case when event = 'HIT' AND ev_team = home_team then 1 else 0 end) Hits_f,
-        sum(case when event = 'FAC' AND ev_team = home_team then 1 else 0 end) Face_w,
-        sum(case when event IN ('GOAL', 'SHOT') AND ev_team = away_team then 1 else 0 end) Shots_a,
-        sum(case when event = 'GOAL' AND ev_team = away_team then 1 else 0 end) Goals_a,
-        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = away_team then 1 else 0 end) Fenwick_a,
-        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = away_team then xg else 0 end) xg_a,
-        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = away_team then shooter_xg else 0 end) shooter_xg_a,
-        sum(case when event IN ('GOAL', 'SHOT', 'MISS', 'BLOCK') AND ev_team = away_team then 1 else 0 end) Corsi_a,
-        sum(case when event = 'PENL' AND ev_team = away_team then 1 else 0 end) Pend,
-        sum(case when event = 'HIT' AND ev_team = away_team then 1 else 0 end) Hits_a,
-        sum(case when event = 'FAC' AND ev_team = away_team then 1 else 0 end) Face_l,
-        sum(case when event = 'FAC' and home_zone = 'Off' then 1 else 0 end) Face_Off,
-        sum(case when event = 'FAC' and home_zone = 'Def' then 1 else 0 end) Face_Def,
-        sum(case when event = 'FAC' and home_zone = 'Neu' then 1 else 0 end) Face_Neu,
-        if_empty
-        FROM pbp 
-        WHERE period != 5
-        GROUP BY home_team, game_id, strength, score_diff, if_empty;
-        """,
-
-        """ 
-        DROP TABLE IF EXISTS away;
-        CREATE TABLE away
-        AS
-        SELECT 
-        away_team as team,
-        game_id,
-        max(date) as date,
-        max(home_team) as opponent,
-        max(home_team) as home,
-        strength,
-        score_diff,
-        sum(case when event IN ('GOAL', 'SHOT') AND ev_team = away_team then 1 else 0 end) Shots_f,
-        sum(case when event = 'GOAL' AND ev_team = away_team then 1 else 0 end) Goals_f,
-        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = away_team then 1 else 0 end) Fenwick_f,
-        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = away_team then xg else 0 end) xg_f,
-        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = away_team then shooter_xg else 0 end) shooter_xg_f,
-        sum(case when event IN ('GOAL', 'SHOT', 'MISS', 'BLOCK') AND ev_team = away_team then 1 else 0 end) Corsi_f,
-        sum(case when event = 'PENL' AND ev_team = away_team then 1 else 0 end) Pent,
-        sum(case when event = 'GIVE' AND ev_team = away_team then 1 else 0 end) Gives,
-        sum(case when event = 'TAKE' AND ev_team = away_team then 1 else 0 end) Takes,
-        sum(case when event = 'HIT' AND ev_team = away_team then 1 else 0 end) Hits_f,
-        sum(case when event = 'FAC' AND ev_team = away_team then 1 else 0 end) Face_w,
-        sum(case when event IN ('GOAL', 'SHOT') AND ev_team = home_team then 1 else 0 end) Shots_a,
-        sum(case when event = 'GOAL' AND ev_team = home_team then 1 else 0 end) Goals_a,
-        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = home_team then 1 else 0 end) Fenwick_a,
-        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = home_team then xg else 0 end) xg_a,
-        sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = home_team then shooter_xg else 0 end) shooter_xg_a,
-        sum(case when event IN ('GOAL', 'SHOT', 'MISS', 'BLOCK') AND ev_team = home_team then 1 else 0 end) Corsi_a,
-        sum(case when event = 'PENL' AND ev_team = home_team then 1 else 0 end) Pend,
-        sum(case when event = 'HIT' AND ev_team = home_team then 1 else 0 end) Hits_a,
-        sum(case when event = 'FAC' AND ev_team = home_team then 1 else 0 end) Face_l,
-        sum(case when event = 'FAC' and home_zone = 'Def' then 1 else 0 end) Face_Off,
-        sum(case when event = 'FAC' and home_zone = 'Off' then 1 else 0 end) Face_Def,
-        sum(case when event = 'FAC' and home_zone = 'Neu' then 1 else 0 end) Face_Neu,
-        if_empty
-        FROM pbp 
-        WHERE period != 5
-        GROUP BY away_team, game_id, strength, score_diff, if_empty;
-        """,
-
-        """
-        -- Strength in pbp is 'home_num x away_num'...would need to flip this in away
-        -- to get them on the same scale
-        UPDATE away
-        SET strength = SUBSTR(strength, 3, 1) || 'x' || SUBSTR(strength, 1, 1);
-        """,
-
-        """
-        DROP TABLE IF EXISTS tmp_stats;
-        CREATE TEMP TABLE tmp_stats
-        AS
-        SELECT * FROM home 
-        UNION
-        SELECT * FROM away;
-        """,
-
-        """
-        DROP TABLE home;
-        DROP TABLE away;
-        """,
+    create_team_tmp_stats(cur)
 
+    commands = (
         """
         -- Mark if home or away team and make tmp_strength
         ALTER TABLE tmp_stats ADD COLUMN home_or_away TEXT, ADD COLUMN tmp_strength TEXT;
@@ -523,21 +674,16 @@ def aggregate_teams(cur, conn):
         AND team_toi.date = tmp_stats.date
         AND team_toi.strength = tmp_stats.strength
         AND team_toi.if_empty = tmp_stats.if_empty;
-        """,
-
-        """
-        -- Add home team and opponent to TOI b4 adding it into master
-        ALTER TABLE team_toi ADD COLUMN home TEXT, ADD COLUMN opponent TEXT;
         
-        UPDATE team_toi p
-        SET 
-            home = t.home,
-            opponent = t.opponent
-        FROM tmp_stats t
+        -- Strengths the team never played at aren't in team_toi
+        UPDATE tmp_stats
+        SET toi = 0
         WHERE
-        p.team = t.team
-        AND p.date = t.date;
-        """,
+        toi IS NULL
+        AND strength IN ({strengths})
+        AND EXISTS (SELECT 1 FROM team_toi WHERE team_toi.team = tmp_stats.team 
+                    AND team_toi.game_id = tmp_stats.game_id);
+        """.format(strengths=TOI_STRENGTHS),
 
         """
         -- Insert those with '2x2' (NHL fucked up on shifts so undefined strength) into table
@@ -619,13 +765,14 @@ def aggregate_teams(cur, conn):
                           WHEN date BETWEEN '2019-09-01' AND '2020-07-01' THEN 2019
                           WHEN date BETWEEN '2020-09-01' AND '2021-07-01' THEN 2020
                     END;
-        """,
-
         """
-        DROP TABLE IF EXISTS team_stats;
+    )
 
-        CREATE TABLE team_stats
-        AS
+    for command in commands:
+        cur.execute(command)
+
+    create_stats_table(cur, 'team_stats',
+        """
         SELECT 
         team,
         game_id,
@@ -667,39 +814,100 @@ def aggregate_teams(cur, conn):
         COALESCE(sum(shooter_xg_a),0) shooter_xg_a,
         COALESCE(sum(shooter_xg_f),0) shooter_xg_f
         FROM tmp_stats
-        GROUP BY team, game_id, date, strength, if_empty;
-        """,
-
-        """
-        -- Get rid of duplicate rows .... I have no idea what's causing it
-        DELETE FROM team_stats USING team_stats ts2
-            WHERE team_stats.primary_key = ts2.primary_key AND team_stats.ctid < ts2.ctid;
+        GROUP BY team, game_id, date, strength, if_empty
         """
     )
 
-    for command in commands:
-        cur.execute(command)
-
     conn.commit()
 
 
-def aggregate_skaters(cur, conn):
+# Memory for grouping the on-ice numbers for skaters (only for that transaction)
+ON_ICE_WORK_MEM = '512MB'
+
+
+def add_on_ice_stats(cur, table):
     """
-    Aggregate numbers for skaters
-    There's a shitload of comments throughout so look through it
+    Add the on-ice numbers for every player to a table in one pass over pbp. The 12 player columns are unpivoted so 
+    each event is a row for every player on the ice. Each slot is still it's own row in the table (like when each one 
+    was done by itself).
+    
+    Everything is from the player's point of view -> For an away player the strength is flipped and the zones are
+    switched.
+    
+    :param cur: cursor
+    :param table: table to add to (ex: skater_tmp_stats)
+    
+    :return: None
+    """
+    # Every player/game/strength is a group in one hash table now (instead of a table for each slot). If it doesn't fit
+    # in memory it spills to disk and that's slower than the old way.
+    cur.execute("SET LOCAL work_mem = %s;", (ON_ICE_WORK_MEM,))
+
+    slots = []
+    for x in range(1, 7):
+        slots.append("({0}, p.homeplayer{0}, p.homeplayer{0}_id, p.home_team, p.away_team, 'Off', 'Def', TRUE)".format(x))
+        slots.append("({0}, p.awayplayer{0}, p.awayplayer{0}_id, p.away_team, p.home_team, 'Def', 'Off', FALSE)".format(x))
+
+    cur.execute(
+        """
+        INSERT INTO {}(player, player_id, game_id, date, team, opponent, home, strength, score_diff, Shots_f,
+        Goals_f, Fenwick_f, xg_f, shooter_xg_f, Corsi_f, Shots_a, Goals_a, Fenwick_a, xg_a, shooter_xg_a, Corsi_a,
+        Face_Off, Face_Def, Face_Neu, if_empty)
+        SELECT 
+        max(s.player) as player,
+        s.player_id,
+        p.game_id,
+        max(p.date) as date,
+        max(s.team) as team,
+        max(s.opponent) as opponent,
+        max(p.home_team) as home,
+        -- Strength in pbp is 'home_num x away_num'...need to flip this for away to get them on the same scale
+        CASE WHEN s.is_home THEN p.strength ELSE SUBSTR(p.strength, 3, 1) || 'x' || SUBSTR(p.strength, 1, 1) END,
+        p.score_diff,
+        count(*) FILTER (WHERE p.event IN ('SHOT', 'GOAL') AND p.ev_team = s.team) Shots_f,
+        count(*) FILTER (WHERE p.event = 'GOAL' AND p.ev_team = s.team) Goals_f,
+        count(*) FILTER (WHERE p.event IN ('GOAL', 'SHOT', 'MISS') AND p.ev_team = s.team) Fenwick_f,
+        COALESCE(sum(p.xg) FILTER (WHERE p.event IN ('GOAL', 'SHOT', 'MISS') AND p.ev_team = s.team), 0) xg_f,
+        COALESCE(sum(p.shooter_xg) FILTER (WHERE p.event IN ('GOAL', 'SHOT', 'MISS') AND p.ev_team = s.team), 0) 
+            shooter_xg_f,
+        count(*) FILTER (WHERE p.event IN ('GOAL', 'SHOT', 'MISS', 'BLOCK') AND p.ev_team = s.team) Corsi_f,
+        count(*) FILTER (WHERE p.event IN ('SHOT', 'GOAL') AND p.ev_team = s.opponent) Shots_a,
+        count(*) FILTER (WHERE p.event = 'GOAL' AND p.ev_team = s.opponent) Goals_a,
+        count(*) FILTER (WHERE p.event IN ('GOAL', 'SHOT', 'MISS') AND p.ev_team = s.opponent) Fenwick_a,
+        COALESCE(sum(p.xg) FILTER (WHERE p.event IN ('GOAL', 'SHOT', 'MISS') AND p.ev_team = s.opponent), 0) xg_a,
+        COALESCE(sum(p.shooter_xg) FILTER (WHERE p.event IN ('GOAL', 'SHOT', 'MISS') AND p.ev_team = s.opponent), 0) 
+            shooter_xg_a,
+        count(*) FILTER (WHERE p.event IN ('GOAL', 'SHOT', 'MISS', 'BLOCK') AND p.ev_team = s.opponent) Corsi_a,
+        count(*) FILTER (WHERE p.event = 'FAC' AND p.home_zone = s.off_zone) Face_Off,
+        count(*) FILTER (WHERE p.event = 'FAC' AND p.home_zone = s.def_zone) Face_Def,
+        count(*) FILTER (WHERE p.event = 'FAC' AND p.ev_zone = 'Neu') Face_Neu,
+        p.if_empty
+        FROM pbp p
+        CROSS JOIN LATERAL (VALUES {}) AS s(slot, player, player_id, team, opponent, off_zone, def_zone, is_home)
+        -- These would just be deleted after
+        WHERE s.player_id IS NOT NULL
+        GROUP BY s.slot, s.is_home, s.player_id, p.game_id, p.strength, p.score_diff, p.if_empty;
+        """.format(table, ', '.join(slots))
+    )
+
+
+def aggregate_skater_on_ice(cur, conn):
+    """
+    Aggregate the on-ice numbers for skaters (and TOI, score adjusted numbers, and season) into skater_tmp_stats. This
+    and aggregate_skater_individual don't depend on each other so they can run at the same time.
     """
 
     ########################################
     # 1
-    # Create Initial Tables for on-ice stats and individual stats
+    # Create Initial Table for on-ice stats
     ########################################
 
     # Create the final table first
     cur.execute(
         """
-        DROP TABLE IF EXISTS tmp_stats;
+        DROP TABLE IF EXISTS skater_tmp_stats;
         
-        CREATE TEMP TABLE tmp_stats(
+        CREATE UNLOGGED TABLE skater_tmp_stats(
         player TEXT,
         player_id BIGINT,
         game_id SMALLINT,
@@ -777,10 +985,158 @@ def aggregate_skaters(cur, conn):
         """
     )
 
-    # Drop if exists and create framework for individual stats Table
-    cur.execute(
-        """
-        DROP TABLE IF EXISTS ind_skater_stats_tmp;
+    #################################################
+    # 2
+    # Aggregate on ice numbers for each home and away player (1-6)
+    # Don't group by score_diff bec. not needed (don't need to score adjust)
+    #################################################
+
+    add_on_ice_stats(cur, 'skater_tmp_stats')
+
+    #################################################
+    # 3
+    # Main portion of code
+    # Adds in: TOI (on and off), score adjusted numbers, and season
+    # In process gets rid of useless rows and stuff
+    # (The off-ice numbers and the individual numbers are merged in at the end -> aggregate_skaters)
+    #################################################
+
+    cur.execute(
+        """
+        -- Delete where player or player_id = null
+        DELETE from skater_tmp_stats
+        WHERE
+        player IS NULL OR player_id IS NULL;
+        
+        
+        -- Problem with this is that it gives TOI to each score diff
+        -- I just select MAX later when group by
+        UPDATE skater_tmp_stats
+        SET toi_on = player_toi.toi_on,
+            toi_off = player_toi.toi_off
+        FROM player_toi
+        WHERE
+        player_toi.player_id = skater_tmp_stats.player_id
+        AND player_toi.game_id  = skater_tmp_stats.game_id
+        AND player_toi.strength = skater_tmp_stats.strength
+        AND player_toi.if_empty = skater_tmp_stats.if_empty;
+        
+        
+        -- Strengths the player's team never played at aren't in player_toi
+        UPDATE skater_tmp_stats
+        SET toi_on = 0,
+            toi_off = 0
+        WHERE
+        toi_on IS NULL
+        AND strength IN ({strengths})
+        AND EXISTS (SELECT 1 FROM player_toi WHERE player_toi.player_id = skater_tmp_stats.player_id 
+                    AND player_toi.game_id = skater_tmp_stats.game_id);
+        
+        
+        -- Insert those with '2x2' (NHL fucked up on shifts so undefined strength) into table
+        INSERT INTO skater_tmp_stats (player, player_id, game_id, date, team, home, opponent, strength, if_empty, toi_on, toi_off)
+        SELECT
+        p.player, p.player_id, p.game_id, p.date, p.team, p.home, p.opponent, p.strength, p.if_empty, p.toi_on, p.toi_off
+        FROM
+        player_toi p
+        WHERE NOT EXISTS (
+            SELECT * from skater_tmp_stats t 
+            WHERE t.player_id = p.player_id
+            AND t.date = p.date
+            AND t.strength = p.strength
+            AND t.if_empty = p.if_empty
+        )
+        AND
+        p.position != 'G'
+        AND
+        p.toi_on > 0;
+        
+        
+        -- Add Position and handedness
+        UPDATE skater_tmp_stats
+        SET 
+            position = nhl_players.position,
+            handedness = nhl_players.shoots_catches
+        FROM nhl_players
+        WHERE
+        nhl_players.id = skater_tmp_stats.player_id;
+        
+        
+        -- Get rid of useless rows 
+        DELETE FROM skater_tmp_stats
+        WHERE (toi_on IS NULL AND toi_off IS NULL AND iCors = 0) OR position = 'G';
+        
+        
+        -- Mark if home or away team and make tmp_strength
+       ALTER TABLE skater_tmp_stats ADD COLUMN home_or_away TEXT, ADD COLUMN tmp_strength TEXT;
+       UPDATE skater_tmp_stats
+        SET 
+           home_or_away = CASE WHEN team = home THEN 'home' ELSE 'away' END,
+           tmp_strength = CASE WHEN strength = '5x5' THEN '5v5' ELSE 'All' END;
+           
+           
+       UPDATE skater_tmp_stats
+        SET
+        shots_f_sa = shots_f * (SELECT shots FROM score_coefficients WHERE skater_tmp_stats.home_or_away = team 
+                                AND skater_tmp_stats.score_diff = score_coefficients.scorediff),
+        fenwick_f_sa = fenwick_f * (SELECT fenwick FROM score_coefficients WHERE skater_tmp_stats.home_or_away = team 
+                                    AND skater_tmp_stats.score_diff = score_coefficients.scorediff),
+        corsi_f_sa = corsi_f * (SELECT corsi FROM score_coefficients WHERE skater_tmp_stats.home_or_away = team 
+                                AND skater_tmp_stats.score_diff = score_coefficients.scorediff),
+        shots_a_sa = shots_a * (SELECT shots FROM score_coefficients WHERE skater_tmp_stats.home_or_away != team 
+                                AND skater_tmp_stats.score_diff = score_coefficients.scorediff),
+        fenwick_a_sa = fenwick_a * (SELECT fenwick FROM score_coefficients WHERE skater_tmp_stats.home_or_away != team  
+                                    AND skater_tmp_stats.score_diff = score_coefficients.scorediff),
+        corsi_a_sa = corsi_a * (SELECT corsi FROM score_coefficients WHERE skater_tmp_stats.home_or_away != team 
+                                AND skater_tmp_stats.score_diff = score_coefficients.scorediff);
+        
+        
+        -- Get rid of useless columns
+        ALTER TABLE skater_tmp_stats DROP COLUMN home_or_away, DROP COLUMN tmp_strength;
+        
+        
+        -- Add season column
+        ALTER TABLE skater_tmp_stats ADD COLUMN season SMALLINT;
+
+        UPDATE skater_tmp_stats
+        SET
+            season = CASE 
+                          WHEN date BETWEEN '2007-09-01' AND '2008-07-01' THEN 2007
+                          WHEN date BETWEEN '2008-09-01' AND '2009-07-01' THEN 2008
+                          WHEN date BETWEEN '2009-09-01' AND '2010-07-01' THEN 2009
+                          WHEN date BETWEEN '2010-09-01' AND '2011-07-01' THEN 2010
+                          WHEN date BETWEEN '2011-09-01' AND '2012-07-01' THEN 2011
+                          WHEN date BETWEEN '2012-09-01' AND '2013-07-01' THEN 2012
+                          WHEN date BETWEEN '2013-09-01' AND '2014-07-01' THEN 2013
+                          WHEN date BETWEEN '2014-09-01' AND '2015-07-01' THEN 2014
+                          WHEN date BETWEEN '2015-09-01' AND '2016-07-01' THEN 2015
+                          WHEN date BETWEEN '2016-09-01' AND '2017-07-01' THEN 2016
+                          WHEN date BETWEEN '2017-09-01' AND '2018-07-01' THEN 2017
+                          WHEN date BETWEEN '2018-09-01' AND '2019-07-01' THEN 2018
+                          WHEN date BETWEEN '2019-09-01' AND '2020-07-01' THEN 2019
+                          WHEN date BETWEEN '2020-09-01' AND '2021-07-01' THEN 2020
+                    END;
+        """.format(strengths=TOI_STRENGTHS)
+    )
+
+    # Commit All Changes
+    conn.commit()
+
+
+def aggregate_skater_individual(cur, conn):
+    """
+    Aggregate the individual numbers for skaters (the event players) into ind_skater_stats
+    """
+
+    ########################################
+    # 1
+    # Create Initial Table for individual stats
+    ########################################
+
+    # Drop if exists and create framework for individual stats Table
+    cur.execute(
+        """
+        DROP TABLE IF EXISTS ind_skater_stats_tmp;
         
         CREATE TEMP TABLE ind_skater_stats_tmp(
         player TEXT,
@@ -874,7 +1230,7 @@ def aggregate_skaters(cur, conn):
     cur.execute(
         """
         DROP TABLE IF EXISTS ind_skater_stats;
-        CREATE TEMP TABLE ind_skater_stats
+        CREATE UNLOGGED TABLE ind_skater_stats
         AS
         SELECT 
         MAX(player) as player,
@@ -910,253 +1266,20 @@ def aggregate_skaters(cur, conn):
         """
     )
 
-    #################################################
-    # 3
-    # Aggregate on ice numbers for each home and away play (1-6)
-    # Then group up by player, game, strength, if_empty (since bec. 3 slots can have multiple for each
-    # Don't group by score_diff bec. not needed (don't need to score adjust)
-    #################################################
-
-    for x in range(1, 7):
-        players = [''.join(['homeplayer', str(x)]),
-                   ''.join(['homeplayer', str(x), '_id']),
-                   ''.join(['awayplayer', str(x)]),
-                   ''.join(['awayplayer', str(x), '_id'])
-                   ]
-
-        commands = (
-
-            """
-            DROP TABLE IF EXISTS home;
-            CREATE TABLE home
-            AS
-            SELECT 
-            max({0}) as player,
-            {1} as player_id,
-            game_id,
-            max(date) as date,
-            max(home_team) as team,
-            max(away_team) as opponent,
-            max(home_team) as home,
-            strength,
-            score_diff,
-            sum(case when event IN ('SHOT', 'GOAL') AND ev_team = home_team then 1 else 0 end) Shots_f,
-            sum(case when event = 'GOAL' AND ev_team = home_team then 1 else 0 end) Goals_f,
-            sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = home_team then 1 else 0 end) Fenwick_f,
-            sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = home_team then xg else 0 end) xg_f,
-            sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = home_team then shooter_xg else 0 end) shooter_xg_f,
-            sum(case when event IN ('GOAL', 'SHOT', 'MISS', 'BLOCK') AND ev_team = home_team then 1 else 0 end) Corsi_f,
-            sum(case when event IN ('SHOT', 'GOAL') AND ev_team = away_team then 1 else 0 end) Shots_a,
-            sum(case when event = 'GOAL' AND ev_team = away_team then 1 else 0 end) Goals_a,
-            sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = away_team then 1 else 0 end) Fenwick_a,
-            sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = away_team then xg else 0 end) xg_a,
-            sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = away_team then shooter_xg else 0 end) shooter_xg_a,
-            sum(case when event IN ('GOAL', 'SHOT', 'MISS', 'BLOCK') AND ev_team = away_team then 1 else 0 end) Corsi_a,
-            sum(case when event = 'FAC' and home_zone = 'Off' then 1 else 0 end) Face_Off,
-            sum(case when event = 'FAC' and home_zone = 'Def' then 1 else 0 end) Face_Def,
-            sum(case when event = 'FAC' and ev_zone = 'Neu' then 1 else 0 end) Face_Neu,
-            if_empty
-            FROM pbp 
-            GROUP BY {1}, game_id, strength, score_diff, if_empty;
-            """.format(players[0], players[1]),
-
-            """ 
-            DROP TABLE IF EXISTS away;
-            CREATE TABLE away
-            AS
-            SELECT 
-            max({0}) as player,
-            {1} as player_id,
-            game_id,
-            max(date) as date,
-            max(away_team) as team,
-            max(home_team) as opponent,
-            max(home_team) as home,
-            strength,
-            score_diff,
-            sum(case when event IN ('SHOT', 'GOAL') AND ev_team = away_team then 1 else 0 end) Shots_f,
-            sum(case when event = 'GOAL' AND ev_team = away_team then 1 else 0 end) Goals_f,
-            sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = away_team then 1 else 0 end) Fenwick_f,
-            sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = away_team then xg else 0 end) xg_f,
-            sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = away_team then shooter_xg else 0 end) shooter_xg_f,
-            sum(case when event IN ('GOAL', 'SHOT', 'MISS', 'BLOCK') AND ev_team = away_team then 1 else 0 end) Corsi_f,
-            sum(case when event IN ('SHOT', 'GOAL') AND ev_team = home_team then 1 else 0 end) Shots_a,
-            sum(case when event = 'GOAL' AND ev_team = home_team then 1 else 0 end) Goals_a,
-            sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = home_team then 1 else 0 end) Fenwick_a,
-            sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = home_team then xg else 0 end) xg_a,
-            sum(case when event IN ('GOAL', 'SHOT', 'MISS') AND ev_team = home_team then shooter_xg else 0 end) shooter_xg_a,
-            sum(case when event IN ('GOAL', 'SHOT', 'MISS', 'BLOCK') AND ev_team = home_team then 1 else 0 end) Corsi_a,
-            sum(case when event = 'FAC' and home_zone = 'Def' then 1 else 0 end) Face_Off,
-            sum(case when event = 'FAC' and home_zone = 'Off' then 1 else 0 end) Face_Def,
-            sum(case when event = 'FAC' and ev_zone = 'Neu' then 1 else 0 end) Face_Neu,
-            if_empty
-            FROM pbp 
-            GROUP BY {1}, game_id, strength, score_diff, if_empty;
-            """.format(players[2], players[3]),
-
-            """
-            -- Strength in pbp is 'home_num x away_num'...would need to flip this in away to get them on the same scale
-            UPDATE away
-            SET strength = SUBSTR(strength, 3, 1) || 'x' || SUBSTR(strength, 1, 1);
-            """,
-
-            """
-            INSERT INTO tmp_stats(player, player_id, game_id, date, team, opponent, home, strength, score_diff, Shots_f,
-            Goals_f, Fenwick_f, xg_f, shooter_xg_f, Corsi_f, Shots_a, Goals_a, Fenwick_a, xg_a, shooter_xg_a, Corsi_a,
-            Face_Off, Face_Def, Face_Neu, if_empty)
-            SELECT 
-            player, player_id, game_id, date, team, opponent, home, strength, score_diff, Shots_f,
-            Goals_f, Fenwick_f, xg_f, shooter_xg_f, Corsi_f, Shots_a, Goals_a, Fenwick_a, xg_a, shooter_xg_a, Corsi_a,
-            Face_Off, Face_Def, Face_Neu, if_empty
-            FROM home;
-            
-            INSERT INTO tmp_stats(player, player_id, game_id, date, team, opponent, home, strength, score_diff, Shots_f,
-            Goals_f, Fenwick_f, xg_f, shooter_xg_f, Corsi_f, Shots_a, Goals_a, Fenwick_a, xg_a, shooter_xg_a, Corsi_a,
-            Face_Off, Face_Def, Face_Neu, if_empty)
-            SELECT 
-            player, player_id, game_id, date, team, opponent, home, strength, score_diff, Shots_f,
-            Goals_f, Fenwick_f, xg_f, shooter_xg_f, Corsi_f, Shots_a, Goals_a, Fenwick_a, xg_a, shooter_xg_a, Corsi_a,
-            Face_Off, Face_Def, Face_Neu, if_empty
-            FROM away;
-            """,
+    # Commit All Changes
+    conn.commit()
 
-            """
-            DROP TABLE home;
-            DROP TABLE away;
-            """
-        )
 
-        for command in commands:
-            cur.execute(command)
+def aggregate_skaters(cur, conn):
+    """
+    Aggregate numbers for skaters
+    There's a shitload of comments throughout so look through it
 
-    #################################################
-    # 4
-    # Main portion of code
-    # Adds in: TOI (on and off), score adjusted numbers (on and off), off-ice numbers, and season
-    # Also merges in individual numbers to master
-    # In process gets rid of useless rows and stuff
-    #################################################
+    Needs team_stats and the tables from aggregate_skater_on_ice and aggregate_skater_individual
+    """
 
-    cur.execute(
+    create_stats_table(cur, 'skater_stats',
         """
-        -- Delete where player or player_id = null
-        DELETE from tmp_stats
-        WHERE
-        player IS NULL OR player_id IS NULL;
-        
-        
-        -- Problem with this is that it gives TOI to each score diff
-        -- I just select MAX later when group by
-        UPDATE tmp_stats
-        SET toi_on = player_toi.toi_on,
-            toi_off = player_toi.toi_off
-        FROM player_toi
-        WHERE
-        player_toi.player_id = tmp_stats.player_id
-        AND player_toi.game_id  = tmp_stats.game_id
-        AND player_toi.strength = tmp_stats.strength
-        AND player_toi.if_empty = tmp_stats.if_empty;
-        
-        
-        -- Add home team and opponent to TOI b4 adding it into master
-        UPDATE player_toi p
-        SET 
-            home = t.home,
-            opponent = t.opponent
-        FROM tmp_stats t
-        WHERE
-        p.player_id = t.player_id  
-        AND p.date = t.date;
-
-
-        -- Insert those with '2x2' (NHL fucked up on shifts so undefined strength) into table
-        INSERT INTO tmp_stats (player, player_id, game_id, date, team, home, opponent, strength, if_empty, toi_on, toi_off)
-        SELECT
-        p.player, p.player_id, p.game_id, p.date, p.team, p.home, p.opponent, p.strength, p.if_empty, p.toi_on, p.toi_off
-        FROM
-        player_toi p
-        WHERE NOT EXISTS (
-            SELECT * from tmp_stats t 
-            WHERE t.player_id = p.player_id
-            AND t.date = p.date
-            AND t.strength = p.strength
-            AND t.if_empty = p.if_empty
-        )
-        AND
-        p.position != 'G'
-        AND
-        p.toi_on > 0;
-        
-        
-        -- Add Position and handedness
-        UPDATE tmp_stats
-        SET 
-            position = nhl_players.position,
-            handedness = nhl_players.shoots_catches
-        FROM nhl_players
-        WHERE
-        nhl_players.id = tmp_stats.player_id;
-        
-        
-        -- Get rid of useless rows 
-        DELETE FROM tmp_stats
-        WHERE (toi_on IS NULL AND toi_off IS NULL AND iCors = 0) OR position = 'G';
-        
-        
-        -- Mark if home or away team and make tmp_strength
-       ALTER TABLE tmp_stats ADD COLUMN home_or_away TEXT, ADD COLUMN tmp_strength TEXT;
-       UPDATE tmp_stats
-        SET 
-           home_or_away = CASE WHEN team = home THEN 'home' ELSE 'away' END,
-           tmp_strength = CASE WHEN strength = '5x5' THEN '5v5' ELSE 'All' END;
-           
-           
-       UPDATE tmp_stats
-        SET
-        shots_f_sa = shots_f * (SELECT shots FROM score_coefficients WHERE tmp_stats.home_or_away = team 
-                                AND tmp_stats.score_diff = score_coefficients.scorediff),
-        fenwick_f_sa = fenwick_f * (SELECT fenwick FROM score_coefficients WHERE tmp_stats.home_or_away = team 
-                                    AND tmp_stats.score_diff = score_coefficients.scorediff),
-        corsi_f_sa = corsi_f * (SELECT corsi FROM score_coefficients WHERE tmp_stats.home_or_away = team 
-                                AND tmp_stats.score_diff = score_coefficients.scorediff),
-        shots_a_sa = shots_a * (SELECT shots FROM score_coefficients WHERE tmp_stats.home_or_away != team 
-                                AND tmp_stats.score_diff = score_coefficients.scorediff),
-        fenwick_a_sa = fenwick_a * (SELECT fenwick FROM score_coefficients WHERE tmp_stats.home_or_away != team  
-                                    AND tmp_stats.score_diff = score_coefficients.scorediff),
-        corsi_a_sa = corsi_a * (SELECT corsi FROM score_coefficients WHERE tmp_stats.home_or_away != team 
-                                AND tmp_stats.score_diff = score_coefficients.scorediff);
-        
-        
-        -- Get rid of useless columns
-        ALTER TABLE tmp_stats DROP COLUMN home_or_away, DROP COLUMN tmp_strength;
-        
-        
-        -- Add season column
-        ALTER TABLE tmp_stats ADD COLUMN season SMALLINT;
-
-        UPDATE tmp_stats
-        SET
-            season = CASE 
-                          WHEN date BETWEEN '2007-09-01' AND '2008-07-01' THEN 2007
-                          WHEN date BETWEEN '2008-09-01' AND '2009-07-01' THEN 2008
-                          WHEN date BETWEEN '2009-09-01' AND '2010-07-01' THEN 2009
-                          WHEN date BETWEEN '2010-09-01' AND '2011-07-01' THEN 2010
-                          WHEN date BETWEEN '2011-09-01' AND '2012-07-01' THEN 2011
-                          WHEN date BETWEEN '2012-09-01' AND '2013-07-01' THEN 2012
-                          WHEN date BETWEEN '2013-09-01' AND '2014-07-01' THEN 2013
-                          WHEN date BETWEEN '2014-09-01' AND '2015-07-01' THEN 2014
-                          WHEN date BETWEEN '2015-09-01' AND '2016-07-01' THEN 2015
-                          WHEN date BETWEEN '2016-09-01' AND '2017-07-01' THEN 2016
-                          WHEN date BETWEEN '2017-09-01' AND '2018-07-01' THEN 2017
-                          WHEN date BETWEEN '2018-09-01' AND '2019-07-01' THEN 2018
-                          WHEN date BETWEEN '2019-09-01' AND '2020-07-01' THEN 2019
-                          WHEN date BETWEEN '2020-09-01' AND '2021-07-01' THEN 2020
-                    END;
-                     
-                     
-        DROP TABLE IF EXISTS skater_stats;
-        CREATE TABLE skater_stats
-        AS
         SELECT
         MAX(player) as player,
         player_id,
@@ -1232,10 +1355,13 @@ def aggregate_skaters(cur, conn):
         COALESCE(SUM(shooter_xg_f),0) shooter_xg_f,
         SUM(shooter_xg_f_off) shooter_xg_f_off,
         COALESCE(SUM(shooter_ixg),0) shooter_ixg
-        FROM tmp_stats
-        GROUP BY player_id, game_id, date, strength, if_empty;
-        
-        
+        FROM skater_tmp_stats
+        GROUP BY player_id, game_id, date, strength, if_empty
+        """
+    )
+
+    cur.execute(
+        """
         UPDATE skater_stats
         SET
             shots_f_off = COALESCE(team_stats.shots_f - skater_stats.shots_f ,0),
@@ -1298,12 +1424,7 @@ def aggregate_skaters(cur, conn):
             
             
         DROP TABLE ind_skater_stats;
-                    
-
-        -- Get rid of duplicate rows ... I have no idea what's causing it
-        DELETE FROM skater_stats USING skater_stats ss2
-            WHERE skater_stats.primary_key = ss2.primary_key AND skater_stats.ctid < ss2.ctid;
-            
+        DROP TABLE skater_tmp_stats;
         """
     )
 
@@ -1311,9 +1432,76 @@ def aggregate_skaters(cur, conn):
     conn.commit()
 
 
-def aggregate_all():
+# Each stage of aggregating -> (function, stages that have to be done first)
+AGGREGATE_STAGES = {
+    'events': (lambda cur, conn: classify_events(cur), []),
+    'teams': (aggregate_teams, ['events']),
+    'goalies': (aggregate_goalies, ['events']),
+    'skater_on_ice': (aggregate_skater_on_ice, []),
+    'skater_individual': (aggregate_skater_individual, []),
+    'skaters': (aggregate_skaters, ['teams', 'skater_on_ice', 'skater_individual']),
+}
+
+# Most stages running at once (each one is a connection)
+AGGREGATE_WORKERS = 3
+
+
+def run_stage(stage):
+    """
+    Run one stage of aggregating on it's own connection
+
+    :param stage: function that takes a cursor and connection
+
+    :return: seconds it took
+    """
+    conn = psycopg2.connect(host=HOST, database="nhl_data", user=USERNAME, password=PASSWORD)
+    try:
+        start = time.time()
+        stage(conn.cursor(), conn)
+        conn.commit()
+        return time.time() - start
+    finally:
+        conn.close()
+
+
+def run_stages(stages, workers=AGGREGATE_WORKERS):
+    """
+    Run the stages of aggregating. Each one starts as soon as the ones it needs are done so the ones that don't depend
+    on each other run at the same time.
+
+    :param stages: dict of name -> (function, names of stages it needs) -> Ex: AGGREGATE_STAGES
+    :param workers: Most stages to run at once
+
+    :return: dict of name -> seconds it took
+    """
+    timings, running = dict(), dict()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while len(timings) < len(stages):
+            for name, (stage, needs) in stages.items():
+                if name not in timings and name not in running.values() and all(need in timings for need in needs):
+                    running[executor.submit(run_stage, stage)] = name
+
+            if not running:
+                raise ValueError("Stages can't be run: " + ', '.join(name for name in stages if name not in timings))
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                timings[name] = future.result()
+                print("Finished {} in {:.2f}s".format(name, timings[name]))
+
+    return timings
+
+
+def aggregate_all(staged_dates=None, workers=AGGREGATE_WORKERS):
     """
     Aggregate stats for each - Teams/Goalies/Skaters
+
+    :param staged_dates: (from_date, to_date) -> If given the rows for those dates are built in shadow tables on the site
+                         and swapped in at the end. Otherwise they're just inserted (the dates should already be
+                         deleted from the site).
+    :param workers: Most stages of aggregating to run at once (see AGGREGATE_STAGES)
     """
 
     try:
@@ -1322,23 +1510,14 @@ def aggregate_all():
         cur = conn.cursor()
         cur_web = conn_web.cursor()
 
-        add_score_column(cur, conn)
-        add_empty_net_column(cur, conn)
-        # If the Strength is like 5x10 just change it to 5x5
-        cur.execute("""UPDATE pbp SET strength = '5x5' WHERE char_length(strength) > 3;""")
-        conn.commit()
-
-        aggregate_teams(cur, conn)
-        print('\nFinished aggregating teams')
-        aggregate_goalies(cur, conn)
-        print('Finished aggregating goalies')
-        aggregate_skaters(cur, conn)
-        print('Finished aggregating skaters')
-
-        add_goalies_to_web(cur_web)
-        add_teams_to_web(cur_web)
-        add_skaters_to_web(cur_web)
+        # score_diff, if_empty, and the strength fix are done before pbp is loaded -> push_to_db.add_derived_columns
+        # and push_to_db.fix_strength
+        # Teams and goalies both come from one scan of pbp ('events')
+        start = time.time()
+        run_stages(AGGREGATE_STAGES, workers)
+        print("Finished aggregating in {:.2f}s".format(time.time() - start))
 
+        send_to_web(cur_web, conn_web, staged_dates)
         drop_tables(cur, conn)
 
         cur.close()
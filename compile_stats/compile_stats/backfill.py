@@ -0,0 +1,225 @@
+"""
+Aggregating for a long range of dates (ex: a whole season) a few days at a time instead of all at once.
+
+After everything is pushed to nhl_data the working tables (pbp, player_toi, team_toi) are moved aside (ex:
+pbp_backfill). Then for each chunk of days those tables are made again with just those days and everything is
+aggregated and sent to the site like normal (aggregate_stats.run_stages). So the temp tables and transactions are
+only ever as big as one chunk.
+
+Every chunk that's done is written to aggregate_progress. If it stops partway through running aggregate_backfill again
+(with the same dates) picks up from the next chunk.
+
+Ex: start_backfill('2017-10-04', '2018-04-08')
+    aggregate_backfill('2017-10-04', '2018-04-08', chunk_days=7)
+"""
+import time
+import psycopg2
+from psycopg2.extensions import AsIs
+
+import sys
+sys.path.append("..")
+from machine_info import *
+
+from compile_stats import aggregate_stats
+
+# Days with games in each chunk
+BACKFILL_CHUNK_DAYS = 7
+
+# Working tables that are split up into chunks
+BACKFILL_TABLES = ['pbp', 'player_toi', 'team_toi']
+
+
+def table_exists(cur, table):
+    """
+    Check if a table is there
+
+    :param cur: cursor
+    :param table: name of table
+
+    :return: Boolean
+    """
+    cur.execute("select * from information_schema.tables where table_name=%s", (table,))
+    return cur.rowcount > 0
+
+
+def start_backfill(from_date, to_date, staged=False):
+    """
+    Get the working tables ready to be aggregated in chunks. Anything left from a backfill that didn't finish is thrown
+    out first. Should be called right after everything is pushed to nhl_data.
+
+    :param from_date: date from
+    :param to_date: date to
+    :param staged: The site tables are swapped at the end (see aggregate_stats.create_staging_tables)
+
+    :return: None
+    """
+    conn = psycopg2.connect(host=HOST, database="nhl_data", user=USERNAME, password=PASSWORD)
+    cur = conn.cursor()
+
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS aggregate_progress(
+        from_date TEXT,
+        to_date TEXT,
+        chunk_from TEXT,
+        chunk_to TEXT,
+        seconds DOUBLE PRECISION,
+        finished TIMESTAMP DEFAULT now()
+        );
+        DELETE FROM aggregate_progress WHERE from_date = %(from_date)s AND to_date = %(to_date)s;
+        """, {'from_date': from_date, 'to_date': to_date}
+    )
+
+    for table in BACKFILL_TABLES:
+        cur.execute(
+            """
+            DROP TABLE IF EXISTS %(backfill)s;
+            ALTER TABLE %(table)s RENAME TO %(backfill)s;
+            CREATE INDEX ON %(backfill)s (date);
+            """, {'table': AsIs(table), 'backfill': AsIs(table + '_backfill')}
+        )
+    conn.commit()
+
+    if staged:
+        conn_web = psycopg2.connect(host=HOST, database=SITE_DB, user=USERNAME, password=PASSWORD)
+        aggregate_stats.create_staging_tables(conn_web.cursor())
+        conn_web.commit()
+        conn_web.close()
+
+    cur.close()
+    conn.close()
+
+
+def get_chunks(cur, chunk_days):
+    """
+    Split the days in the backfill into chunks
+
+    :param cur: cursor
+    :param chunk_days: Days with games in each chunk
+
+    :return: list of (first day, last day) for each chunk
+    """
+    cur.execute("SELECT DISTINCT date FROM pbp_backfill ORDER BY date;")
+    days = [day for day, in cur.fetchall()]
+
+    return [(days[i], days[min(i + chunk_days, len(days)) - 1]) for i in range(0, len(days), chunk_days)]
+
+
+def make_chunk_tables(cur, chunk_from, chunk_to):
+    """
+    Make the working tables (pbp, player_toi, team_toi) again with only the days in a chunk
+
+    :param cur: cursor
+    :param chunk_from: first day
+    :param chunk_to: last day
+
+    :return: None
+    """
+    for table in BACKFILL_TABLES:
+        cur.execute(
+            """
+            CREATE UNLOGGED TABLE %(table)s
+            AS
+            SELECT * FROM %(backfill)s WHERE date >= %(chunk_from)s AND date <= %(chunk_to)s;
+            ANALYZE %(table)s;
+            """, {'table': AsIs(table), 'backfill': AsIs(table + '_backfill'), 'chunk_from': chunk_from,
+                  'chunk_to': chunk_to}
+        )
+
+
+def delete_chunk_from_site(cur_web, chunk_from, chunk_to, staged=False):
+    """
+    Delete the days in a chunk from the site tables. Only matters when a chunk is done over after it stopped partway
+    through (so nothing is added twice).
+
+    :param cur_web: cursor for site db
+    :param chunk_from: first day
+    :param chunk_to: last day
+    :param staged: Delete from the staging tables instead
+
+    :return: None
+    """
+    suffix = '_staged' if staged else ''
+    for _, table in aggregate_stats.WEB_TABLES:
+        cur_web.execute("DELETE FROM {} WHERE date >= %(chunk_from)s AND date <= %(chunk_to)s;".format(table + suffix),
+                        {'chunk_from': chunk_from, 'chunk_to': chunk_to})
+
+
+def aggregate_backfill(from_date, to_date, chunk_days=BACKFILL_CHUNK_DAYS, staged=False,
+                       workers=aggregate_stats.AGGREGATE_WORKERS):
+    """
+    Aggregate the stats a chunk of days at a time and push them to the site. Each chunk is committed when it's done so
+    if it stops it can just be run again. start_backfill has to be called first.
+
+    :param from_date: date from (same as for start_backfill)
+    :param to_date: date to
+    :param chunk_days: Days with games in each chunk
+    :param staged: The site tables are swapped at the end (same as for start_backfill)
+    :param workers: Most stages of aggregating to run at once
+
+    :return: None
+    """
+    conn = psycopg2.connect(host=HOST, database="nhl_data", user=USERNAME, password=PASSWORD)
+    cur = conn.cursor()
+
+    if not table_exists(cur, 'pbp_backfill'):
+        print("Nothing to backfill -> Call start_backfill first")
+        cur.close()
+        conn.close()
+        return
+
+    conn_web = psycopg2.connect(host=HOST, database=SITE_DB, user=USERNAME, password=PASSWORD)
+    cur_web = conn_web.cursor()
+
+    cur.execute("SELECT chunk_from, chunk_to FROM aggregate_progress WHERE from_date = %s AND to_date = %s",
+                (from_date, to_date))
+    finished = set(cur.fetchall())
+
+    chunks = get_chunks(cur, chunk_days)
+    times = []
+    for i, (chunk_from, chunk_to) in enumerate(chunks):
+        if (chunk_from, chunk_to) in finished:
+            print("Chunk {}/{} ({} to {}) already done".format(i + 1, len(chunks), chunk_from, chunk_to))
+            continue
+
+        start = time.time()
+
+        # Anything left over from a chunk that didn't finish
+        aggregate_stats.drop_tables(cur, conn)
+
+        make_chunk_tables(cur, chunk_from, chunk_to)
+        conn.commit()
+
+        aggregate_stats.run_stages(aggregate_stats.AGGREGATE_STAGES, workers)
+
+        delete_chunk_from_site(cur_web, chunk_from, chunk_to, staged)
+        conn_web.commit()
+        aggregate_stats.add_to_web(staged=staged)
+
+        aggregate_stats.drop_tables(cur, conn)
+        times.append(time.time() - start)
+        cur.execute(
+            """
+            INSERT INTO aggregate_progress (from_date, to_date, chunk_from, chunk_to, seconds)
+            VALUES (%s, %s, %s, %s, %s);
+            """, (from_date, to_date, chunk_from, chunk_to, times[-1])
+        )
+        conn.commit()
+
+        left = len([chunk for chunk in chunks[i + 1:] if chunk not in finished])
+        print("Chunk {}/{} ({} to {}) done in {:.2f}s -> ~{:.0f}s left".format(
+            i + 1, len(chunks), chunk_from, chunk_to, times[-1], left * sum(times) / len(times)))
+
+    if staged:
+        aggregate_stats.publish_staging_tables(cur_web, conn_web, from_date, to_date)
+
+    # All done so nothing to resume
+    for table in BACKFILL_TABLES:
+        cur.execute("DROP TABLE IF EXISTS %(backfill)s;", {'backfill': AsIs(table + '_backfill')})
+    cur.execute("DELETE FROM aggregate_progress WHERE from_date = %s AND to_date = %s", (from_date, to_date))
+    conn.commit()
+
+    cur.close()
+    conn.close()
+    cur_web.close()
+    conn_web.close()
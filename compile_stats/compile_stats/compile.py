@@ -2,6 +2,7 @@
 File used to start process of compiling stats to insert into site db
 """
 import datetime
+import io
 import pandas as pd
 import psycopg2
 import sqlalchemy
@@ -12,7 +13,8 @@ import hockey_scraper as hs
 from nhl_players import process_players, player_info
 from xg_probs import goal_probs
 import shared
-from compile_stats import aggregate_stats, compile_toi, push_to_db as ptd
+from compile_stats import aggregate_frames, aggregate_stats, backfill, compile_toi, on_ice, partitions
+from compile_stats import push_to_db as ptd
 from coords_adjs import apply_coords_adjustments as aca
 
 import sys
@@ -47,6 +49,45 @@ def get_season_table(table, cols, engine):
     return df
 
 
+def get_shifts(from_date, to_date):
+    """
+    Get the shifts (with positions) between two dates from the season table instead of scraping them again. They come
+    over in one COPY so it's quick for a whole season.
+
+    :param from_date: date from
+    :param to_date: date to
+
+    :return: DataFrame of shifts...empty if there's no table for that season
+    """
+    conn = psycopg2.connect(host=HOST, database="nhl_data", user=USERNAME, password=PASSWORD)
+    cur = conn.cursor()
+
+    table = 'shifts' + shared.get_season(from_date)
+    cur.execute("select * from information_schema.tables where table_name=%s", (table,))
+    if cur.rowcount == 0:
+        cur.close()
+        conn.close()
+        return pd.DataFrame()
+
+    query = cur.mogrify(
+        """
+        SELECT * FROM %(shifts)s 
+        WHERE CAST (date AS DATE) >= %(from_date)s and CAST (date AS DATE) <= %(to_date)s
+        ORDER BY game_id, period, start
+        """, {'from_date': from_date, 'to_date': to_date, 'shifts': AsIs(table)}
+    ).decode()
+
+    buffer = io.StringIO()
+    cur.copy_expert("COPY ({}) TO STDOUT CSV HEADER".format(query), buffer)
+    cur.close()
+    conn.close()
+
+    buffer.seek(0)
+    shifts_df = pd.read_csv(buffer, dtype={'date': str, 'team': str, 'player': str, 'position': str})
+
+    return compile_toi.compact_shifts(ptd.fix_shifts_df(shifts_df))
+
+
 def rink_adjust(pbp):
     """
     Adjust the coordinates for rink bias. Adjusted based on current season and last season's data
@@ -88,24 +129,6 @@ def rink_adjust(pbp):
     return pbp
 
 
-def fix_shifts_df(shiftsDf):
-    """
-    Fix some issues with the columns for the shiftsDf. Apparently the way it's set up it prefers the data types
-    provided when we read in from a csv as opposed to scraping
-    """
-    # Make Lowercase
-    shiftsDf.columns = map(str.lower, shiftsDf.columns)
-
-    shiftsDf.game_id = shiftsDf.game_id.astype(int)
-    shiftsDf.period = shiftsDf.period.astype(int)
-    shiftsDf.player_id = shiftsDf.player_id.astype(float)
-    shiftsDf.start = shiftsDf.start.astype(int)
-    shiftsDf.end = shiftsDf.end.astype(int)
-    shiftsDf.duration = shiftsDf.duration.astype(int)
-
-    return shiftsDf
-
-
 def delete_from_site(from_date, to_date):
     """
     Delete data between date ranges for site db
@@ -156,13 +179,32 @@ def delete_from_nhl_data(from_date, to_date):
     if not bool(cur.rowcount) or cur.rowcount == 0:
         return
 
-    cur.execute(
-        """
-        -- Delete From pbp and shifts
-        DELETE FROM %(pbp)s where CAST (date AS DATE) >= %(from_date)s and CAST (date AS DATE) <= %(to_date)s;
-        -- DELETE FROM %(shifts)s where CAST (date AS DATE) >= %(from_date)s and CAST (date AS DATE) <= %(to_date)s;
-        """, {'from_date': from_date, 'to_date': to_date, 'pbp': AsIs('pbp' + year), 'shifts': AsIs('shifts' + year)}
-    )
+    # Drop the days from pbp...if it's from before it was partitioned it's a regular delete
+    if partitions.is_partitioned(cur, 'pbp' + year):
+        partitions.drop_partitions(cur, 'pbp' + year, from_date, to_date)
+    else:
+        cur.execute(
+            """
+            DELETE FROM %(pbp)s where CAST (date AS DATE) >= %(from_date)s and CAST (date AS DATE) <= %(to_date)s;
+            """, {'from_date': from_date, 'to_date': to_date, 'pbp': AsIs('pbp' + year)}
+        )
+
+    # Shifts weren't saved for older seasons
+    cur.execute("select * from information_schema.tables where table_name=%s", ('shifts' + year,))
+    if cur.rowcount > 0:
+        cur.execute(
+            """
+            DELETE FROM %(shifts)s where CAST (date AS DATE) >= %(from_date)s and CAST (date AS DATE) <= %(to_date)s;
+            """, {'from_date': from_date, 'to_date': to_date, 'shifts': AsIs('shifts' + year)}
+        )
+
+    cur.execute("select * from information_schema.tables where table_name=%s", ('player_pair_toi',))
+    if cur.rowcount > 0:
+        cur.execute(
+            """
+            DELETE FROM player_pair_toi where CAST (date AS DATE) >= %(from_date)s and CAST (date AS DATE) <= %(to_date)s;
+            """, {'from_date': from_date, 'to_date': to_date}
+        )
     conn.commit()
     cur.close()
     conn.close()
@@ -182,20 +224,42 @@ def delete_dates_from_db(from_date, to_date):
     print("Deleted any date references from nhl_data db\n")
 
 
-def process(from_date, to_date):
+def process(from_date, to_date, workers=1, binary=False, staged=False, chunk_days=None, in_memory=False,
+            check_on_ice=False, shifts_from_db=False):
     """
     Process between dates
     1. Scrape games
     2. Fix up shifts and push new players
     3. Calculate TOI
     4. Push TOI tables, and new pbp and shifts
+
+    :param from_date: date from
+    :param to_date: date to
+    :param workers: Number of processes used for calculating the TOI (worth it for backfills)
+    :param binary: Load the tables with binary COPY instead of csv
+    :param staged: Keep the old rows on the site until the new ones are ready and then swap them in
+    :param chunk_days: Aggregate this many days (with games) at a time instead of everything at once (for backfills).
+                       If it stops partway through it can be picked up with backfill.aggregate_backfill.
+    :param in_memory: Aggregate in pandas off of the pbp and TOI that are already here instead of in the db (see 
+                      aggregate_frames). Not used with chunk_days.
+    :param check_on_ice: Check the players on the ice for each event in the pbp against the ones from the shifts (see
+                         on_ice). The events that don't match are saved to on_ice_{from_date}_{to_date}.csv.
+    :param shifts_from_db: Recompute the TOI off of the shifts already in the season table (see get_shifts) instead of
+                           scraping them again. If any of the games aren't there the shifts are scraped like normal.
     """
+    # Has to be read before the dates are deleted (they're loaded back in with everything else)
+    shifts_df = get_shifts(from_date, to_date) if shifts_from_db else pd.DataFrame()
+
     # First just delete any previous entries of these dates from every db
-    delete_dates_from_db(from_date, to_date)
+    # When staged the site keeps them until the end
+    if staged:
+        delete_from_nhl_data(from_date, to_date)
+    else:
+        delete_dates_from_db(from_date, to_date)
 
-    scraped_data = hs.scrape_date_range(from_date, to_date, True, data_format='Pandas',
+    scraped_data = hs.scrape_date_range(from_date, to_date, shifts_df.empty, data_format='Pandas',
                                         docs_dir="../../hockey_scraper_data")
-    pbp_df, shiftsDf = scraped_data['pbp'], scraped_data['shifts']
+    pbp_df = scraped_data['pbp']
     season = int(shared.get_season(from_date))
 
     # Check if scraping went OK
@@ -203,18 +267,36 @@ def process(from_date, to_date):
         print('Unable to scrape games')
         return ''
 
-    # Fill shifts with positions and push new players to db
-    shiftsDf = fix_shifts_df(shiftsDf)
-    process_players.process_players(shiftsDf)
-    shifts_df = player_info.fill_shifts_with_positions(shiftsDf)
-
-    # Get TOI
-    players_toi, teams_toi = compile_toi.process_games(shifts_df)
-
-    # Create DataFrames
-    player_df = pd.DataFrame(players_toi, columns=['player', 'player_id', 'position', 'game_id', 'date', 'team',
-                                                   'strength', 'if_empty', 'toi_on', 'toi_off'])
-    team_df = pd.DataFrame(teams_toi, columns=['team', 'game_id', 'date', 'strength', 'if_empty', 'toi'])
+    # If the db doesn't have the shifts for every game just scrape them all
+    if not shifts_df.empty:
+        missing = set(pd.to_numeric(pbp_df['Game_Id']).astype(int)) - set(shifts_df['game_id'])
+        if missing:
+            print("No shifts in the db for games: {} -> Scraping the shifts".format(
+                ', '.join(str(game) for game in sorted(missing))))
+            scraped_data = hs.scrape_date_range(from_date, to_date, True, data_format='Pandas',
+                                                docs_dir="../../hockey_scraper_data")
+            pbp_df, shifts_df = scraped_data['pbp'], pd.DataFrame()
+
+    # Fill shifts with positions and push new players to db (the ones from the db already have them)
+    if shifts_df.empty:
+        shiftsDf = ptd.fix_shifts_df(scraped_data['shifts'])
+        process_players.process_players(shiftsDf)
+        shifts_df = player_info.fill_shifts_with_positions(shiftsDf)
+
+    # Validate the players on the ice from the scraper
+    if check_on_ice:
+        mismatches = on_ice.compare_on_ice(pbp_df, on_ice.resolve_on_ice(pbp_df, shifts_df))
+        if not mismatches.empty:
+            mismatches.to_csv("on_ice_{}_{}.csv".format(from_date, to_date), index=False)
+
+    # Get TOI -> Nothing is calculated here. The rows are made one game at a time as they are pushed to the db
+    toi_games = compile_toi.iter_games(shifts_df, workers=workers)
+
+    # When aggregating in memory the player and team TOI are held onto instead of loaded
+    in_memory = in_memory and not chunk_days
+    if in_memory:
+        player_rows, team_rows = [], []
+        toi_games = aggregate_frames.collect_toi(toi_games, player_rows, team_rows)
 
     # Season
     pbp_df['season'] = pbp_df.apply(lambda row: int(shared.get_season(row['Date'])), axis=1)
@@ -227,10 +309,19 @@ def process(from_date, to_date):
     pbp_df = goal_probs.get_xg(pbp_df)
 
     # PUSH all the data to nhl_data DB
-    ptd.push_to_db(pbp_df, shiftsDf, player_df, team_df, shared.get_season(pbp_df.iloc[0]['Date']))
+    pbp_df = ptd.push_to_db(pbp_df, shifts_df, toi_games, shared.get_season(pbp_df.iloc[0]['Date']), binary=binary,
+                            work_table=not in_memory)
 
     # Aggregate all the statistics and push to site DB
-    aggregate_stats.aggregate_all()
+    if chunk_days:
+        backfill.start_backfill(from_date, to_date, staged=staged)
+        backfill.aggregate_backfill(from_date, to_date, chunk_days=chunk_days, staged=staged)
+    elif in_memory:
+        player_toi, team_toi = aggregate_frames.toi_frames(player_rows, team_rows, pbp_df)
+        aggregate_frames.aggregate_all(pbp_df, player_toi, team_toi,
+                                       staged_dates=(from_date, to_date) if staged else None)
+    else:
+        aggregate_stats.aggregate_all(staged_dates=(from_date, to_date) if staged else None)
 
     # Return errors for scraping...this is so we can store in logs for daily scraping/compiling
     return scraped_data['errors']
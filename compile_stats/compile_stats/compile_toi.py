@@ -1,10 +1,18 @@
 """
 Module used for calculating the TOI for players and teams for a list of games.
-1. Needs to be a list of games and the DataFrame full of shifts (needs to include positions).
-2. compile_toi.process_games -> starts the whole thing
+1. Needs to be a list of games and the DataFrame full of shifts (needs to include positions). The shifts are expected
+   in SHIFT_DTYPES (see compact_shifts).
+2. compile_toi.iter_games -> starts the whole thing. Yields the rows one game at a time.
+   compile_toi.process_games -> Same but returns the rows for every game at once
 """
+import multiprocessing
+import numpy as np
+from itertools import repeat
 
-# I don't think this is needed anymore...Idk
+from compile_stats import stints
+
+# The shifts can have the 3 letter names for these teams while the pbp has these -> Player rows get the pbp ones so
+# they line up with the pbp (team rows keep the shifts ones)
 TEAMS = {'TBL': 'T.B', 'LAK': 'L.A', 'NJD': 'N.J', 'SJS': 'S.J'}
 
 # "Approved" Strengths
@@ -27,358 +35,224 @@ strengths = [
         '2x2',
 ]
 
+# Columns of the rows for the player_toi and team_toi tables
+PLAYER_COLUMNS = ['player', 'player_id', 'position', 'game_id', 'date', 'team', 'strength', 'if_empty', 'toi_on',
+                  'toi_off']
+TEAM_COLUMNS = ['team', 'game_id', 'date', 'strength', 'if_empty', 'toi']
+PAIR_COLUMNS = ['game_id', 'date', 'team', 'player_id', 'other_id', 'relation', 'strength', 'if_empty', 'toi']
 
-def combine_games(games):
-    """
-    Turns toi dictionaries into DataFrames
+# Columns of the shifts and the dtypes they're kept in -> Teams and positions only have a few values each
+SHIFT_DTYPES = {'game_id': np.int64, 'date': object, 'period': np.int8, 'team': 'category', 'player': object,
+                'player_id': np.int32, 'position': 'category', 'start': np.int16, 'end': np.int16,
+                'duration': np.int16}
 
-    :param games: Dictionary that hold date of game, player_toi dict, and team_toi dict
+# Strengths are kept as codes until the rows are made -> The code is the index in strengths
+# Look up by [team skaters, other team skaters]. Anything over 6 skaters is lumped in w/ 7 (goes to misc.)
+MAX_SKATERS = 7
+STRENGTH_CODES = np.full((MAX_SKATERS + 1, MAX_SKATERS + 1), strengths.index('2x2'), dtype=np.int64)
+for code, strength in enumerate(strengths):
+    STRENGTH_CODES[int(strength[0]), int(strength[2])] = code
 
-    :return: DataFrame of TOI for teams and players for given games
-    """
-    players = []
-    teams = []
-
-    for game in list(games.keys()):
-        for team in list(games[game]['teams'].keys()):
-            # Players
-            for player in list(games[game]['players'][team].keys()):
-                for strength in list(games[game]['players'][team][player]['TOI'].keys()):
-
-                    # TODO: Needed???
-                    if team in list(TEAMS.keys()):
-                        fixed_team = TEAMS[team]
-                    else:
-                        fixed_team = team
-
-                    for net in list(games[game]['players'][team][player]['TOI'][strength].keys()):
-                        players.append({
-                            'player': games[game]['players'][team][player]['Player'],
-                            'position': games[game]['players'][team][player]['Position'],
-                            'player_id': player,
-                            'game_id': game,
-                            'date': games[game]['date'],
-                            'team': fixed_team,
-                            'strength': strength,
-                            'if_empty': 1 if net == 'Empty' else 0,
-                            'toi_on': games[game]['players'][team][player]['TOI'][strength][net]['On'],
-                            'toi_off': games[game]['players'][team][player]['TOI'][strength][net]['Off']
-
-                        })
-
-            # Teams
-            for strength in list(games[game]['teams'][team].keys()):
-                for net in list(games[game]['teams'][team][strength].keys()):
-                    teams.append({
-                        'team': team,
-                        'game_id': game,
-                        'date': games[game]['date'],
-                        'strength': strength,
-                        'if_empty': 1 if net == 'Empty' else 0,
-                        'toi': games[game]['teams'][team][strength][net],
-                    })
-
-    return players, teams
-
-
-def get_player(row):
-    return [row['player'], row['player_id'], row['position'], row['team']]
-
-
-def get_players(game_df):
-    """
-    Get players who played in specific game
-    
-    :param game_df: DataFrame for game with shift info
-    
-    :return: players list
-    """
-    players_series = game_df.apply(lambda row: get_player(row), axis=1)
-    players_set = set(tuple(x) for x in players_series.tolist())
+# Don't bother if it's a shootout -> '1x1', '0x0', '1x0', '0x1'
+STRENGTH_CODES[:2, :2] = -1
 
-    return [list(x) for x in players_set]
+# Each strength has a bucket for if the net was empty and one for if it wasn't -> bucket = code * 2 + if_empty
+NUM_BUCKETS = len(strengths) * 2
 
 
-def get_game_length(game_df, game, teams):
+def compact_shifts(shifts_df):
     """
-    Gets a list with the length equal to the amount of seconds in that game
-    
-    :param game_df: DataFrame with shift info for game
-    :param game: game_id
-    :param teams: both teams in game
-    
-    :return: list 
+    Put the shifts in SHIFT_DTYPES. Shifts without a player_id are dropped (they can't be used for anything).
+
+    :param shifts_df: DataFrame of shifts (lowercase columns and positions)
+
+    :return: DataFrame with just the SHIFT_DTYPES columns
     """
-    # Start off with the standard 3 periods (1201 because start at 0)
-    seconds = list(range(0, 1201)) * 3
+    shifts_df = shifts_df[shifts_df['player_id'].notnull()]
 
-    # If the last shift was an overtime shift, then extend the list of seconds by how fair into OT the game went
-    if game_df['period'][game_df.shape[0] - 1] == 4:
-        seconds.extend(list(range(0, game_df['end'][game_df.shape[0] - 1] + 1)))
+    return shifts_df[list(SHIFT_DTYPES)].astype(SHIFT_DTYPES)
 
-    # For Playoff Games
-    # If the game went beyond 4 periods tack that on to
-    if int(game) >= 30000:
-        # Go from beyond period 4 because done above
-        for i in range(game_df['period'][game_df.shape[0] - 1] - 4):
-            seconds.extend(list(range(0, 1201)))
 
-        seconds.extend(list(range(0, game_df['end'][game_df.shape[0] - 1] + 1)))
+def get_buckets(game_stints, team_index):
+    """
+    Get the strength and empty net bucket for each stint for one team -> Strength is 'team skaters x other skaters'
 
-    # Create dict for seconds_list
-    # On = Players on Ice at that second
-    # Off = Players who got off ice at that second
-    for i in range(len(seconds)):
-        seconds[i] = {
-            teams[0]: {'On': {'Skaters': dict(), 'Goalies': dict()}, 'Off': {'Skaters': dict(), 'Goalies': dict()}},
-            teams[1]: {'On': {'Skaters': dict(), 'Goalies': dict()}, 'Off': {'Skaters': dict(), 'Goalies': dict()}}
-        }
+    :param game_stints: Stints object for game
+    :param team_index: 0 or 1 -> for teams[0] or teams[1]
+
+    :return: array of buckets (-1 for stints that don't count)
+    """
+    skaters = np.minimum(game_stints.skaters, MAX_SKATERS)
+    codes = STRENGTH_CODES[skaters[:, team_index], skaters[:, 1 - team_index]]
 
-    return seconds
+    return np.where(codes >= 0, codes * 2 + game_stints.if_empty, -1)
 
 
-def fill_player_dict(teams, players_list):
+def get_bucket_lengths(game_stints, buckets):
     """
-    Fill by team by player with stuff
-    
-    NOTE: Ignore the 'team_toi and 'other_team_toi' keys
-    
-    :param teams: both teams in game
-    :param players_list: list of players in game
-    
-    :return: dict by player by team
+    Spread the length of each stint into its bucket
+
+    :param game_stints: Stints object for game
+    :param buckets: bucket for each stint
+
+    :return: matrix of stint x bucket
     """
-    players_toi = {teams[0]: dict(), teams[1]: dict()}
-
-    for p in players_list:
-        players_toi[p[3]][str(p[1])] = {
-            'Player': p[0],
-            'Position': p[2],
-            'TOI': {
-                '5x5': {'Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}},
-                        'Not_Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}}},
-                '6x5': {'Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}},
-                        'Not_Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}}},
-                '5x6': {'Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}},
-                        'Not_Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}}},
-                '5x4': {'Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}},
-                        'Not_Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}}},
-                '4x5': {'Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}},
-                        'Not_Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}}},
-                '5x3': {'Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}},
-                        'Not_Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}}},
-                '3x5': {'Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}},
-                        'Not_Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}}},
-                '4x4': {'Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}},
-                        'Not_Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}}},
-                '4x3': {'Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}},
-                        'Not_Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}}},
-                '3x4': {'Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}},
-                        'Not_Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}}},
-                '3x3': {'Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}},
-                        'Not_Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}}},
-                '6x4': {'Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}},
-                        'Not_Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}}},
-                '4x6': {'Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}},
-                        'Not_Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}}},
-                '6x3': {'Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}},
-                        'Not_Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}}},
-                '3x6': {'Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}},
-                        'Not_Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}}},
-                # '2x2' is for misc. TOI
-                '2x2': {'Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}},
-                        'Not_Empty': {'On': 0, 'Off': 0, 'team_toi': {}, 'other_team_toi': {}}},
-            }
-        }
-
-    return players_toi
-
-
-def fill_team_dict(teams):
+    counted = np.flatnonzero(buckets >= 0)
+    bucket_lengths = np.zeros((len(game_stints), NUM_BUCKETS), dtype=np.int64)
+    bucket_lengths[counted, buckets[counted]] = game_stints.lengths[counted]
+
+    return bucket_lengths
+
+
+def played_buckets(team_toi):
     """
-    Fill by team with stuff
-    
-    :param teams: both teams in game
-    
-    :return: dict by by team
+    Get the buckets a team played in. They're in the order of strengths with the empty net first.
+
+    :param team_toi: array of team TOI indexed by [strength code, empty]
+
+    :return: list of (strength code, if_empty)
     """
-    teams_toi = {teams[0]: dict(), teams[1]: dict()}
-    for t in teams:
-        teams_toi[t] = {
-            '5x5': {'Empty': 0, 'Not_Empty': 0},
-            '6x5': {'Empty': 0, 'Not_Empty': 0},
-            '5x6': {'Empty': 0, 'Not_Empty': 0},
-            '5x4': {'Empty': 0, 'Not_Empty': 0},
-            '4x5': {'Empty': 0, 'Not_Empty': 0},
-            '5x3': {'Empty': 0, 'Not_Empty': 0},
-            '3x5': {'Empty': 0, 'Not_Empty': 0},
-            '4x4': {'Empty': 0, 'Not_Empty': 0},
-            '4x3': {'Empty': 0, 'Not_Empty': 0},
-            '3x4': {'Empty': 0, 'Not_Empty': 0},
-            '3x3': {'Empty': 0, 'Not_Empty': 0},
-            '6x4': {'Empty': 0, 'Not_Empty': 0},
-            '4x6': {'Empty': 0, 'Not_Empty': 0},
-            '6x3': {'Empty': 0, 'Not_Empty': 0},
-            '3x6': {'Empty': 0, 'Not_Empty': 0},
-            '2x2': {'Empty': 0, 'Not_Empty': 0},  # For misc. TOI...where I store mistakes
-        }
-
-    return teams_toi
-
-
-def distribute_toi(second, seconds_list, players_toi, teams_toi):
+    return [(code, empty) for code in range(len(strengths)) for empty in [1, 0] if team_toi[code, empty] > 0]
+
+
+def distribute_toi(game_stints):
     """
-    Distributes toi for given second for players and teams
+    Distributes toi for each stint for players and teams. Only strengths that were actually played at get a row.
+
+    The TOI is held in arrays indexed by [player, strength code, empty] (teams are just [strength code, empty]) and
+    only turned into rows at the end.
+
+    :param game_stints: Stints object for game
+
+    :return: list of player rows, list of team rows
     """
-    both_teams = list(seconds_list[second].keys())
-
-    players_on_ice = {
-        both_teams[0]: len(seconds_list[second][both_teams[0]]['On']['Skaters'].keys()),
-        both_teams[1]: len(seconds_list[second][both_teams[1]]['On']['Skaters'].keys())
-    }
-
-    goalies_on_ice = {
-        both_teams[0]: len(seconds_list[second][both_teams[0]]['On']['Goalies'].keys()),
-        both_teams[1]: len(seconds_list[second][both_teams[1]]['On']['Goalies'].keys())
-    }
-
-    # Players for both teams
-    for team in list(seconds_list[second].keys()):
-        # Determine Strength
-        if team == both_teams[0]:
-            strength = 'x'.join([str(players_on_ice[team]), str(players_on_ice[both_teams[1]])])
-            other_team = both_teams[1]
-        else:
-            strength = 'x'.join([str(players_on_ice[team]), str(players_on_ice[both_teams[0]])])
-            other_team = both_teams[0]
-
-        # Don't bother if it's a shootout
-        if strength not in strengths:
-            if strength in ['1x1', '0x0', '1x0', '0x1', '1x1']:
-                return
-            else:
-                # There are mistakes with the shift charts ...any misc. strength not in above goes here
-                strength = '2x2'
-
-        # Check if empty net
-        if goalies_on_ice[both_teams[0]] == 0 or goalies_on_ice[both_teams[1]] == 0:
-            if_empty = 'Empty'
-        else:
-            if_empty = 'Not_Empty'
-
-        # For Players
-        for player_key in list(players_toi[team].keys()):
-            if players_toi[team][player_key]['Position'] != 'G':
-                if player_key in list(seconds_list[second][team]['On']['Skaters'].keys()):
-                    players_toi[team][player_key]['TOI'][strength][if_empty]['On'] += 1
-
-                    """
-                    ########### Get toi spent with players on other team ##############################
-                    ####################################################################################################
-                    # Go through players on the other team
-                    for opp_player in list(players_toi[other_team].keys()):
-                        if opp_player in list(seconds_list[second][other_team]['On']['Skaters'].keys()):
-                            if opp_player in list(players_toi[team][player_key]['TOI'][strength][if_empty]['opp_team_toi'].keys()):
-                                players_toi[team][player_key]['TOI'][strength][if_empty]['opp_team_toi'][opp_player] += 1
-                            else:
-                                players_toi[team][player_key]['TOI'][strength][if_empty]['opp_team_toi'][opp_player] = 1
-                    ####################################################################################################
-                    
-                    
-                    ################### TOI with players on same team ###############################
-                    for same_team_key in list(players_toi[team].keys()):
-                        if same_team_key in list(seconds_list[second][team]['On']['Skaters'].keys()) and same_team_key != player_key:
-                            if same_team_key in list(players_toi[team][player_key]['TOI'][strength][if_empty]['team_toi'].keys()):
-                                players_toi[team][player_key]['TOI'][strength][if_empty]['team_toi'][same_team_key] += 1
-                            else:
-                                players_toi[team][player_key]['TOI'][strength][if_empty]['team_toi'][same_team_key] = 1
-                    ####################################################################################################
-                    """
-                else:
-                    players_toi[team][player_key]['TOI'][strength][if_empty]['Off'] += 1
-            else:
-                if player_key in list(seconds_list[second][team]['On']['Goalies'].keys()):
-                    players_toi[team][player_key]['TOI'][strength][if_empty]['On'] += 1
-                else:
-                    players_toi[team][player_key]['TOI'][strength][if_empty]['Off'] += 1
-
-        # For Teams
-        teams_toi[team][strength][if_empty] += 1
-
-
-def populate_matrix(row, seconds_list):
+    players, teams_rows = [], []
+    players_list = game_stints.players[['player', 'player_id', 'position']].values.tolist()
+
+    for i, team in enumerate(game_stints.teams):
+        bucket_lengths = get_bucket_lengths(game_stints, get_buckets(game_stints, i))
+        team_players = np.flatnonzero(game_stints.team_index == i)
+
+        team_toi = bucket_lengths.sum(axis=0).reshape(len(strengths), 2)
+        toi_on = (game_stints.on_ice[:, team_players].T.astype(np.int64) @ bucket_lengths).reshape(-1, len(strengths), 2)
+
+        fixed_team = TEAMS.get(team, team)
+
+        for code, empty in played_buckets(team_toi):
+            strength, toi = strengths[code], int(team_toi[code, empty])
+
+            # For Players
+            for player, player_toi in zip(team_players, toi_on[:, code, empty].tolist()):
+                p = players_list[player]
+                players.append((p[0], p[1], p[2], game_stints.game_id, game_stints.date, fixed_team, strength,
+                                empty, player_toi, toi - player_toi))
+
+            # For Teams
+            teams_rows.append((team, game_stints.game_id, game_stints.date, strength, empty, toi))
+
+    return players, teams_rows
+
+
+def distribute_pair_toi(game_stints):
     """
-    For a given shift it fills in the seconds the player was on the ice
-    
-    :param row: given shifts info
-    :param seconds_list: list with every second of game
+    Get the toi every pair of skaters spent on the ice together, as teammates and against each other. Stints with the
+    same lineups are grouped up by their bitmasks first so each lineup is only gone through once. 
+
+    Every pair only gets one row. For opponents it's from the point of view of teams[0].
+
+    :param game_stints: Stints object for game
+
+    :return: list of pair rows
     """
-    start = row['start']
-    end = row['end']
-    team = row['team']
-
-    if row['period'] != 1:
-        start += (1200 * (row['period'] - 1))
-        end += (1200 * (row['period'] - 1))
-
-    for x in range(start, end+1):
-        # 'On' really just means the player isn't getting off at that second
-        if x == end:
-            shift_type = 'Off'
-        else:
-            shift_type = 'On'
-
-        if row['position'] == 'G':
-            seconds_list[x][team][shift_type]['Goalies'][str(row['player_id'])] = {'Player': row['player'],
-                                                                                   'Position': row['position']}
-        else:
-            seconds_list[x][team][shift_type]['Skaters'][str(row['player_id'])] = {'Player': row['player'],
-                                                                                   'Position': row['position']}
-
-
-def process_games(shifts_df):
+    pairs = []
+    player_ids = game_stints.players['player_id'].values
+
+    for i, team in enumerate(game_stints.teams):
+        buckets = get_buckets(game_stints, i)
+        team_toi = get_bucket_lengths(game_stints, buckets).sum(axis=0).reshape(len(strengths), 2)
+        skaters, opponents = game_stints.team_players(i), game_stints.team_players(1 - i)
+
+        fixed_team = TEAMS.get(team, team)
+
+        for code, empty in played_buckets(team_toi):
+            intervals = buckets == code * 2 + empty
+            lineups, lineup_index = np.unique(game_stints.masks[intervals][:, [i, 1 - i]], axis=0, return_inverse=True)
+            lineup_toi = np.bincount(lineup_index.reshape(-1), weights=game_stints.lengths[intervals])
+
+            team_on = stints.lineup_matrix(lineups[:, 0], len(skaters))
+            opponents_on = stints.lineup_matrix(lineups[:, 1], len(opponents))
+            player_lineup_toi = (team_on * lineup_toi[:, None]).T
+
+            relations = [('teammate', skaters, np.triu(player_lineup_toi @ team_on, 1))]
+            if i == 0:
+                relations.append(('opponent', opponents, player_lineup_toi @ opponents_on))
+
+            for relation, others, pair_toi in relations:
+                player, other = np.nonzero(pair_toi)
+                pairs.extend(zip(repeat(game_stints.game_id), repeat(game_stints.date), repeat(fixed_team),
+                                 player_ids[skaters[player]].tolist(), player_ids[others[other]].tolist(),
+                                 repeat(relation), repeat(strengths[code]), repeat(empty),
+                                 pair_toi[player, other].astype(np.int64).tolist()))
+
+    return pairs
+
+
+def process_game(game_df):
     """
-    Processes the actual games
-    
-    :param shifts_df: DataFrame of shifts for those games
-    
-    :return: DataFrame of to for players and teams
+    Processes one game. Kept at the top level so it can be sent to a worker process.
+
+    :param game_df: DataFrame of shifts for that game
+
+    :return: list of player rows, list of team rows, list of pair rows
     """
-    games = dict()
+    print('Calculating TOI for game ' + str(game_df.iloc[0]['game_id']))
 
-    for game in list(set(shifts_df['game_id'].tolist())):
-        print('Calculating TOI for game ' + str(game))
+    # Who is on the ice between every change
+    game_stints = stints.build_stints(game_df)
 
-        game_df = shifts_df[shifts_df['game_id'] == game]
-        game_df = game_df.sort_values(by=['period', 'end']).reset_index(drop=True)
-        date = game_df.iloc[0]['date']
+    # Put toi in for players and team
+    players, teams = distribute_toi(game_stints)
 
-        # Get Players and Teams
-        teams = list(set(game_df['team'].tolist()))
-        players_list = get_players(game_df)
+    return players, teams, distribute_pair_toi(game_stints)
 
-        # Get game Length
-        seconds_list = get_game_length(game_df, game, teams)
 
-        # Fill with base
-        players_toi = fill_player_dict(teams, players_list)
-        teams_toi = fill_team_dict(teams)
+def iter_games(shifts_df, workers=1):
+    """
+    Processes the actual games and yields the rows for each one as soon as it's done (in order of game_id). So nothing
+    is held onto for more than one game at a time.
 
-        # Populate seconds_list with players
-        shifts = game_df.to_dict('records')
-        [populate_matrix(shift, seconds_list) for shift in shifts]
+    Each game is independent so with more than one worker they are split up among a pool of processes.
 
-        # Put toi in for players and team
-        [distribute_toi(s, seconds_list, players_toi, teams_toi) for s in range(len(seconds_list))]
+    :param shifts_df: DataFrame of shifts for those games
+    :param workers: Number of processes to use
 
-        games[str(game)] = {'date': date, 'players': players_toi, 'teams': teams_toi}
+    :return: Generator of (player rows, team rows, pair rows) -> Columns are PLAYER_COLUMNS, TEAM_COLUMNS, and
+             PAIR_COLUMNS
+    """
+    games_list = (game_df for game, game_df in shifts_df.groupby('game_id', sort=True))
 
-        # Debugging
-        """
-        if game == '20107':
-            import json
-            print(json.dumps(teams_toi, indent=2))
-        """
+    if workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            for game_rows in pool.imap(process_game, games_list):
+                yield game_rows
+    else:
+        for game_df in games_list:
+            yield process_game(game_df)
+
+
+def process_games(shifts_df, workers=1):
+    """
+    Processes the actual games
+    
+    :param shifts_df: DataFrame of shifts for those games
+    :param workers: Number of processes to use
+    
+    :return: list of player rows, list of team rows, list of pair rows
+    """
+    players, teams, pairs = [], [], []
+    for game_players, game_teams, game_pairs in iter_games(shifts_df, workers=workers):
+        players.extend(game_players)
+        teams.extend(game_teams)
+        pairs.extend(game_pairs)
 
-    players, teams = combine_games(games)
-    return players, teams
+    return players, teams, pairs
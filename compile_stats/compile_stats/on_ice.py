@@ -0,0 +1,148 @@
+"""
+Get the players on the ice for every event in the pbp from the shifts instead of the homeplayer/awayplayer columns
+from the scraper. Each game's shifts are made into a stint table and then every event in that game is looked up at
+once with searchsorted.
+
+The resolved columns are laid out like the scraper ones (the goalie takes one of the 6 slots) so they can be compared
+or used in place of them.
+
+All runs through - resolve_on_ice (and compare_on_ice to check against the scraper)
+"""
+import numpy as np
+import pandas as pd
+
+from compile_stats import stints
+
+SLOTS = 6
+HOME_COLS = ['homeplayer{}_id'.format(x) for x in range(1, SLOTS + 1)]
+AWAY_COLS = ['awayplayer{}_id'.format(x) for x in range(1, SLOTS + 1)]
+
+
+def get_lookup_seconds(game_pbp):
+    """
+    Get the second to look up each event at (from the start of the game).
+
+    For a faceoff it's the players who are coming on at that second. For everything else it's who was on just before
+    it (so a player getting off at the same second as a goal was on for it).
+
+    :param game_pbp: pbp for one game
+
+    :return: array of seconds
+    """
+    offset = 1200 * (game_pbp['period'].values.astype(np.int64) - 1)
+    seconds = game_pbp['seconds_elapsed'].values.astype(np.int64) + offset
+
+    return np.where(game_pbp['event'].values == 'FAC', seconds, seconds - 1)
+
+
+def get_slots(game_stints, stint_index, team_index):
+    """
+    Fill the 6 slots for one team with the id's of the players on the ice (sorted with the empty slots last)
+
+    :param game_stints: Stints object for game
+    :param stint_index: stint for each event (-1 if none)
+    :param team_index: 0 or 1 -> for teams[0] or teams[1]
+
+    :return: matrix of event x slot
+    """
+    players = np.flatnonzero(game_stints.team_index == team_index)
+    player_ids = game_stints.players['player_id'].values.astype(float)[players]
+
+    on_ice = game_stints.on_ice[np.maximum(stint_index, 0)][:, players] & (stint_index >= 0)[:, None]
+    slots = np.sort(np.where(on_ice, player_ids, np.nan), axis=1)
+
+    # Pad out for when there are less players than slots
+    slots = np.hstack([slots, np.full((len(slots), SLOTS), np.nan)])
+
+    return slots[:, :SLOTS]
+
+
+def resolve_game(game_pbp, game_shifts):
+    """
+    Get the players on the ice for every event in one game
+
+    :param game_pbp: pbp for one game (lowercase columns)
+    :param game_shifts: shifts for that game (needs positions)
+
+    :return: DataFrame with the same index as game_pbp
+    """
+    home_team = game_pbp['home_team'].iloc[0]
+    game_stints = stints.build_stints(game_shifts, home_team=home_team)
+    stint_index = game_stints.find(get_lookup_seconds(game_pbp))
+
+    # No shifts for the home team...means something is messed up so leave it empty
+    if game_stints.teams[0] != home_team:
+        stint_index = np.full(len(game_pbp), -1)
+
+    slots = np.hstack([get_slots(game_stints, stint_index, 0), get_slots(game_stints, stint_index, 1)])
+    resolved = pd.DataFrame(slots, columns=HOME_COLS + AWAY_COLS, index=game_pbp.index)
+
+    found = stint_index >= 0
+    resolved['home_goalie_id'] = np.where(found, game_stints.goalie_ids[np.maximum(stint_index, 0), 0], np.nan)
+    resolved['away_goalie_id'] = np.where(found, game_stints.goalie_ids[np.maximum(stint_index, 0), 1], np.nan)
+    resolved['strength'] = np.where(found, game_stints.strength[np.maximum(stint_index, 0)], None)
+
+    return resolved
+
+
+def resolve_on_ice(pbp, shifts_df):
+    """
+    Get the players on the ice for every event from the shifts. Shootouts, games with no shifts, and games without
+    shifts for the home team are left empty (compare_on_ice prints those games).
+
+    :param pbp: DataFrame of pbp
+    :param shifts_df: DataFrame of shifts for those games (needs positions)
+
+    :return: DataFrame with the same index as pbp -> homeplayer1_id-6, awayplayer1_id-6, home_goalie_id,
+             away_goalie_id, strength
+    """
+    index = pbp.index
+    pbp = pbp.rename(columns=str.lower)
+    # Period 5 is only a shootout in the regular season
+    pbp = pbp[~((pbp['period'].astype(int) == 5) & (pbp['game_id'].astype(int) < 30000))]
+    shifts_df = shifts_df.rename(columns=str.lower)
+    shifts_df = shifts_df.assign(game_id=shifts_df['game_id'].astype(int))
+    game_shifts = dict(list(shifts_df.groupby('game_id')))
+
+    games = []
+    for game, game_pbp in pbp.groupby(pbp['game_id'].astype(int)):
+        if game in game_shifts:
+            games.append(resolve_game(game_pbp, game_shifts[game]))
+
+    resolved = pd.concat(games) if games else pd.DataFrame(columns=HOME_COLS + AWAY_COLS)
+
+    return resolved.reindex(index)
+
+
+def compare_on_ice(pbp, resolved):
+    """
+    Find the events where the players from the scraper and the ones from the shifts don't match. Only events that
+    were resolved are checked.
+
+    :param pbp: DataFrame of pbp
+    :param resolved: DataFrame from resolve_on_ice
+
+    :return: DataFrame of the events that don't match with both versions of the players
+    """
+    pbp = pbp.rename(columns=str.lower).loc[resolved.index]
+    checked = resolved[HOME_COLS + AWAY_COLS].notnull().any(axis=1).values
+
+    mismatch = np.zeros(len(pbp), dtype=bool)
+    for cols in [HOME_COLS, AWAY_COLS]:
+        scraped = np.sort(pbp[cols].apply(pd.to_numeric, errors='coerce').values.astype(float), axis=1)
+        mine = resolved[cols].values.astype(float)
+        mismatch |= ~((scraped == mine) | (np.isnan(scraped) & np.isnan(mine))).all(axis=1)
+
+    mismatch &= checked
+    print("{} of {} events don't match the players from the shifts".format(mismatch.sum(), checked.sum()))
+
+    # Games where nothing could be resolved (no shifts or none for the home team)
+    game_ids = pbp['game_id'].astype(int)
+    empty_games = sorted(set(game_ids.unique()) - set(game_ids[checked].unique()))
+    if empty_games:
+        print("No players from the shifts for games: " + ', '.join(str(game) for game in empty_games))
+
+    info = pbp.loc[mismatch, ['game_id', 'period', 'seconds_elapsed', 'event']]
+    scraped = pbp.loc[mismatch, HOME_COLS + AWAY_COLS].add_prefix('scraped_')
+
+    return pd.concat([info, scraped, resolved.loc[mismatch, HOME_COLS + AWAY_COLS]], axis=1)
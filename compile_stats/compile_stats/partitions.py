@@ -0,0 +1,180 @@
+"""
+The season pbp tables (ex: pbp2017) are partitioned by the day of the game (game_date). Every day is it's own table
+(ex: pbp2017_20171010) so re-compiling a date range is just dropping those days and attaching the new ones instead of
+deleting from the whole season.
+
+A day is loaded into a staging table first and then attached to the season table when it's done. The staging table
+has a check on the date so attaching it doesn't have to scan it.
+
+Season tables made before this can be moved over with partition_pbp_table.
+"""
+import datetime
+from psycopg2.extensions import AsIs
+
+
+def partition_name(table, date):
+    """
+    Name of the partition for a day
+
+    :param table: season table (ex: pbp2017)
+    :param date: date of games (datetime.date or 'YYYY-MM-DD')
+
+    :return: name of partition (ex: pbp2017_20171010)
+    """
+    return "{}_{}".format(table, str(date)[:10].replace('-', ''))
+
+
+def is_partitioned(cur, table):
+    """
+    Check if a table is partitioned
+
+    :param cur: cursor
+    :param table: name of table
+
+    :return: Boolean
+    """
+    cur.execute("SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = %s",
+                (table,))
+    return cur.rowcount > 0
+
+
+def get_partitions(cur, table):
+    """
+    Get the days that have a partition
+
+    :param cur: cursor
+    :param table: season table
+
+    :return: dict of date -> partition name
+    """
+    cur.execute(
+        """
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = %s
+        """, (table,)
+    )
+
+    partitions = dict()
+    for name, in cur.fetchall():
+        day = name[len(table) + 1:]
+        partitions[datetime.date(int(day[:4]), int(day[4:6]), int(day[6:]))] = name
+
+    return partitions
+
+
+def create_partitioned_table(cur, table, spec):
+    """
+    Create a season table partitioned by game_date if it isn't there. The index on game_id is made for every partition.
+
+    :param cur: cursor
+    :param table: season table
+    :param spec: list of (column, type) for the table (needs game_date)
+
+    :return: None
+    """
+    cols = ', '.join('"{}" {}'.format(col, pg_type) for col, pg_type in spec)
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS %(table)s (%(cols)s) PARTITION BY LIST (game_date);
+        CREATE INDEX IF NOT EXISTS %(index)s ON %(table)s (game_id);
+        """, {'table': AsIs(table), 'cols': AsIs(cols), 'index': AsIs(table + '_game_id_idx')}
+    )
+
+
+def stage_partition(cur, table, date):
+    """
+    Make an empty staging table for a day. If there's already a partition for that day it's dropped. The CHECK (with the
+    NOT NULL) matches the partition bound so it doesn't have to scan the table when it's attached.
+
+    :param cur: cursor
+    :param table: season table
+    :param date: day of games
+
+    :return: name of staging table
+    """
+    drop_partitions(cur, table, date, date)
+
+    staging = partition_name(table, date)
+    cur.execute(
+        """
+        DROP TABLE IF EXISTS %(staging)s;
+        CREATE TABLE %(staging)s (LIKE %(table)s INCLUDING DEFAULTS, CHECK (game_date IS NOT NULL AND game_date = %(date)s));
+        """, {'staging': AsIs(staging), 'table': AsIs(table), 'date': str(date)[:10]}
+    )
+
+    return staging
+
+
+def attach_partition(cur, table, date):
+    """
+    Attach a loaded staging table to the season table
+
+    :param cur: cursor
+    :param table: season table
+    :param date: day of games
+
+    :return: None
+    """
+    cur.execute("ALTER TABLE %(table)s ATTACH PARTITION %(staging)s FOR VALUES IN (%(date)s);",
+                {'table': AsIs(table), 'staging': AsIs(partition_name(table, date)), 'date': str(date)[:10]})
+
+
+def drop_partitions(cur, table, from_date, to_date):
+    """
+    Detach and drop the partitions for every day between two dates
+
+    :param cur: cursor
+    :param table: season table
+    :param from_date: date from
+    :param to_date: date to
+
+    :return: None
+    """
+    from_date = datetime.date.fromisoformat(str(from_date)[:10])
+    to_date = datetime.date.fromisoformat(str(to_date)[:10])
+
+    for date, name in get_partitions(cur, table).items():
+        if from_date <= date <= to_date:
+            cur.execute("ALTER TABLE %(table)s DETACH PARTITION %(name)s; DROP TABLE %(name)s;",
+                        {'table': AsIs(table), 'name': AsIs(name)})
+
+
+def partition_pbp_table(cur, table, spec):
+    """
+    Move a season table that isn't partitioned over to one that is. The old table is copied into a partition for each
+    day and then dropped. Everything happens in the caller's transaction.
+
+    Every row needs a date to know which partition it goes in. If any don't have one nothing is moved (they'd be left
+    out and lost when the old table is dropped).
+
+    :param cur: cursor
+    :param table: season table
+    :param spec: list of (column, type) for the new table. Any the old table doesn't have are added (empty).
+
+    :return: None
+    """
+    print("Partitioning " + table)
+    old = table + '_unpartitioned'
+
+    cur.execute("SELECT DISTINCT game_id FROM %(table)s WHERE date IS NULL OR date = '';", {'table': AsIs(table)})
+    games = [str(game) for game, in cur.fetchall()]
+    if games:
+        raise ValueError("Can't partition {} -> No date for events in games: {}".format(table, ', '.join(games)))
+
+    cur.execute("ALTER TABLE %(table)s RENAME TO %(old)s;", {'table': AsIs(table), 'old': AsIs(old)})
+    for col, pg_type in spec:
+        cur.execute('ALTER TABLE %(old)s ADD COLUMN IF NOT EXISTS "{}" {};'.format(col, pg_type), {'old': AsIs(old)})
+    cur.execute("UPDATE %(old)s SET game_date = CAST(date AS DATE);", {'old': AsIs(old)})
+    create_partitioned_table(cur, table, spec)
+
+    cols = ', '.join('"{}"'.format(col) for col, pg_type in spec)
+    cur.execute("SELECT DISTINCT game_date FROM %(old)s;", {'old': AsIs(old)})
+    for date, in cur.fetchall():
+        staging = stage_partition(cur, table, date)
+        cur.execute("INSERT INTO %(staging)s (%(cols)s) SELECT %(cols)s FROM %(old)s WHERE game_date = %(date)s;",
+                    {'staging': AsIs(staging), 'old': AsIs(old), 'cols': AsIs(cols), 'date': date})
+        attach_partition(cur, table, date)
+
+    cur.execute("DROP TABLE %(old)s;", {'old': AsIs(old)})
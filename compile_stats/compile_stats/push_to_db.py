@@ -1,4 +1,6 @@
+import io
 import os
+import time
 import pandas as pd
 import psycopg2
 from psycopg2.extensions import AsIs
@@ -7,6 +9,49 @@ import sys
 sys.path.append("../{}".format(os.path.dirname(os.path.realpath(__file__))))
 from machine_info import *
 
+from compile_stats import binary_copy, compile_toi, partitions
+
+# Number of rows held in memory at a time before being sent to the db
+CHUNK_SIZE = 50000
+
+# Columns and types for each table
+PBP_SPEC = [
+    ('game_id', 'bigint'), ('date', 'text'), ('period', 'int'), ('event', 'text'), ('description', 'text'),
+    ('time_elapsed', 'text'), ('seconds_elapsed', 'double precision'), ('strength', 'text'), ('ev_zone', 'text'),
+    ('type', 'text'), ('ev_team', 'text'), ('home_zone', 'text'), ('away_team', 'text'), ('home_team', 'text'),
+    ('p1_name', 'text'), ('p1_id', 'double precision'), ('p2_name', 'text'), ('p2_id', 'double precision'),
+    ('p3_name', 'text'), ('p3_id', 'double precision')] + \
+    [(col, pg_type) for i in range(1, 7) for col, pg_type in [('awayplayer{}'.format(i), 'text'),
+                                                               ('awayplayer{}_id'.format(i), 'double precision')]] + \
+    [(col, pg_type) for i in range(1, 7) for col, pg_type in [('homeplayer{}'.format(i), 'text'),
+                                                               ('homeplayer{}_id'.format(i), 'double precision')]] + [
+    ('away_players', 'bigint'), ('home_players', 'bigint'), ('away_score', 'bigint'), ('home_score', 'bigint'),
+    ('away_goalie', 'text'), ('away_goalie_id', 'double precision'), ('home_goalie', 'text'),
+    ('home_goalie_id', 'double precision'), ('xc', 'double precision'), ('yc', 'double precision'),
+    ('home_coach', 'text'), ('away_coach', 'text'), ('season', 'bigint'), ('xc_adj', 'double precision'),
+    ('yc_adj', 'double precision'), ('xg', 'double precision'), ('reg_xg', 'text'), ('shooter_xg', 'double precision'),
+    ('game_date', 'date'), ('score_diff', 'smallint'), ('if_empty', 'smallint')
+]
+PLAYER_TOI_SPEC = [
+    ('player', 'text'), ('player_id', 'double precision'), ('position', 'text'), ('game_id', 'bigint'), ('date', 'text'),
+    ('team', 'text'), ('strength', 'text'), ('if_empty', 'bigint'), ('toi_on', 'double precision'),
+    ('toi_off', 'double precision'), ('home', 'text'), ('opponent', 'text')
+]
+TEAM_TOI_SPEC = [
+    ('team', 'text'), ('game_id', 'bigint'), ('date', 'text'), ('strength', 'text'), ('if_empty', 'bigint'),
+    ('toi', 'double precision'), ('home', 'text'), ('opponent', 'text')
+]
+PAIR_TOI_SPEC = [
+    ('game_id', 'bigint'), ('date', 'text'), ('team', 'text'), ('player_id', 'double precision'),
+    ('other_id', 'double precision'), ('relation', 'text'), ('strength', 'text'), ('if_empty', 'bigint'),
+    ('toi', 'bigint')
+]
+SHIFTS_SPEC = [
+    ('game_id', 'bigint'), ('period', 'bigint'), ('team', 'text'), ('player', 'text'), ('player_id', 'bigint'),
+    ('start', 'double precision'), ('position', 'text'), ('end', 'double precision'), ('duration', 'double precision'),
+    ('date', 'text')
+]
+
 
 def fix_pbp_df(pbpDf):
     """
@@ -45,134 +90,359 @@ def fix_pbp_df(pbpDf):
     pbpDf.yc_adj = pd.to_numeric(pbpDf.yc_adj, errors='coerce')
     pbpDf.xg = pd.to_numeric(pbpDf.xg, errors='coerce')
 
-    return pbpDf
+    # The season tables are partitioned on this
+    pbpDf['game_date'] = pd.to_datetime(pbpDf.date).dt.normalize()
+
+    return add_derived_columns(pbpDf)
 
 
-def csv_to_file(df, df_name):
+def add_derived_columns(pbp):
     """
-    Make df into csv file
-    
+    Add the columns the aggregating needs so it doesn't have to update the whole pbp table for them
+    1. score_diff -> home - away (-3 to 3)
+    2. if_empty -> 1 if either net is empty
+
+    The strength is left alone (see fix_strength) since the season table keeps it like it was scraped.
+
+    :param pbp: DataFrame of pbp (lowercase columns)
+
+    :return: DataFrame with the columns
+    """
+    score_diff = pd.to_numeric(pbp.home_score, errors='coerce') - pd.to_numeric(pbp.away_score, errors='coerce')
+    pbp['score_diff'] = score_diff.clip(-3, 3).astype('Int16')
+
+    pbp['if_empty'] = (pbp.home_goalie_id.isnull() | pbp.away_goalie_id.isnull()).astype('int16')
+
+    return pbp
+
+
+def fix_strength(strength):
+    """
+    Strengths like 5x10 are changed to 5x5. Only for the pbp that's aggregated (the pbp table or in memory).
+
+    :param strength: Series of strengths
+
+    :return: Series of fixed strengths
+    """
+    return strength.where(~(strength.str.len() > 3), '5x5')
+
+
+def fix_shifts_df(shifts):
+    """
+    Fix up the columns for the shifts. The scraped ones don't come with the same types as ones read in from a csv (or
+    the shifts table). Only the columns in the table are kept and the player_id can be null.
+
+    Used for the shifts that were just scraped (compile.process), read back from the table (compile.get_shifts), and
+    loaded into the table.
+
+    :param shifts: DataFrame of shifts
+
+    :return: fixed DataFrame
+    """
+    shifts = shifts.rename(columns=str.lower)
+    shifts = shifts[[col for col, pg_type in SHIFTS_SPEC if col in shifts.columns]]
+
+    shifts = shifts.assign(game_id=shifts['game_id'].astype(int), period=shifts['period'].astype(int),
+                           player_id=pd.to_numeric(shifts['player_id'], errors='coerce').round().astype('Int64'))
+    for col in ['start', 'end', 'duration']:
+        shifts[col] = pd.to_numeric(shifts[col], errors='coerce').astype(float)
+
+    return shifts
+
+
+def print_rate(tables, num_rows, start):
+    """
+    Print how many rows were loaded and how fast
+
+    :param tables: tables loaded into
+    :param num_rows: rows loaded into each table
+    :param start: time the load started
+    """
+    seconds = max(time.time() - start, 1e-6)
+    print("{}: {} rows in {:.2f}s ({:.0f} rows/s)".format(', '.join(tables), num_rows, seconds, num_rows / seconds))
+
+
+def column_list(columns):
+    """
+    Quote the columns for a query ('end' needs it)
+
+    :param columns: list of column names
+
+    :return: string of columns
+    """
+    return ', '.join('"{}"'.format(col) for col in columns)
+
+
+def create_table(cur, table, spec):
+    """
+    Create a table from its spec if it isn't there
+
+    :param cur: cursor
+    :param table: name of table
+    :param spec: list of (column, type)
+
+    :return: None
+    """
+    cols = ', '.join('"{}" {}'.format(col, pg_type) for col, pg_type in spec)
+    cur.execute("CREATE TABLE IF NOT EXISTS {} ({});".format(table, cols))
+
+
+def add_missing_columns(cur, table, spec):
+    """
+    Add any columns in the spec the table doesn't have. Rows already there get nulls for them.
+
+    The columns the table has are checked first so nothing is altered when they're all there (each ALTER locks the
+    whole table -> for a partitioned one that's every partition).
+
+    :param cur: cursor
+    :param table: name of table
+    :param spec: list of (column, type)
+
+    :return: None
+    """
+    cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name = %s", (table,))
+    columns = set(col for col, in cur.fetchall())
+
+    for col, pg_type in spec:
+        if col not in columns:
+            cur.execute('ALTER TABLE {} ADD COLUMN "{}" {};'.format(table, col, pg_type))
+
+
+def copy_chunk(cur, tables, df, spec=None):
+    """
+    COPY a chunk into each table. It's sent as csv unless the spec is given, then it's sent in the binary format.
+    Either way it's only encoded once for all the tables.
+
+    :param cur: cursor
+    :param tables: tables to load into
+    :param df: DataFrame for the chunk
+    :param spec: list of (column, type) for the table -> For binary
+
+    :return: None
+    """
+    if spec is None:
+        columns = [col.lower() for col in df.columns]
+        buffer = io.StringIO()
+        df.to_csv(buffer, index=False, header=False)
+        copy_format = 'CSV'
+    else:
+        columns = [col for col, pg_type in spec]
+        buffer = io.BytesIO(binary_copy.encode(df, spec))
+        copy_format = '(FORMAT binary)'
+
+    for table in tables:
+        buffer.seek(0)
+        cur.copy_expert("COPY {} ({}) FROM STDIN {}".format(table, column_list(columns), copy_format), buffer)
+
+
+def copy_df(cur, df, tables, spec=None, chunk_size=CHUNK_SIZE):
+    """
+    Load a DataFrame into each table. It's encoded one chunk at a time in memory and each chunk is sent to every table
+    so it's only made once.
+
+    :param cur: cursor
     :param df: DataFrame
-    :param df_name: Name of file
-    
+    :param tables: tables to load into
+    :param spec: list of (column, type) for the table -> Sent in the binary format if given. Otherwise csv.
+    :param chunk_size: rows per chunk
+
     :return: None
     """
-    # Make Lowercase
-    df.columns = map(str.lower, df.columns)
-    df.to_csv("{}.csv".format(df_name), sep=',', index=False)
+    start = time.time()
+
+    # Only the columns the table has
+    if spec is not None:
+        spec = [(col, pg_type) for col, pg_type in spec if col in df.columns]
+
+    for i in range(0, df.shape[0], chunk_size):
+        copy_chunk(cur, tables, df.iloc[i:i + chunk_size], spec)
 
+    print_rate(tables, df.shape[0], start)
 
-def toi_to_db(cur):
+
+def add_home_opponent(df, games):
     """
+    Add the home team and the opponent to TOI rows. The team has to be the home or away team in the pbp for that game
+    (after compile_toi.TEAMS is used on both, so ex: 'TBL' and 'T.B' are the same). Any rows where it isn't are left
+    null and the games are printed.
+
+    :param df: DataFrame of player or team TOI rows
+    :param games: DataFrame of home_team and away_team for each game_id (index)
 
+    :return: None
     """
-    print("TOI to db")
+    home = df.game_id.map(games.home_team)
+    away = df.game_id.map(games.away_team)
+
+    team = df.team.replace(compile_toi.TEAMS)
+    is_home, is_away = team == home.replace(compile_toi.TEAMS), team == away.replace(compile_toi.TEAMS)
+
+    df['home'] = home
+    df['opponent'] = away.where(is_home, home.where(is_away))
 
-    # Players
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS player_toi
-        (player text, player_id double precision, position text, game_id bigint, date text, team text, strength text,
-         if_empty bigint, toi_on double precision, toi_off double precision
-        );
+    unmatched = df[~(is_home | is_away)]
+    if not unmatched.empty:
+        print("TOI rows with a team that isn't in the pbp for games: " + ', '.join(
+            "{} ({})".format(game, team) for game, team in unmatched[['game_id', 'team']].drop_duplicates().values))
 
-        COPY player_toi FROM '{}/player_toi.csv' CSV HEADER;
-        """.format(os.getcwd())
-    )
 
-    # Teams
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS team_toi
-        (team text, game_id bigint, date text, strength text, if_empty bigint, toi double precision);
+def toi_to_db(cur, toi_games, games, binary=False, chunk_size=CHUNK_SIZE):
+    """
+    Load the TOI rows as they come in from compile_toi.iter_games. They're held in memory until there's a chunk's worth
+    for a table and then sent over.
+    player_toi and team_toi are just for aggregating. player_pair_toi is kept around.
 
-        COPY team_toi FROM '{}/team_toi.csv' CSV HEADER;
-        """.format(os.getcwd())
-    )
+    The home team and opponent for each row in player_toi and team_toi are added here (from the pbp) so the aggregating
+    doesn't have to change those tables.
 
+    :param cur: cursor
+    :param toi_games: Iterable of (player rows, team rows, pair rows) for each game
+    :param games: DataFrame of home_team and away_team for each game_id (index)
+    :param binary: Send in the binary format instead of csv
+    :param chunk_size: rows per chunk
 
-# TODO: Fix...I guess (read below)
-def shifts_to_db(cur, season):
+    :return: None
     """
-    This doesn't work...probably just an issue with nulls (force change for some cols)
+    print("TOI to db")
+
+    tables = [('player_toi', PLAYER_TOI_SPEC), ('team_toi', TEAM_TOI_SPEC), ('player_pair_toi', PAIR_TOI_SPEC)]
+    for table, spec in tables:
+        create_table(cur, table, spec)
+        add_missing_columns(cur, table, spec)
+
+    pending, loaded = [[] for _ in tables], [0] * len(tables)
+    start = time.time()
+
+    def flush(i):
+        table, spec = tables[i]
+        columns = [col for col, pg_type in spec]
+        if table == 'player_pair_toi':
+            df = pd.DataFrame(pending[i], columns=columns)
+        else:
+            df = pd.DataFrame(pending[i], columns=columns[:-2])
+            add_home_opponent(df, games)
+        copy_chunk(cur, [table], df, spec if binary else None)
+        loaded[i] += len(pending[i])
+        pending[i] = []
+
+    for game_rows in toi_games:
+        for i, rows in enumerate(game_rows):
+            pending[i].extend(rows)
+            if len(pending[i]) >= chunk_size:
+                flush(i)
+
+    # The time here includes calculating the TOI since the rows are made as they're loaded
+    for i, table in enumerate(tables):
+        flush(i)
+        print_rate([table[0]], loaded[i], start)
+
+
+def shifts_to_db(cur, shifts, season, binary=False):
     """
+    Load the shifts into the table for the season (ex: shifts2017). Indexed on game and period so TOI can be
+    recomputed from it without scraping again.
+
+    :param cur: cursor
+    :param shifts: DataFrame of shifts (with positions)
+    :param season: season of games
+    :param binary: Send in the binary format instead of csv
 
-    print("Shifts to db")
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS %(shifts)s
-        (game_id bigint, period bigint, team text, player text, player_id bigint, start double precision, 
-         position text, end double precision, duration double precision, date text
-        );
+    :return: None
+    """
+    print("\nShifts to db")
 
-        COPY %(shifts)s FROM %(path)s CSV HEADER;
-        """, {'shifts': AsIs('shifts' + str(season)), 'path': os.getcwd() + "/tmp_shifts.csv"}
-    )
+    table = 'shifts' + str(season)
+    create_table(cur, table, SHIFTS_SPEC)
+    cur.execute("CREATE INDEX IF NOT EXISTS %(index)s ON %(shifts)s (game_id, period);",
+                {'index': AsIs(table + '_game_id_period_idx'), 'shifts': AsIs(table)})
 
+    copy_df(cur, shifts, [table], SHIFTS_SPEC if binary else None)
 
-def pbp_to_db(cur, season):
 
-    print("\nPbp to db")
-    for db_type in ['', str(season)]:
-        cur.execute(
-            """
-             CREATE TABLE IF NOT EXISTS %(pbp)s
-             (game_id bigint, date text, period int, event text, description text, time_elapsed text,
-             seconds_elapsed double precision, strength text, ev_zone text, type text, ev_team text,
-             home_zone text, away_team text, home_team text, p1_name text, p1_id double precision, p2_name text,
-             p2_id double precision, p3_name text, p3_id double precision, awayplayer1 text, awayplayer1_id double precision,
-             awayplayer2 text, awayplayer2_id double precision,  awayplayer3 text,  awayplayer3_id double precision,
-             awayplayer4 text, awayplayer4_id double precision,  awayplayer5 text,  awayplayer5_id double precision,
-             awayplayer6 text, awayplayer6_id double precision,  homeplayer1 text,  homeplayer1_id double precision,
-             homeplayer2 text, homeplayer2_id double precision,  homeplayer3 text,  homeplayer3_id double precision,
-             homeplayer4 text, homeplayer4_id double precision,  homeplayer5 text,  homeplayer5_id double precision,
-             homeplayer6 text, homeplayer6_id double precision,  away_players bigint, home_players bigint,
-             away_score bigint,  home_score bigint, away_goalie text,  away_goalie_id double precision,
-             home_goalie text, home_goalie_id double precision,  xc double precision, yc double precision, home_coach text, 
-             away_coach text, season bigint, xc_adj double precision, yc_adj double precision, xg double precision,
-             reg_xg text, shooter_xg double precision);
+def pbp_to_db(cur, pbp, season, binary=False, work_table=True):
+    """
+    Load the pbp into the table used for aggregating (pbp) and the one for the season (ex: pbp2017). Both are loaded 
+    from the same chunks.
     
-             COPY %(pbp)s FROM %(path)s CSV HEADER;
-            """, {'pbp': AsIs('pbp' + db_type), 'path': os.getcwd() + "/tmp_pbp.csv"}
-        )
+    The season table is partitioned by day. Each day goes into a staging table and is attached when it's loaded. A 
+    season table from before it was partitioned is moved over first.
+    
+    :param cur: cursor
+    :param pbp: DataFrame of pbp
+    :param season: season of games
+    :param binary: Send in the binary format instead of csv
+    :param work_table: Load the pbp table used for aggregating (not needed when it's done in memory -> aggregate_frames)
+    
+    :return: None
+    """
+    print("\nPbp to db")
+
+    # Every row needs a day to go into (groupby would just leave them out)
+    if pbp.game_date.isnull().any():
+        games = pbp.loc[pbp.game_date.isnull(), 'game_id'].unique()
+        raise ValueError("No game_date for events in games: " + ', '.join(str(game) for game in games))
 
+    table = 'pbp' + str(season)
+    if work_table:
+        create_table(cur, 'pbp', PBP_SPEC)
+    if not partitions.is_partitioned(cur, table):
+        cur.execute("select * from information_schema.tables where table_name=%s", (table,))
+        if cur.rowcount > 0:
+            partitions.partition_pbp_table(cur, table, PBP_SPEC)
+        partitions.create_partitioned_table(cur, table, PBP_SPEC)
 
-def push_to_db(pbp, shifts, player_df, team_df, season):
+    # For columns added after the season table was made
+    add_missing_columns(cur, table, PBP_SPEC)
+
+    for date, day_pbp in pbp.groupby('game_date'):
+        staging = partitions.stage_partition(cur, table, date)
+        work_pbp = day_pbp.assign(strength=fix_strength(day_pbp.strength))
+
+        # Both tables get the same chunks unless a strength had to be fixed for the pbp table
+        if not work_table:
+            copy_df(cur, day_pbp, [staging], PBP_SPEC if binary else None)
+        elif work_pbp.strength.equals(day_pbp.strength):
+            copy_df(cur, day_pbp, ['pbp', staging], PBP_SPEC if binary else None)
+        else:
+            copy_df(cur, work_pbp, ['pbp'], PBP_SPEC if binary else None)
+            copy_df(cur, day_pbp, [staging], PBP_SPEC if binary else None)
+
+        partitions.attach_partition(cur, table, date)
+
+
+def push_to_db(pbp, shifts, toi_games, season, binary=False, work_table=True):
     """
     Push everything to DB:
     1. Team and Player TOI tables
     2. pbp for aggregating data
     3. Add to master pbp
     4. Add to master shifts 
+    
+    Nothing is written to disk. Everything is sent over with COPY FROM STDIN.
+    With binary the values are sent the way they're stored so Postgres doesn't have to parse the text. 
+    
+    :param pbp: DataFrame of pbp
+    :param shifts: DataFrame of shifts (with positions)
+    :param toi_games: Iterable of (player rows, team rows, pair rows) for each game -> compile_toi.iter_games
+    :param season: season of games
+    :param binary: Send in the binary COPY format instead of csv
+    :param work_table: Load the pbp table used for aggregating
+    
+    :return: DataFrame of pbp as it was loaded into the pbp table (strengths fixed)
     """
     conn = psycopg2.connect(host=HOST, database="nhl_data", user=USERNAME, password=PASSWORD)
     cur = conn.cursor()
 
     # Fix misc. columns
     pbp = fix_pbp_df(pbp)
-    player_df.game_id = pd.to_numeric(player_df.game_id, errors='coerce')
-    player_df.player_id = pd.to_numeric(player_df.player_id, errors='coerce')
-    team_df.game_id = pd.to_numeric(team_df.game_id, errors='coerce')
-
-    # Make into CSV files
-    csv_to_file(pbp, "tmp_pbp")
-    #csv_to_file(shifts, "tmp_shifts")
-    csv_to_file(player_df, "player_toi")
-    csv_to_file(team_df, "team_toi")
+    shifts = fix_shifts_df(shifts)
 
-
-    pbp_to_db(cur, season)
-    #shifts_to_db(cur, season)
-    toi_to_db(cur)
+    pbp_to_db(cur, pbp, season, binary, work_table)
+    shifts_to_db(cur, shifts, season, binary)
+    toi_to_db(cur, toi_games, pbp.groupby('game_id')[['home_team', 'away_team']].first(), binary)
 
     conn.commit()
     cur.close()
     conn.close()
 
-    # Delete Tmp Files
-    os.remove("tmp_pbp.csv")
-    #os.remove("tmp_shifts.csv")
-    os.remove("player_toi.csv")
-    os.remove("team_toi.csv")
-
-
+    return pbp.assign(strength=fix_strength(pbp.strength))
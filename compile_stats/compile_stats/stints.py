@@ -0,0 +1,209 @@
+"""
+Stint table for a game. A stint is a stretch of the game where nobody got on or off the ice so the lineup for both
+teams is the same the whole way through.
+
+Everything is stored by column in arrays (one entry per stint) so the TOI, who was on for an event, and who played
+with who can all be read off of it without going back through the shifts.
+
+The seconds run through the whole game -> A shift in the 2nd period starts at 1200 + start
+
+All runs through - build_stints
+"""
+import numpy as np
+
+
+class Stints:
+    """
+    On-ice lineups for one game
+
+    players -> DataFrame of everyone who played (player, player_id, position, team). The row number is the player's
+               index in on_ice.
+    teams -> [home, away] if the home team was given. Otherwise just both teams.
+    start, end -> second the stint starts and ends (end isn't included)
+    on_ice -> matrix of stint x player (True if on the ice)
+    skaters, goalies -> number of each on the ice for teams[0] and teams[1]
+    goalie_ids -> player_id of the goalie in net for teams[0] and teams[1] (nan if empty)
+    strength -> 'teams[0] skaters x teams[1] skaters'
+    if_empty -> If either net is empty
+    masks -> Skaters on the ice for teams[0] and teams[1] as a bitmask. Bit n is the nth player in team_players(team).
+    """
+    def __init__(self, game_id, date, teams, players, start, end, on_ice):
+        self.game_id = game_id
+        self.date = date
+        self.teams = teams
+        self.players = players
+        self.start = start
+        self.end = end
+        self.on_ice = on_ice
+
+        self.team_index = np.array([teams.index(team) for team in players['team']], dtype=np.int64)
+        self.goalie = players['position'].values == 'G'
+
+        self.skaters = np.stack([self.team_on_ice(i).sum(axis=1) for i in range(2)], axis=1)
+        self.goalies = np.stack([self.team_on_ice(i, goalies=True).sum(axis=1) for i in range(2)], axis=1)
+        self.if_empty = (self.goalies == 0).any(axis=1).astype(np.int64)
+
+        player_ids = players['player_id'].values.astype(float)
+        self.goalie_ids = np.full((len(start), 2), np.nan)
+        for i in range(2):
+            goalies = self.team_players(i, goalies=True)
+            in_net = self.on_ice[:, goalies].any(axis=1)
+            self.goalie_ids[in_net, i] = player_ids[goalies[self.on_ice[in_net][:, goalies].argmax(axis=1)]]
+
+        self.masks = np.stack([lineup_masks(self.team_on_ice(i)) for i in range(2)], axis=1)
+
+    def __len__(self):
+        return len(self.start)
+
+    @property
+    def strength(self):
+        """
+        Strength of each stint as 'teams[0] skaters x teams[1] skaters'. Only made when asked for.
+        """
+        return np.array(['x'.join([str(x[0]), str(x[1])]) for x in self.skaters])
+
+    @property
+    def lengths(self):
+        """
+        Length of each stint in seconds
+        """
+        return self.end - self.start
+
+    def team_players(self, team_index, goalies=False):
+        """
+        Index of the skaters (or goalies) for one team
+
+        :param team_index: 0 or 1 -> for teams[0] or teams[1]
+        :param goalies: Goalies instead of skaters
+
+        :return: array of player indices
+        """
+        return np.flatnonzero((self.team_index == team_index) & (self.goalie == goalies))
+
+    def team_on_ice(self, team_index, goalies=False):
+        """
+        on_ice for just the skaters (or goalies) of one team
+
+        :param team_index: 0 or 1 -> for teams[0] or teams[1]
+        :param goalies: Goalies instead of skaters
+
+        :return: matrix of stint x player
+        """
+        return self.on_ice[:, self.team_players(team_index, goalies)]
+
+    def find(self, seconds):
+        """
+        Find the stint for each second given. The stint that starts at a given second is the one used.
+
+        :param seconds: array of seconds (from the start of the game)
+
+        :return: array of stint indices (-1 if nobody was on the ice)
+        """
+        seconds = np.asarray(seconds)
+        stints = np.searchsorted(self.start, seconds, side='right') - 1
+        found = (stints >= 0) & (seconds < self.end[np.maximum(stints, 0)])
+
+        return np.where(found, stints, -1)
+
+
+def lineup_masks(on_ice):
+    """
+    Turn the skaters on the ice for each stint into one number. Only works for up to 64 players.
+
+    :param on_ice: matrix of stint x player for one team
+
+    :return: array of bitmasks
+    """
+    if on_ice.shape[1] > 64:
+        raise ValueError("Can't make a bitmask for more than 64 players")
+
+    bits = np.left_shift(np.uint64(1), np.arange(on_ice.shape[1], dtype=np.uint64))
+    return (on_ice * bits).sum(axis=1, dtype=np.uint64)
+
+
+def lineup_matrix(masks, num_players):
+    """
+    Turn bitmasks back into a matrix of lineup x player (opposite of lineup_masks)
+
+    :param masks: array of bitmasks
+    :param num_players: Number of players the masks were made from
+
+    :return: matrix of lineup x player (1 if on the ice)
+    """
+    return (masks[:, None] >> np.arange(num_players, dtype=np.uint64)) & np.uint64(1)
+
+
+def get_players(game_df):
+    """
+    Get players who played in specific game
+
+    :param game_df: DataFrame for game with shift info
+
+    :return: DataFrame of players
+    """
+    players = game_df[['player', 'player_id', 'position', 'team']].drop_duplicates(subset=['player_id', 'team'])
+
+    return players.reset_index(drop=True)
+
+
+def get_on_ice(game_df, players):
+    """
+    Turns the shifts into the intervals of the game where nobody got on or off the ice. Every start and end of a shift
+    is a boundary. A player is on for an interval when the running sum of his shift starts and ends is above zero.
+
+    :param game_df: DataFrame with shift info for game
+    :param players: DataFrame of players in game
+
+    :return: start of each interval, end of each interval, matrix of interval x player (True if on the ice)
+    """
+    player_index = {key: i for i, key in enumerate(zip(players['team'], players['player_id'].map(str)))}
+    shift_players = np.array([player_index[key] for key in zip(game_df['team'], game_df['player_id'].map(str))],
+                             dtype=np.int64)
+
+    offset = 1200 * (game_df['period'].values.astype(np.int64) - 1)
+    start = game_df['start'].values.astype(np.int64) + offset
+    end = game_df['end'].values.astype(np.int64) + offset
+
+    # Player isn't on for the second he gets off...so a shift w/ no length doesn't count for anything
+    valid = end > start
+    start, end, shift_players = start[valid], end[valid], shift_players[valid]
+
+    times = np.unique(np.concatenate([start, end]))
+    changes = np.zeros((len(times), len(players)), dtype=np.int32)
+    np.add.at(changes, (np.searchsorted(times, start), shift_players), 1)
+    np.add.at(changes, (np.searchsorted(times, end), shift_players), -1)
+
+    # Last boundary doesn't start an interval
+    on_ice = np.cumsum(changes, axis=0)[:-1] > 0
+
+    return times[:-1], times[1:], on_ice
+
+
+def build_stints(game_df, home_team=None):
+    """
+    Compress the shifts for a game into stints. Intervals next to each other with the same players on the ice are
+    merged and any with nobody on the ice are dropped.
+
+    :param game_df: DataFrame with shift info for game (needs positions)
+    :param home_team: Home team for game. If given it's teams[0].
+
+    :return: Stints object
+    """
+    players = get_players(game_df)
+    start, end, on_ice = get_on_ice(game_df, players)
+
+    # Only keep an interval when the lineup changed from the one before it
+    new_lineup = np.ones(len(start), dtype=bool)
+    new_lineup[1:] = (on_ice[1:] != on_ice[:-1]).any(axis=1)
+    stint_starts = np.flatnonzero(new_lineup)
+    stint_ends = np.append(stint_starts[1:], len(start)) - 1
+
+    start, end, on_ice = start[stint_starts], end[stint_ends], on_ice[stint_starts]
+    anyone = on_ice.any(axis=1)
+
+    teams = sorted(set(game_df['team']))
+    if home_team in teams:
+        teams = [home_team] + [team for team in teams if team != home_team]
+
+    return Stints(game_df.iloc[0]['game_id'], game_df.iloc[0]['date'], teams, players, start[anyone], end[anyone],
+                  on_ice[anyone])
@@ -0,0 +1,4 @@
+HOST = '/tmp/pgdata'
+USERNAME = 'postgres'
+PASSWORD = ''
+SITE_DB = 'site'
@@ -4,27 +4,15 @@ Only for shift files that do not have player positions yet!!!
 All runs through - fill_shifts_with_positions
 """
 
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine
 
 import sys
 sys.path.append("..")
 from machine_info import *
 
-
-def get_player(row):
-    """
-    Subset of id and position
-    """
-    return [row['id'], row['position']]
-
-
-def get_position(player_id, players):
-    try:
-        return players[str(player_id)]
-    except KeyError:
-        print("Player id " + str(player_id) + " not found")
-        return ''
+from compile_stats import compile_toi
+from nhl_players import player_registry
 
 
 # TODO: This functions shouldn't be in this file
@@ -32,82 +20,68 @@ def check_missing_shifts(shifts_df):
     """
     Checks for missing shifts for Goalies (others can have but those would be a lot more work to find)
     Adds them in if they have any
+
+    Everything is done for all the games at once -> The periods each team has a goalie for come from one groupby and
+    all the missing shifts are added in one go.
     
     :param shifts_df: Shifts DataFrame
     
     :return: Shifts DataFrame with some (or none) extra shifts included
     """
-    games_list = list(set(shifts_df['game_id'].tolist()))
+    keys = ['game_id', 'team', 'period']
 
-    for game in games_list:
-        game_df = shifts_df[shifts_df['game_id'] == game]
-        game_df = game_df.reset_index(drop=True)
+    # Get last period in game (really only matters for non-regulation games) -> period of the game's last shift
+    games = shifts_df.groupby('game_id', sort=False)['period'].agg(['nunique', 'last'])
+    last_period = games['last'].where(games['nunique'] > 3, 3).astype(int).rename('last_period')
 
-        # Get last period in game and time (really only matters for non-regulation games)
-        if len(set(game_df['period'].tolist())) > 3:
-            last_period = game_df['period'][game_df.shape[0] - 1]
-            last_time = list(range(0, int(game_df['end'][game_df.shape[0] - 1]) + 1))
-            game_end = {'period': last_period, 'time': last_time}
-        else:
-            game_end = {'period': 3, 'time': 1200}
+    goalies_df = shifts_df[shifts_df.position == 'G']
+    goalie_periods = goalies_df.groupby(keys, observed=True, sort=False).size().reset_index()[keys]
 
-        for team in list(set(game_df['team'].tolist())):
-            goalie_df = game_df[(game_df.team == team) & (game_df.position == 'G')]  # Subset goalies from team
-            goalie_periods = list(set(goalie_df['period'].tolist()))
+    # Just use the first goalie in the game for each team...if it's not him I don't care
+    goalies = goalies_df.drop_duplicates(['game_id', 'team']).join(last_period, on='game_id').reset_index(drop=True)
 
-            # Get periods missing from shifts for goalies
-            missing_periods = list(set(range(1, game_end['period']+1))-set(goalie_periods))
+    # One row for every period of the game for each goalie
+    missing = goalies.loc[goalies.index.repeat(goalies['last_period'])]
+    missing['period'] = (missing.groupby(level=0).cumcount() + 1).astype(shifts_df['period'].dtype)
 
-            # Just use the first goalie in the game...if it's not him I don't care. I don't give a fuck at this point
-            goalie = dict(goalie_df.iloc[0])
+    # Only keep periods the team doesn't have a goalie for
+    missing = missing.merge(goalie_periods, on=keys, how='left', indicator=True)
+    missing = missing[missing['_merge'] == 'left_only']
 
-            # Add Goalie Data in for missing periods
-            for period in missing_periods:
-                missing = goalie
-                missing['period'] = period
-                missing['start'] = 0
-                missing['end'] = 1200
-                missing['duration'] = 1200
+    if missing.empty:
+        return shifts_df
 
-                shifts_df = shifts_df.append(missing, ignore_index=True)
+    missing = missing.assign(start=0, end=1200, duration=1200)[shifts_df.columns]
 
-    return shifts_df
+    return pd.concat([shifts_df, missing], ignore_index=True)
 
 
 def fill_shifts_with_positions(shifts_df):
     """
-    Given a DataFrame filled with the shift info for a collection of games it fills in the positions for each player
+    Given a DataFrame filled with the shift info for a collection of games it fills in the positions for each player.
+    Every player is looked up at once and any that can't be found are printed together.
     
     :param shifts_df: DataFrame of Shifts
     
-    :return: Same DataFrame with positions
+    :return: Same DataFrame with positions -> In compile_toi.SHIFT_DTYPES
     """
-    # Get Players table from db
-    # TODO: Barlowe
-    engine = create_engine('postgresql://{}:{}@{}:5432/nhl_data'.format(USERNAME, PASSWORD, HOST))
-    players_df = pd.read_sql_table('nhl_players', engine)
-
-    # Get list of all players and positions
-    players_series = players_df.apply(lambda row: get_player(row), axis=1)
-    players_set = set(tuple(x) for x in players_series.tolist())
-    players_list = [list(x) for x in players_set]
-
-    # Dict of players -> ID is key
-    players = dict()
-    for p in players_list:
-        players[str(p[0])] = p[1]
-
     # Get rid of shifts that are fucked up
     shifts_df = shifts_df[~shifts_df['player_id'].isnull()]
+    player_ids = shifts_df['player_id'].astype(np.int64)
+
+    # Players from db (only read in once -> see player_registry). Any added since then are fetched first.
+    # TODO: Barlowe
+    players = player_registry.get_registry()
+    players.refresh(player_ids)
 
     # Fill in positions
-    shifts_df['position'] = shifts_df.apply(lambda row: get_position(int(row['player_id']), players), axis=1)
+    shifts_df = shifts_df.assign(position=players.positions(player_ids))
+
+    missing = players.unknown(player_ids)
+    if len(missing) > 0:
+        print("Player ids not found: " + ', '.join(str(player_id) for player_id in sorted(missing)))
 
     # Sometimes goalies are missing shifts...add them in here
     shifts_df = check_missing_shifts(shifts_df)
 
-    return shifts_df[['game_id', 'date', 'period', 'team', 'player', 'player_id', 'position', 'start', 'end', 'duration']]
-
-
-
-
+    return compile_toi.compact_shifts(shifts_df)
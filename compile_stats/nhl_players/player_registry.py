@@ -0,0 +1,174 @@
+"""
+One copy of nhl_players for the whole process. It's read in once and kept in arrays (id -> hand, position, name).
+After that only new players are fetched -> ids over the highest one seen or ones that were just added.
+
+Ex: registry = player_registry.get_registry()
+    registry.positions(shifts_df['player_id'])
+
+All runs through - get_registry
+"""
+import numpy as np
+import pandas as pd
+import psycopg2
+
+import sys
+sys.path.append("..")
+from machine_info import *
+
+
+class PlayerRegistry:
+    """
+    Info for every player in nhl_players. Each player is one spot in the arrays and ids finds it.
+
+    ids -> Index of player ids
+    hand, position, name -> shoots_catches, position, and name for each player
+    watermark -> Highest id fetched so far
+    """
+    def __init__(self):
+        self.ids = pd.Index([], dtype=np.int64)
+        self.hand = np.array([], dtype=object)
+        self.position = np.array([], dtype=object)
+        self.name = np.array([], dtype=object)
+        self.watermark = -1
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, rows):
+        """
+        Add players that aren't here yet
+
+        :param rows: list of (id, shoots_catches, position, name)
+
+        :return: None
+        """
+        players = pd.DataFrame(rows, columns=['id', 'hand', 'position', 'name'])
+        players['id'] = pd.to_numeric(players.id, errors='coerce')
+        players = players[players.id.notnull()].drop_duplicates('id')
+        players = players[~players.id.astype(np.int64).isin(self.ids)]
+        if players.empty:
+            return
+
+        self.ids = self.ids.append(pd.Index(players.id.astype(np.int64).values))
+        self.hand = np.concatenate([self.hand, players.hand.values.astype(object)])
+        self.position = np.concatenate([self.position, players.position.values.astype(object)])
+        self.name = np.concatenate([self.name, players.name.values.astype(object)])
+        self.watermark = max(self.watermark, int(self.ids.max()))
+
+    def add(self, players):
+        """
+        Add players that were just inserted into nhl_players
+
+        :param players: list of dicts for each player (process_players.get_player_info)
+
+        :return: None
+        """
+        self.append([(p['id'], p['shoots_catches'], p['position'], p['name']) for p in players])
+
+    def refresh(self, ids=None):
+        """
+        Get the players that were added to nhl_players since the last time. That's every id over the watermark and any
+        of the ids given that aren't here (the first time it's everyone).
+
+        :param ids: ids to make sure are fetched if they're in the table
+
+        :return: None
+        """
+        conn = psycopg2.connect(host=HOST, database="nhl_data", user=USERNAME, password=PASSWORD)
+        cur = conn.cursor()
+
+        cur.execute("SELECT id, shoots_catches, position, name FROM nhl_players WHERE id > %s", (self.watermark,))
+        self.append(cur.fetchall())
+
+        if ids is not None:
+            missing = [int(player_id) for player_id in self.unknown(ids)]
+            if missing:
+                cur.execute("SELECT id, shoots_catches, position, name FROM nhl_players WHERE id = ANY(%s)", (missing,))
+                self.append(cur.fetchall())
+
+        cur.close()
+        conn.close()
+
+    def locate(self, ids):
+        """
+        Get the spot of each id in the arrays
+
+        :param ids: player ids (nan is fine)
+
+        :return: array of spots (-1 if not here)
+        """
+        ids = pd.to_numeric(pd.Series(ids), errors='coerce').values.astype(float)
+        known = ~np.isnan(ids)
+
+        spots = np.full(len(ids), -1, dtype=np.int64)
+        spots[known] = self.ids.get_indexer(ids[known].astype(np.int64))
+
+        return spots
+
+    def lookup(self, values, ids, default):
+        """
+        Get the value for each id
+
+        :param values: one of the arrays (ex: self.hand)
+        :param ids: player ids
+        :param default: for ids that aren't here
+
+        :return: array of values
+        """
+        spots = self.locate(ids)
+        found = spots >= 0
+
+        looked_up = np.full(len(spots), default, dtype=object)
+        looked_up[found] = values[spots[found]]
+
+        return looked_up
+
+    def handedness(self, ids, default=''):
+        return self.lookup(self.hand, ids, default)
+
+    def positions(self, ids, default=''):
+        return self.lookup(self.position, ids, default)
+
+    def names(self, ids, default=''):
+        return self.lookup(self.name, ids, default)
+
+    def unknown(self, ids):
+        """
+        Get the ids that aren't here
+
+        :param ids: player ids
+
+        :return: array of unique ids (nan is skipped)
+        """
+        ids = pd.to_numeric(pd.Series(ids), errors='coerce').dropna().astype(np.int64).unique()
+
+        return ids[self.ids.get_indexer(ids) < 0]
+
+    def spot(self, player_id):
+        """
+        Get the spot of one player
+
+        :param player_id: player's id number
+
+        :return: spot in the arrays -> KeyError if they aren't here (ValueError if it's nan)
+        """
+        return self.ids.get_loc(int(player_id))
+
+
+# Shared by everything in the process
+_registry = None
+
+
+def get_registry():
+    """
+    Get the registry. The first time it's called nhl_players is read in.
+
+    :return: PlayerRegistry
+    """
+    global _registry
+
+    if _registry is None:
+        _registry = PlayerRegistry()
+        _registry.refresh()
+
+    return _registry
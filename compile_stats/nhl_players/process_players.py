@@ -5,8 +5,10 @@ All runs through - process_players
 """
 
 import json
+import os
+import threading
 import time
-import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import requests
 from requests.adapters import HTTPAdapter
@@ -17,40 +19,138 @@ import sys
 sys.path.append("..")
 from machine_info import *
 
+from nhl_players import player_registry
 
-def get_page(url):
+
+# {} is the player id
+PEOPLE_URL = 'http://statsapi.web.nhl.com/api/v1/people/{}'
+
+# Raw response for each player that was fetched -> {id}.json
+PEOPLE_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'people_cache')
+
+FETCH_WORKERS = 8
+REQUESTS_PER_SECOND = 4
+
+
+class TokenBucket:
+    """
+    Limits how fast requests go out across threads. Holds up to capacity tokens and gets rate more every second. Each
+    request takes one (and waits for one if there aren't any).
+    """
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        """
+        Wait until there's a token and take it
+
+        :return: None
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+def get_session(pool_size=FETCH_WORKERS):
+    """
+    Get a session that keeps its connections around (one for each thread) and retries
+
+    :param pool_size: number of connections to keep
+
+    :return: Session
+    """
+    session = requests.Session()
+    retries = Retry(total=10, backoff_factor=.1, status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+
+def get_page(url, session, bucket=None):
     """
     Get the page
     
     :param url: given url
+    :param session: Session to get it with (get_session)
+    :param bucket: TokenBucket to wait on before it's requested (None to not wait)
     
     :return: page
     """
-    response = requests.Session()
-    retries = Retry(total=10, backoff_factor=.1)
-    response.mount('http://', HTTPAdapter(max_retries=retries))
+    if bucket is not None:
+        bucket.take()
 
-    response = response.get(url, timeout=5)
+    response = session.get(url, timeout=5)
     response.raise_for_status()
 
-    time.sleep(1)
-
     return json.loads(response.text)
 
 
-def get_player_info(player_id):
+def cache_file(player_id, cache_dir=PEOPLE_CACHE):
     """
-    Scrape info for a given player
-    
+    Get the file a player's people response is cached in
+
     :param player_id: id per NHL
-    
-    :return: player info
+    :param cache_dir: directory with a file for each player fetched (None to not use one)
+
+    :return: file name (None if no cache)
+    """
+    return os.path.join(cache_dir, '{}.json'.format(player_id)) if cache_dir else None
+
+
+def get_people(player_id, session, bucket=None, url=PEOPLE_URL, cache_dir=PEOPLE_CACHE):
+    """
+    Get the response from the people api for a player. It's saved to the cache so it's only ever fetched once.
+
+    :param player_id: id per NHL
+    :param session: Session to get it with
+    :param bucket: TokenBucket to wait on
+    :param url: people url -> {} is the player id
+    :param cache_dir: directory with a file for each player fetched (None to not use one)
+
+    :return: response as a dict
+    """
+    file_name = cache_file(player_id, cache_dir)
+
+    if file_name and os.path.isfile(file_name):
+        with open(file_name) as f:
+            return json.load(f)
+
+    response = get_page(url.format(player_id), session, bucket)
+
+    # Only keep ones with a player. Written to another file first so it's never half there
+    if file_name and response.get('people'):
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(file_name + '.tmp', 'w') as f:
+            json.dump(response, f)
+        os.replace(file_name + '.tmp', file_name)
+
+    return response
+
+
+def parse_player(response):
     """
-    url = 'http://statsapi.web.nhl.com/api/v1/people/{}'.format(player_id)
-    response = get_page(url)
+    Get the info for the player in a people response
 
-    print("Scraping a new player...  " + response['people'][0]['fullName'])
+    :param response: response from the people api
 
+    :return: player info
+    """
     p = {'id': response['people'][0]['id'], 'name': response['people'][0]['fullName']}
     try:
         p['birth_date'] = response['people'][0]['birthDate']
@@ -85,6 +185,54 @@ def get_player_info(player_id):
     return p
 
 
+def get_player_info(player_id, session=None, bucket=None, url=PEOPLE_URL, cache_dir=PEOPLE_CACHE):
+    """
+    Scrape info for a given player
+    
+    :param player_id: id per NHL
+    :param session: Session to get it with (a new one if not given)
+    :param bucket: TokenBucket to wait on
+    :param url: people url -> {} is the player id
+    :param cache_dir: directory of cached responses
+    
+    :return: player info
+    """
+    session = session if session is not None else get_session(1)
+
+    return parse_player(get_people(player_id, session, bucket, url, cache_dir))
+
+
+def fetch_players(player_ids, workers=FETCH_WORKERS, rate=REQUESTS_PER_SECOND, url=PEOPLE_URL, cache_dir=PEOPLE_CACHE):
+    """
+    Scrape info for a bunch of players at once. They share one session and no more than rate requests go out each
+    second (ones in the cache don't count). It's printed once how many were scraped and how many were in the cache (the
+    threads would mix up one line per player).
+
+    :param player_ids: ids per NHL
+    :param workers: most players to fetch at once
+    :param rate: requests per second (None for no limit)
+    :param url: people url -> {} is the player id
+    :param cache_dir: directory of cached responses
+
+    :return: list of player info (same order as the ids)
+    """
+    player_ids = list(player_ids)
+    cached = sum(os.path.isfile(cache_file(player_id, cache_dir)) for player_id in player_ids) if cache_dir else 0
+    if player_ids:
+        print("Scraping {} new players ({} from the cache)".format(len(player_ids) - cached, cached))
+
+    session = get_session(workers)
+    bucket = TokenBucket(rate) if rate else None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        players = list(executor.map(lambda player_id: get_player_info(player_id, session, bucket, url, cache_dir),
+                                    player_ids))
+
+    session.close()
+
+    return players
+
+
 def process_players(df):
     """
     Get player info for each player and store in db
@@ -93,33 +241,19 @@ def process_players(df):
     df.columns = map(str.lower, df.columns)
 
     engine = create_engine('postgresql://{}:{}@{}:5432/nhl_data'.format(USERNAME, PASSWORD, HOST))
-    player_df = pd.read_sql_table('nhl_players', engine)
-
-    # Get list of id's for players in scraped games
-    df = df[np.isfinite(df['player_id'])]
-    scraped_players = set(x for x in df['player_id'].tolist())
-    scraped_players = [int(x) for x in scraped_players if x != np.nan]
 
-    # Get list of id's already in database
-    players = set(x for x in player_df['id'].tolist())
-    players = [int(x) for x in players]
+    # Players already in database -> Only the ones added since it was last read are fetched
+    players = player_registry.get_registry()
+    players.refresh(df['player_id'])
 
     # Scrape info for any new players
-    players_info = [get_player_info(player_id) for player_id in scraped_players if player_id not in players]
+    players_info = fetch_players(players.unknown(df['player_id']))
 
     # If any new players append to the database
     if len(players_info) != 0:
         print('\n')
         df = pd.DataFrame(players_info)
         df.to_sql('nhl_players', engine, if_exists='append', index=False)
+        players.add(players_info)
     else:
         print("No new players added to db\n")
-
-
-
-
-
-
-
-
-
@@ -3,14 +3,16 @@ Shared Functions among different modules
 """
 
 import time
+import numpy as np
 import pandas as pd
 import psycopg2
-from sqlalchemy import create_engine
 
 import sys
 sys.path.append("..")
 from machine_info import *
 
+from nhl_players import player_registry
+
 
 def get_season_table(table, engine):
     """
@@ -58,65 +60,13 @@ def get_season(date):
             return str(int(year) - 1)
 
 
-def get_player_handedness(player_id, players):
-    """
-    Return handedness of player - alerts me if can't find player
-
-    :param player_id: player's id number
-    :param players: dict of players
-
-    :return: handedness
-    """
-    try:
-        player_id = int(player_id)
-        return players[str(player_id)]["hand"]
-    except KeyError:
-        print("Player id " + str(player_id) + " not found")
-        return ''
-    except ValueError:
-        return ''
-
-
-def get_player_position(player_id, players):
-    """
-    Return position of player - alerts me if can't find player
-    ValueError is for when it's nan (not an event with a primary player)
-
-    :param player_id: player's id number
-    :param players: dict of players
-
-    :return: position
-    """
-    try:
-        player_id = int(player_id)
-        return players[str(player_id)]["pos"]
-    except KeyError:
-        print("Player id " + str(player_id) + " not found")
-        return ''
-    except ValueError:
-        return ''
-
-
 def get_player_info():
     """
-    Get info on players from db
+    Get info on players from db. It's only read in once for the whole process (see player_registry).
 
-    :return: dict of players
+    :return: PlayerRegistry
     """
-    engine = create_engine('postgresql://{}:{}@{}:5432/nhl_data'.format(USERNAME, PASSWORD, HOST))
-    players_df = pd.read_sql_table('nhl_players', engine)
-
-    # Get list of all players and positions
-    players_series = players_df.apply(lambda row: [row['id'], row['shoots_catches'], row['position']], axis=1)
-    players_set = set(tuple(x) for x in players_series.tolist())
-    players_list = [list(x) for x in players_set]
-
-    # Dict of players -> ID is key
-    players = dict()
-    for p in players_list:
-        players[str(p[0])] = {"hand": p[1], "pos": "F" if p[2] in ["RW", "LW", "C"] else "D"}
-
-    return players
+    return player_registry.get_registry()
 
 
 def get_shooter_info(pbp):
@@ -125,15 +75,30 @@ def get_shooter_info(pbp):
     1. Handedness of player
     2. Position of player
 
+    Every shooter is looked up at once. Any that can't be found are printed together at the end.
+
     :param pbp: Play by Play
 
-    :return: list containing list of handedness and positions
+    :return: list containing array of handedness and array of positions
     """
     players = get_player_info()
 
-    pbp_dict = pbp.to_dict("records")
-    shooters_hand = [get_player_handedness(play['p1_ID'], players) for play in pbp_dict]
-    shooters_pos = [get_player_position(play['p1_ID'], players) for play in pbp_dict]
+    shooter_ids = pd.to_numeric(pbp['p1_ID'], errors='coerce')
+    spots = players.locate(shooter_ids)
 
-    return [shooters_hand, shooters_pos]
+    # Could have been added since the players were read in
+    if (spots[shooter_ids.notnull().values] < 0).any():
+        players.refresh(shooter_ids)
+        spots = players.locate(shooter_ids)
+
+    found = spots >= 0
+    shooters_hand = np.full(len(spots), '', dtype=object)
+    shooters_pos = np.full(len(spots), '', dtype=object)
+    shooters_hand[found] = players.hand[spots[found]]
+    shooters_pos[found] = np.where(np.isin(players.position[spots[found]], ["RW", "LW", "C"]), "F", "D")
 
+    missing = shooter_ids[~found & shooter_ids.notnull().values].astype(np.int64).unique()
+    if len(missing) > 0:
+        print("Player ids not found: " + ', '.join(str(player_id) for player_id in sorted(missing)))
+
+    return [shooters_hand, shooters_pos]
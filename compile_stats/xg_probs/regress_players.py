@@ -86,9 +86,10 @@ def get_players():
     :return: dict of players
     """
     players = shared.get_player_info()
+    positions = np.where(np.isin(players.position, ["RW", "LW", "C"]), "F", "D")
 
     players_dict = {}
-    for player_id in players.keys():
+    for player_id, pos in zip(players.ids.astype(str), positions):
         data = {"2007": {"xg": 0, "fen": 0, "goals": 0}, "2008": {"xg": 0, "fen": 0, "goals": 0},
                 "2009": {"xg": 0, "fen": 0, "goals": 0}, "2010": {"xg": 0, "fen": 0, "goals": 0},
                 "2011": {"xg": 0, "fen": 0, "goals": 0}, "2012": {"xg": 0, "fen": 0, "goals": 0},
@@ -96,7 +97,7 @@ def get_players():
                 "2015": {"xg": 0, "fen": 0, "goals": 0}, "2016": {"xg": 0, "fen": 0, "goals": 0},
                 "2017": {"xg": 0, "fen": 0, "goals": 0}
                 }
-        players_dict[player_id] = {"data": data, "pos": players[player_id]["pos"]}
+        players_dict[player_id] = {"data": data, "pos": pos}
 
     return players_dict
 